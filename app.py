@@ -1,320 +1,95 @@
 import os
 import sys
-import re
+import threading
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QLineEdit, QPushButton, 
-                             QProgressBar, QMessageBox)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+                             QProgressBar, QMessageBox, QTableWidget, QTableWidgetItem,
+                             QHeaderView, QAbstractItemView)
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QFont
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from dotenv import load_dotenv
-from tqdm import tqdm
-from ytmusicapi import YTMusic
-from pytube import YouTube
 
-# Cargar variables de entorno
-load_dotenv()
+# Solo módulos propios: spotipy, ytmusicapi, pytube, aiohttp y requests se
+# importan con la primera descarga, así la ventana aparece sin esperarlos
+from download_worker import DownloadWorker
+from job_queue import CANCELLED, DONE, FAILED, JobQueue
+from services import Services
 
 class DownloadThread(QThread):
+    """Adaptador que ejecuta `DownloadWorker` en un hilo de Qt y reenvía sus eventos como señales."""
     progress_update = pyqtSignal(int, int)  # (current, total)
     status_update = pyqtSignal(str)
     download_complete = pyqtSignal(bool, str)  # (success, message)
     
-    def __init__(self, playlist_url, parent=None):
+    def __init__(self, playlist_url, parent=None, concurrent=None, output_dir=None, services=None,
+                 control=None, budget=None):
         super().__init__(parent)
-        self.playlist_url = playlist_url
-        self.is_running = True
-        
+        self.worker = DownloadWorker(
+            playlist_url,
+            concurrent=concurrent,
+            output_dir=output_dir,
+            services=services,
+            control=control,
+            budget=budget,
+            on_progress=self.progress_update.emit,
+            on_status=self.status_update.emit,
+            on_complete=self.download_complete.emit
+        )
+    
+    @property
+    def metrics(self):
+        return self.worker.metrics
+    
     def run(self):
-        try:
-            # Configurar credenciales de Spotify
-            client_id = os.getenv('SPOTIFY_CLIENT_ID')
-            client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
-            
-            if not client_id or not client_secret:
-                self.download_complete.emit(False, "Error: No se encontraron las credenciales de Spotify. Verifica el archivo .env")
-                return
-            
-            # Autenticar con Spotify
-            client_credentials_manager = SpotifyClientCredentials(
-                client_id=client_id, 
-                client_secret=client_secret
-            )
-            sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
-            
-            # Extraer ID de la playlist desde la URL
-            playlist_id = self.extract_playlist_id(self.playlist_url)
-            if not playlist_id:
-                self.download_complete.emit(False, "Error: URL de playlist inválida")
-                return
-            
-            # Obtener información de la playlist
-            self.status_update.emit("Obteniendo información de la playlist...")
-            playlist = sp.playlist(playlist_id)
-            playlist_name = playlist['name']
-            
-            # Crear carpeta para la playlist
-            download_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SpotifyPlaylists", playlist_name)
-            os.makedirs(download_dir, exist_ok=True)
-            self.status_update.emit(f"Directorio de descarga: {download_dir}")
-            
-            # Verificar que el directorio se creó correctamente
-            if not os.path.exists(download_dir):
-                raise Exception(f"No se pudo crear el directorio de descarga: {download_dir}")
-            
-            # Verificar permisos de escritura
-            if not os.access(download_dir, os.W_OK):
-                raise Exception(f"No hay permisos de escritura en el directorio: {download_dir}")
-            
-            # Obtener todas las canciones de la playlist
-            tracks = []
-            results = playlist['tracks']
-            tracks.extend(results['items'])
-            while results['next']:
-                results = sp.next(results)
-                tracks.extend(results['items'])
-            
-            total_tracks = len(tracks)
-            self.status_update.emit(f"Encontradas {total_tracks} canciones en la playlist '{playlist_name}'")
-            
-            # Inicializar YTMusic para búsqueda
-            ytmusic = YTMusic()
-            
-            # Descargar cada canción
-            for i, item in enumerate(tracks):
-                if not self.is_running:
-                    self.download_complete.emit(False, "Descarga cancelada por el usuario")
-                    return
-                    
-                track = item['track']
-                artist = track['artists'][0]['name']
-                song_name = track['name']
-                search_query = f"{song_name} {artist}"
-                
-                self.status_update.emit(f"Buscando: {search_query}")
-                
-                # Buscar en YouTube Music
-                search_results = ytmusic.search(search_query, filter="songs")
-                if not search_results:
-                    self.status_update.emit(f"No se encontró: {search_query}")
-                    continue
-                
-                # Obtener el ID del video de YouTube
-                video_id = search_results[0]['videoId']
-                
-                # Crear URL de YouTube
-                youtube_url = f"https://www.youtube.com/watch?v={video_id}"
-                
-                # Descargar audio usando pytube
-                try:
-                    self.status_update.emit(f"Buscando y descargando: {song_name} - {artist}")
-                    
-                    # Configurar YouTube con opciones para evitar errores comunes
-                    yt = YouTube(
-                        youtube_url,
-                        use_oauth=False,
-                        allow_oauth_cache=False
-                    )
-                    
-                    # Configurar el callback de progreso para actualizar tanto el estado como la barra de progreso
-                    def progress_callback(stream, chunk, bytes_remaining):
-                        file_progress = int((1 - bytes_remaining / stream.filesize) * 100)
-                        self.status_update.emit(f"Descargando {song_name} - {artist}: {file_progress}%")
-                        # Actualizar la barra de progreso general considerando el progreso actual de la canción
-                        total_progress = ((i * 100) + file_progress) / total_tracks
-                        self.progress_update.emit(int(total_progress), 100)
-                        QApplication.processEvents()
-                    
-                    yt.register_on_progress_callback(progress_callback)
-                    
-                    # Verificar que se obtuvo correctamente el objeto YouTube
-                    if not yt:
-                        self.status_update.emit(f"Error: No se pudo obtener información del video para {song_name}")
-                        self.progress_update.emit(i + 1, total_tracks)
-                        continue
-                    
-                    # Obtener el stream de audio con la mejor calidad
-                    audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
-                    
-                    # Verificar que se obtuvo un stream de audio
-                    if not audio_stream:
-                        self.status_update.emit(f"Error: No se encontró stream de audio para {song_name}")
-                        self.progress_update.emit(i + 1, total_tracks)
-                        continue
-                    
-                    # Limpiar el nombre del archivo para evitar caracteres problemáticos
-                    file_name = f"{song_name} - {artist}"
-                    for char in ['/', '\\', '"', '?', ':', '*', '<', '>', '|']:
-                        file_name = file_name.replace(char, '_')
-                    
-                    # Descargar el archivo
-                    self.status_update.emit(f"Descargando: {song_name} - {artist}")
-                    
-                    # Intentar descargar con manejo de errores mejorado
-                    try:
-                        # Crear un nombre de archivo único para evitar conflictos
-                        safe_filename = f"{file_name}"
-                        # Ya no necesitamos un archivo temporal, descargamos directamente como .mp3
-                        mp3_file_path = os.path.join(download_dir, f"{safe_filename}.mp3")
-                        
-                        # Asegurar que el directorio existe y tiene permisos de escritura
-                        if not os.path.exists(download_dir):
-                            os.makedirs(download_dir, exist_ok=True)
-                            self.status_update.emit(f"Creado directorio: {download_dir}")
-                        
-                        # Verificar permisos de escritura antes de intentar descargar
-                        if not os.access(download_dir, os.W_OK):
-                            self.status_update.emit(f"⚠️ Advertencia: No hay permisos de escritura en: {download_dir}")
-                            # Intentar corregir permisos
-                            try:
-                                os.chmod(download_dir, 0o755)
-                                self.status_update.emit(f"Permisos corregidos para: {download_dir}")
-                            except Exception as e:
-                                self.status_update.emit(f"No se pudieron corregir permisos: {str(e)}")
-                        
-                        # Limpiar archivos existentes
-                        if os.path.exists(mp3_file_path):
-                            try:
-                                os.remove(mp3_file_path)
-                                self.status_update.emit(f"Eliminado archivo existente: {mp3_file_path}")
-                            except Exception as e:
-                                self.status_update.emit(f"Error al limpiar archivo existente: {str(e)}")
-                        
-                        # Descargar el archivo directamente como MP3
-                        self.status_update.emit(f"Descargando archivo: {file_name}")
-                        
-                        # Intentar la descarga con reintentos
-                        max_retries = 3
-                        retry_count = 0
-                        download_success = False
-                        
-                        while retry_count < max_retries and not download_success:
-                            try:
-                                temp_file = audio_stream.download(
-                                    output_path=download_dir,
-                                    filename=f"{safe_filename}.mp3",
-                                    skip_existing=False,
-                                    timeout=30  # Agregar timeout
-                                )
-                                
-                                # Verificar permisos de escritura en el directorio
-                                if not os.access(download_dir, os.W_OK):
-                                    raise Exception(f"No hay permisos de escritura en el directorio: {download_dir}")
-                                
-                                # Verificar que el archivo temporal existe y tiene el tamaño correcto
-                                if not os.path.exists(temp_file):
-                                    raise Exception(f"El archivo temporal no se creó: {temp_file}")
-                                
-                                file_size = os.path.getsize(temp_file)
-                                if file_size < 1024:  # Menos de 1KB probablemente es un error
-                                    raise Exception(f"El archivo descargado es demasiado pequeño: {file_size} bytes")
-                                
-                                # Forzar sincronización con el sistema de archivos para asegurar que el archivo se escriba completamente
-                                if hasattr(os, 'fsync'):
-                                    try:
-                                        with open(temp_file, 'rb') as f:
-                                            os.fsync(f.fileno())
-                                    except Exception as e:
-                                        self.status_update.emit(f"No se pudo sincronizar el archivo: {str(e)}")
-                                
-                                self.status_update.emit(f"Archivo temporal creado: {temp_file} ({file_size} bytes)")
-
-                                
-                                # Verificar que el archivo se descargó correctamente
-                                if os.path.exists(temp_file) and os.path.getsize(temp_file) > 0:
-                                    file_size = os.path.getsize(temp_file)
-                                    if file_size > 1024:  # Más de 1KB
-                                        download_success = True
-                                        self.status_update.emit(f"✅ Archivo MP3 descargado como: {temp_file} ({file_size} bytes)")
-                                        # Asegurar que la barra de progreso muestre el 100% para esta canción
-                                        total_progress = ((i + 1) * 100) / total_tracks
-                                        self.progress_update.emit(int(total_progress), 100)
-                                        QApplication.processEvents()
-                                        
-                                        # Verificar que el archivo existe en el directorio
-                                        if os.path.exists(temp_file):
-                                            self.status_update.emit(f"✓ Verificado: Archivo guardado correctamente en {download_dir}")
-                                        else:
-                                            raise Exception(f"Error: No se puede encontrar el archivo en {download_dir}")
-                                    else:
-                                        raise Exception(f"El archivo descargado es demasiado pequeño: {file_size} bytes")
-                                else:
-                                    raise Exception("El archivo descargado está vacío o no existe")
-                                    
-                            except Exception as e:
-                                retry_count += 1
-                                if retry_count < max_retries:
-                                    self.status_update.emit(f"Reintento {retry_count} de {max_retries}: {str(e)}")
-                                else:
-                                    raise Exception(f"Error después de {max_retries} intentos: {str(e)}")
-                        
-                        # Verificar el archivo descargado
-                        try:
-                            # Como ahora descargamos directamente con extensión .mp3, no necesitamos renombrar
-                            # Verificamos que el archivo existe y tiene el tamaño correcto
-                            if not os.path.exists(temp_file):
-                                raise Exception(f"El archivo MP3 no existe: {temp_file}")
-                            
-                            mp3_size = os.path.getsize(temp_file)
-                            if mp3_size < 1024:  # Menos de 1KB probablemente es un error
-                                raise Exception(f"El archivo MP3 es demasiado pequeño: {mp3_size} bytes")
-                            
-                            # Forzar sincronización con el sistema de archivos
-                            os.sync() if hasattr(os, 'sync') else None
-                            
-                            # Mostrar la ruta completa para ayudar al usuario a encontrar el archivo
-                            self.status_update.emit(f"✅ Descargado: {song_name} - {artist} ({mp3_size} bytes) en {download_dir}")
-                            
-                            # Verificar que el archivo realmente existe en el directorio
-                            files_in_dir = os.listdir(download_dir)
-                            if f"{safe_filename}.mp3" in files_in_dir:
-                                self.status_update.emit(f"✓ Verificado: Archivo {safe_filename}.mp3 encontrado en el directorio")
-                            else:
-                                self.status_update.emit(f"⚠️ Advertencia: Archivo {safe_filename}.mp3 no encontrado en el directorio a pesar de descarga exitosa")
-                                
-                        except Exception as e:
-                            raise Exception(f"Error al verificar el archivo: {str(e)}")
+        self.worker.run()
+    
+    def stop(self):
+        self.worker.stop()
 
-                            
-                    except Exception as e:
-                        self.status_update.emit(f"❌ Error al descargar {song_name}: {str(e)}")
-                        # Continuar con la siguiente canción pero actualizar el progreso
-                        self.progress_update.emit(i + 1, total_tracks)
-                except Exception as e:
-                    self.status_update.emit(f"Error al descargar {song_name}: {str(e)}")
-            
-            self.download_complete.emit(True, f"Descarga completada. Las canciones se guardaron en: {download_dir}")
-            
-        except Exception as e:
-            self.download_complete.emit(False, f"Error: {str(e)}")
+class AsyncDownloadThread(QThread):
+    """Adaptador que ejecuta el motor asyncio en un único hilo y reenvía sus eventos como señales."""
+    progress_update = pyqtSignal(int, int)  # (current, total)
+    status_update = pyqtSignal(str)
+    download_complete = pyqtSignal(bool, str)  # (success, message)
     
-    def extract_playlist_id(self, url):
-        # Patrones para diferentes formatos de URL de Spotify
-        patterns = [
-            r'spotify:playlist:([a-zA-Z0-9]+)',  # spotify:playlist:ID
-            r'https://open\.spotify\.com/playlist/([a-zA-Z0-9]+)',  # https://open.spotify.com/playlist/ID
-            r'https://open\.spotify\.com/playlist/([a-zA-Z0-9]+)\?',  # https://open.spotify.com/playlist/ID?si=...
-        ]
+    def __init__(self, playlist_url, parent=None, services=None, control=None, budget=None):
+        super().__init__(parent)
+        # El motor asyncio (y aiohttp) solo se carga si se elige DOWNLOAD_BACKEND=asyncio
+        from async_engine import AsyncDownloadEngine
         
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        return None
+        self.engine = AsyncDownloadEngine(
+            playlist_url,
+            services=services,
+            control=control,
+            budget=budget,
+            on_progress=self.progress_update.emit,
+            on_status=self.status_update.emit,
+            on_complete=self.download_complete.emit
+        )
+    
+    def run(self):
+        self.engine.run_sync()
     
     def stop(self):
-        self.is_running = False
+        self.engine.stop()
 
 class SpotifyDownloaderApp(QMainWindow):
+    # Columnas de la tabla de la cola
+    QUEUE_COLUMNS = ['Playlist', 'Prioridad', 'Estado', 'Progreso']
+    
     def __init__(self):
         super().__init__()
-        self.download_thread = None
+        # Servicios de larga duración: se preparan en segundo plano en cuanto se
+        # empieza a escribir una URL, así ni la ventana ni la primera descarga los esperan
+        self.services = Services()
+        self.warmed_up = False
+        # Cola de playlists: varias descargas a la vez que comparten el presupuesto de transferencias
+        self.queue = JobQueue(self.start_job)
+        self.batch_start = 0
         self.initUI()
     
     def initUI(self):
         self.setWindowTitle('Descargador de Playlists de Spotify')
-        self.setGeometry(300, 300, 600, 300)
+        self.setGeometry(300, 300, 700, 450)
         
         # Widget central
         central_widget = QWidget()
@@ -333,7 +108,7 @@ class SpotifyDownloaderApp(QMainWindow):
         main_layout.addWidget(title_label)
         
         # Descripción
-        desc_label = QLabel('Ingresa el enlace de tu playlist de Spotify para descargar todas las canciones')
+        desc_label = QLabel('Ingresa el enlace de tu playlist de Spotify para añadirla a la cola de descargas')
         desc_label.setAlignment(Qt.AlignCenter)
         main_layout.addWidget(desc_label)
         
@@ -342,22 +117,42 @@ class SpotifyDownloaderApp(QMainWindow):
         url_label = QLabel('URL de la Playlist:')
         self.url_input = QLineEdit()
         self.url_input.setPlaceholderText('https://open.spotify.com/playlist/...')
+        self.url_input.returnPressed.connect(self.start_download)
+        self.url_input.textEdited.connect(self.warm_up)
+        self.download_btn = QPushButton('Añadir a la cola')
+        self.download_btn.clicked.connect(self.start_download)
         url_layout.addWidget(url_label)
         url_layout.addWidget(self.url_input)
+        url_layout.addWidget(self.download_btn)
         main_layout.addLayout(url_layout)
         
-        # Botones
+        # Cola de descargas: una fila por playlist con su progreso
+        self.queue_table = QTableWidget(0, len(self.QUEUE_COLUMNS))
+        self.queue_table.setHorizontalHeaderLabels(self.QUEUE_COLUMNS)
+        self.queue_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.queue_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.queue_table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.queue_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.queue_table.itemSelectionChanged.connect(self.update_buttons)
+        main_layout.addWidget(self.queue_table)
+        
+        # Botones sobre la playlist seleccionada
         button_layout = QHBoxLayout()
-        self.download_btn = QPushButton('Descargar')
-        self.download_btn.clicked.connect(self.start_download)
+        self.pause_btn = QPushButton('Pausar')
+        self.pause_btn.clicked.connect(self.pause_download)
+        self.resume_btn = QPushButton('Reanudar')
+        self.resume_btn.clicked.connect(self.resume_download)
+        self.up_btn = QPushButton('Subir prioridad')
+        self.up_btn.clicked.connect(lambda: self.change_priority(1))
+        self.down_btn = QPushButton('Bajar prioridad')
+        self.down_btn.clicked.connect(lambda: self.change_priority(-1))
         self.cancel_btn = QPushButton('Cancelar')
         self.cancel_btn.clicked.connect(self.cancel_download)
-        self.cancel_btn.setEnabled(False)
-        button_layout.addWidget(self.download_btn)
-        button_layout.addWidget(self.cancel_btn)
+        for button in (self.pause_btn, self.resume_btn, self.up_btn, self.down_btn, self.cancel_btn):
+            button_layout.addWidget(button)
         main_layout.addLayout(button_layout)
         
-        # Barra de progreso
+        # Barra de progreso de toda la cola
         self.progress_bar = QProgressBar()
         self.progress_bar.setRange(0, 100)
         self.progress_bar.setValue(0)
@@ -368,8 +163,17 @@ class SpotifyDownloaderApp(QMainWindow):
         self.status_label.setAlignment(Qt.AlignCenter)
         main_layout.addWidget(self.status_label)
         
-        # Verificar credenciales
-        self.check_credentials()
+        self.update_buttons()
+        
+        # Verificar credenciales cuando la ventana ya está en pantalla
+        QTimer.singleShot(0, self.check_credentials)
+    
+    def warm_up(self):
+        """Crear los clientes y pedir el token de Spotify en segundo plano (una sola vez)."""
+        if self.warmed_up:
+            return
+        self.warmed_up = True
+        threading.Thread(target=self.services.warm_up, name='warm-up', daemon=True).start()
     
     def check_credentials(self):
         client_id = os.getenv('SPOTIFY_CLIENT_ID')
@@ -388,49 +192,152 @@ class SpotifyDownloaderApp(QMainWindow):
             QMessageBox.warning(self, 'Error', 'Por favor ingresa una URL de playlist válida')
             return
         
-        # Deshabilitar botón de descarga y habilitar cancelar
-        self.download_btn.setEnabled(False)
-        self.cancel_btn.setEnabled(True)
-        self.progress_bar.setValue(0)
-        
-        # Iniciar hilo de descarga
-        self.download_thread = DownloadThread(playlist_url)
+        # La entrada queda libre para seguir añadiendo playlists
+        self.warm_up()
+        job = self.queue.add(playlist_url)
+        self.add_row(job)
+        self.url_input.clear()
+        self.queue.dispatch()
+        self.refresh_queue()
+    
+    def start_job(self, job):
+        # Iniciar hilo de descarga (DOWNLOAD_BACKEND=asyncio usa el motor asíncrono)
+        if os.getenv('DOWNLOAD_BACKEND', 'thread').strip().lower() == 'asyncio':
+            thread = AsyncDownloadThread(job.url, services=self.services, control=job, budget=self.queue.budget)
+        else:
+            thread = DownloadThread(job.url, services=self.services, control=job, budget=self.queue.budget)
+        job.worker = thread
         # Conectar señales usando Qt.QueuedConnection para asegurar la actualización correcta
-        self.download_thread.progress_update.connect(self.update_progress, Qt.QueuedConnection)
-        self.download_thread.status_update.connect(self.update_status, Qt.QueuedConnection)
-        self.download_thread.download_complete.connect(self.download_finished, Qt.QueuedConnection)
-        self.download_thread.start()
+        thread.progress_update.connect(
+            lambda current, total, job=job: self.update_progress(job, current, total), Qt.QueuedConnection
+        )
+        thread.status_update.connect(lambda message, job=job: self.update_status(job, message), Qt.QueuedConnection)
+        thread.download_complete.connect(
+            lambda success, message, job=job: self.download_finished(job, success, message), Qt.QueuedConnection
+        )
+        thread.start()
+    
+    def add_row(self, job):
+        row = self.queue_table.rowCount()
+        self.queue_table.insertRow(row)
+        self.queue_table.setItem(row, 0, QTableWidgetItem(job.url))
+        self.queue_table.setItem(row, 1, QTableWidgetItem())
+        self.queue_table.setItem(row, 2, QTableWidgetItem())
+        bar = QProgressBar()
+        bar.setRange(0, 100)
+        self.queue_table.setCellWidget(row, 3, bar)
+        self.queue_table.selectRow(row)
+    
+    def refresh_row(self, job):
+        # Las filas siguen el orden en que se añadieron los trabajos
+        row = self.queue.jobs.index(job)
+        self.queue_table.item(row, 1).setText(str(job.priority))
+        self.queue_table.item(row, 2).setText(job.state)
+        self.queue_table.item(row, 2).setToolTip(job.message)
+        self.queue_table.cellWidget(row, 3).setValue(job.percent)
+    
+    def refresh_queue(self):
+        for job in self.queue.jobs:
+            self.refresh_row(job)
+        self.progress_bar.setValue(self.queue.overall_progress())
+        self.update_buttons()
+    
+    def selected_job(self):
+        row = self.queue_table.currentRow()
+        if 0 <= row < len(self.queue.jobs):
+            return self.queue.jobs[row]
+        return None
+    
+    def update_buttons(self):
+        job = self.selected_job()
+        active = job is not None and not job.finished
+        self.pause_btn.setEnabled(active and not job.paused)
+        self.resume_btn.setEnabled(active and job.paused)
+        self.up_btn.setEnabled(active)
+        self.down_btn.setEnabled(active)
+        self.cancel_btn.setEnabled(active)
+    
+    def pause_download(self):
+        job = self.selected_job()
+        if job is not None:
+            self.queue.pause(job)
+            self.refresh_queue()
+    
+    def resume_download(self):
+        job = self.selected_job()
+        if job is not None:
+            self.queue.resume(job)
+            self.refresh_queue()
+    
+    def change_priority(self, delta):
+        job = self.selected_job()
+        if job is not None:
+            self.queue.set_priority(job, job.priority + delta)
+            self.refresh_queue()
     
     def cancel_download(self):
-        if self.download_thread and self.download_thread.isRunning():
-            self.download_thread.stop()
+        job = self.selected_job()
+        if job is not None and not job.finished:
+            self.queue.cancel(job)
             self.status_label.setText('Cancelando descarga...')
+            self.refresh_queue()
     
-    def update_progress(self, current, total):
+    def update_progress(self, job, current, total):
         try:
             progress = int((current / total) * 100)
             if 0 <= progress <= 100:  # Asegurar que el progreso esté en el rango válido
-                self.progress_bar.setValue(progress)
+                job.percent = progress
+                self.refresh_row(job)
+                self.progress_bar.setValue(self.queue.overall_progress())
         except Exception as e:
             print(f"Error al actualizar progreso: {e}")
     
-    def update_status(self, message):
-        self.status_label.setText(message)
+    def update_status(self, job, message):
+        # El informe llega después del resultado: la fila conserva el mensaje final
+        if not job.finished:
+            job.message = message
+        self.status_label.setText(f"#{job.id}: {message}")
     
-    def download_finished(self, success, message):
-        # Restaurar estado de los botones
-        self.download_btn.setEnabled(True)
-        self.cancel_btn.setEnabled(False)
+    def closeEvent(self, event):
+        # Detener las descargas en curso, guardar las cachés y cerrar las conexiones al salir
+        for job in self.queue.stop_all():
+            if job.worker is not None:
+                job.worker.wait()
+        self.services.close()
+        super().closeEvent(event)
+    
+    def download_finished(self, job, success, message):
+        # Anotar el resultado y arrancar las siguientes playlists de la cola
+        self.queue.finish(job, success, message)
+        self.refresh_queue()
         
         # Mostrar mensaje
-        self.status_label.setText(message)
+        self.status_label.setText(f"#{job.id}: {message}")
         
-        if success:
-            QMessageBox.information(self, 'Descarga Completada', message)
-        else:
-            QMessageBox.warning(self, 'Error', message)
+        if not self.queue.idle():
+            return
+        # Resumen de las playlists terminadas desde que la cola quedó vacía la última vez
+        finished = [j for j in self.queue.jobs[self.batch_start:] if j.state != CANCELLED]
+        self.batch_start = len(self.queue.jobs)
+        if len(finished) == 1:
+            # Una sola playlist: su mensaje, como sin cola
+            if finished[0].state == DONE:
+                QMessageBox.information(self, 'Descarga Completada', finished[0].message)
+            else:
+                QMessageBox.warning(self, 'Error', finished[0].message)
+        elif finished:
+            failed = [j for j in finished if j.state == FAILED]
+            summary = f"{len(finished) - len(failed)} playlists completadas, {len(failed)} con errores"
+            if failed:
+                QMessageBox.warning(self, 'Cola terminada', summary)
+            else:
+                QMessageBox.information(self, 'Cola terminada', summary)
 
 if __name__ == '__main__':
+    from dotenv import load_dotenv
+    
+    # Cargar variables de entorno
+    load_dotenv()
     app = QApplication(sys.argv)
     window = SpotifyDownloaderApp()
     window.show()
@@ -0,0 +1,712 @@
+import asyncio
+import os
+import time
+from itertools import islice
+
+from audio_store import AudioStore
+from concurrency import download_controller, search_controller
+from download_core import extract_playlist_id, make_job, place_copy, safe_file_name
+from http_download import check_download
+from manifest import PlaylistManifest, file_sha256
+from matching import TrackMatcher, candidate_from_ytmusic
+from metrics import RunMetrics
+from progress import ProgressAggregator
+from rate_limit import default_scheduler
+from settings import BASE_DIR, env_bool, env_int
+from spotify_listing import PAGE_SIZE, open_playlist
+from services import Services
+from stream_cache import is_expired_url_error, stream_from_pytube
+from tagging import Tagger
+from transcode import Transcoder, ffmpeg_available
+
+CHUNK_SIZE = 64 * 1024
+
+
+class AsyncDownloadEngine:
+    """Motor de descarga basado en asyncio, sin interfaz gráfica.
+
+    Las transferencias comparten una sesión aiohttp con un pool de conexiones,
+    así cientos de descargas en curso no necesitan un hilo cada una. Cuántas
+    descargas y búsquedas hay en curso lo decide un límite adaptativo
+    (`AIMDController`) a partir del rendimiento y los errores observados. Las llamadas bloqueantes de spotipy,
+    ytmusicapi y pytube se ejecutan en un pool de hilos acotado, la
+    conversión de formato en un pool de procesos mientras siguen las descargas
+    y las etiquetas con la portada del álbum en un pool de etiquetado.
+
+    Acepta una URL o una lista de URLs. Con varias playlists se comparten los
+    clientes, la caché y el pool de conexiones. El audio se guarda una sola vez
+    en el `AudioStore` y cada playlist recibe un enlace, así una canción
+    repetida entre playlists se descarga una sola vez.
+
+    Emite los mismos eventos que `DownloadThread`: `on_progress(current, total)`,
+    `on_status(message)` y `on_complete(success, message)`. El progreso y los
+    mensajes se agrupan y se publican a ritmo fijo (`ProgressAggregator`).
+    """
+
+    def __init__(self, playlist_urls, on_progress=None, on_status=None, on_complete=None,
+                 output_dir=None, max_connections=None, max_per_host=None,
+                 search_concurrency=None, resolve_concurrency=None, report_path=None, services=None,
+                 control=None, budget=None):
+        if isinstance(playlist_urls, str):
+            playlist_urls = [playlist_urls]
+        self.playlist_urls = list(playlist_urls)
+        self.on_complete = on_complete or (lambda success, message: None)
+        # Progreso y mensajes agrupados: se publican a ritmo fijo desde un hilo propio
+        self.progress = ProgressAggregator(on_progress, on_status)
+        self.output_dir = output_dir or os.path.join(BASE_DIR, "SpotifyPlaylists")
+        self.max_connections = max_connections or env_int('ASYNC_MAX_CONNECTIONS', 64)
+        self.max_per_host = max_per_host or env_int('ASYNC_MAX_PER_HOST', 8)
+        self.search_concurrency = search_concurrency or env_int('SEARCH_WORKERS', 4)
+        self.resolve_concurrency = resolve_concurrency or env_int('RESOLVE_WORKERS', 4)
+        # Límites adaptativos de búsquedas y descargas en curso, creados con cada ejecución
+        self.search_limit = None
+        self.download_limit = None
+        self.incremental = env_bool('INCREMENTAL_SYNC', True)
+        self.prune_removed = env_bool('PRUNE_REMOVED')
+        # Planificador común de límites; la vista propia cuenta solo las peticiones de esta ejecución
+        self.scheduler = default_scheduler().scoped()
+        # Clientes y cachés de larga duración (los de la aplicación, o propios si no se indican).
+        # La sesión aiohttp no se comparte: pertenece al bucle de eventos de cada ejecución
+        self.owns_services = services is None
+        self.services = services or Services()
+        # Trabajo de la cola (pausa y prioridad) y presupuesto de transferencias común a la cola
+        self.control = control
+        self.budget = budget
+        self.transcoder = Transcoder()
+        self.tagger = None
+        self.matcher = TrackMatcher()
+        # Informe de la ejecución con los tiempos de cada etapa
+        self.metrics = RunMetrics()
+        self.report_path = report_path
+        self.report_enabled = bool(report_path) or env_bool('RUN_REPORT', True)
+        self.is_running = True
+
+    def stop(self):
+        self.is_running = False
+
+    def run_sync(self):
+        """Ejecutar el motor en un bucle de eventos propio (bloquea hasta terminar)."""
+        asyncio.run(self.run())
+
+    def complete(self, success, message):
+        # Entregar el progreso y los mensajes pendientes antes del resultado
+        self.progress.close()
+        self.on_complete(success, message)
+
+    def set_track_progress(self, job, percent):
+        self.progress.set_track(job['index'], percent)
+
+    async def wait_if_paused(self):
+        """Esperar mientras el trabajo de la cola está en pausa; devuelve False si se canceló."""
+        if self.control is None:
+            return self.is_running
+        return await self.control.wait_if_paused_async(lambda: self.is_running)
+
+    def transfer_allowed(self):
+        # Una pausa corta la transferencia; el .part se reanuda al continuar
+        return self.is_running and not (self.control is not None and self.control.paused)
+
+    async def run(self):
+        playlists = []
+        self.progress.start()
+        try:
+            loop = asyncio.get_running_loop()
+            match_cache = self.services.match_cache()
+            stream_cache = self.services.stream_cache()
+
+            # Cliente de Spotify compartido (el token se reutiliza entre ejecuciones)
+            sp = await loop.run_in_executor(None, self.services.spotify)
+            if sp is None:
+                self.complete(False, "Error: No se encontraron las credenciales de Spotify. Verifica el archivo .env")
+                return
+
+            # Los streams de YouTube son webm/opus o m4a: hace falta ffmpeg para convertirlos
+            if not ffmpeg_available():
+                self.complete(False, "Error: No se encontró ffmpeg. Instálalo para convertir el audio")
+                return
+
+            playlist_ids = []
+            for url in self.playlist_urls:
+                playlist_id = extract_playlist_id(url)
+                if playlist_id:
+                    playlist_ids.append(playlist_id)
+                else:
+                    self.progress.status(f"URL de playlist inválida: {url}")
+            if not playlist_ids:
+                self.complete(False, "Error: URL de playlist inválida")
+                return
+
+            def list_playlist(playlist_id):
+                with self.metrics.stage('listado'):
+                    return open_playlist(sp, playlist_id, scheduler=self.scheduler)
+
+            # Solo la cabecera y la primera página de cada playlist; el resto de
+            # páginas llega mientras ya se descargan las primeras canciones
+            self.progress.status("Obteniendo información de la playlist...")
+            listings = await asyncio.gather(
+                *(loop.run_in_executor(None, list_playlist, playlist_id) for playlist_id in playlist_ids),
+                return_exceptions=True
+            )
+
+            for playlist_id, listing in zip(playlist_ids, listings):
+                if isinstance(listing, Exception):
+                    self.progress.status(f"Error al obtener la playlist {playlist_id}: {str(listing)}")
+                    continue
+                playlist = self.open_playlist(listing)
+                playlists.append(playlist)
+                self.progress.status(f"Encontradas {listing.total} canciones en la playlist '{playlist['name']}'")
+
+            if not playlists:
+                self.complete(False, "Error: No se pudo obtener ninguna playlist")
+                return
+
+            expected = sum(playlist['listing'].total for playlist in playlists)
+            self.progress.reset(expected)
+
+            ytmusic = await loop.run_in_executor(None, self.services.ytmusic)
+            # Etiquetas y portada en su propio pool, con los datos que ya trae el listado
+            self.tagger = Tagger(self.transcoder.format, self.services.art_cache(), self.services.http_session())
+            if self.tagger.enabled and not self.tagger.active:
+                self.progress.status("No se encontró mutagen: las canciones se guardarán sin etiquetas")
+            # Las descargas empiezan con el límite por host y las búsquedas con SEARCH_WORKERS;
+            # a partir de ahí se ajustan según el rendimiento y los errores observados
+            self.search_limit = search_controller(self.search_concurrency, self.limit_changed)
+            # ASYNC_MAX_PER_HOST es un máximo: el límite adaptativo solo se mueve por debajo
+            self.download_limit = download_controller(
+                self.max_per_host, self.limit_changed, ceiling=self.max_per_host
+            )
+
+            context = {
+                'loop': loop,
+                'ytmusic': ytmusic,
+                'match_cache': match_cache,
+                'stream_cache': stream_cache,
+                'store': AudioStore(extension=self.transcoder.extension),
+                'resolve_sem': asyncio.Semaphore(self.resolve_concurrency),
+                # Planificación a medida que llegan las canciones (ver plan_job)
+                'jobs': 0,
+                'expected': expected,
+                'existing': {},
+                'primaries': {},
+                'tasks': set(),
+                'skipped': 0,
+                'repeated': 0,
+            }
+
+            # aiohttp se importa al empezar la descarga, no al importar el motor
+            import aiohttp
+
+            # El límite adaptativo decide cuántas descargas hay en curso; el conector solo pone el techo
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections, limit_per_host=self.max_per_host
+            )
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                context['session'] = session
+                await asyncio.gather(*(self.stream_playlist(playlist, context) for playlist in playlists))
+                if context['skipped'] or context['repeated']:
+                    self.progress.status(
+                        f"{context['skipped']} canciones sin cambios, {context['repeated']} repetidas entre playlists; "
+                        f"{context['jobs'] - context['skipped'] - context['repeated']} por descargar"
+                    )
+                # Las tareas terminadas salen del conjunto; esperar a las que siguen en curso
+                while context['tasks']:
+                    await asyncio.gather(*list(context['tasks']))
+
+            if not self.is_running:
+                self.complete(False, "Descarga cancelada por el usuario")
+                return
+
+            if self.prune_removed:
+                for playlist in playlists:
+                    # Sin el listado completo no se sabe qué canciones se quitaron
+                    if playlist['manifest'] is None or not playlist['complete']:
+                        continue
+                    removed = playlist['manifest'].prune(playlist['keys'])
+                    if removed:
+                        self.progress.status(f"Eliminadas {len(removed)} canciones que ya no están en la playlist '{playlist['name']}'")
+
+            self.progress.status(f"Peticiones: {self.scheduler.summary()}")
+            self.progress.status(f"Concurrencia: {self.search_limit.summary()}; {self.download_limit.summary()}")
+            if self.tagger.active:
+                self.progress.status(f"Etiquetas: {self.services.art_cache().summary()}")
+            target = playlists[0]['download_dir'] if len(playlists) == 1 else self.output_dir
+            self.complete(True, f"Descarga completada. Las canciones se guardaron en: {target}")
+
+        except Exception as e:
+            self.complete(False, f"Error: {str(e)}")
+        finally:
+            # Al cancelar se descartan las conversiones y etiquetados que aún no empezaron
+            self.transcoder.shutdown(wait=self.is_running)
+            if self.tagger is not None:
+                self.tagger.shutdown(wait=self.is_running)
+            if self.owns_services:
+                self.services.close()
+            else:
+                self.services.save()
+            for playlist in playlists:
+                if playlist['manifest'] is not None:
+                    playlist['manifest'].save()
+            self.write_report()
+            self.progress.close()
+
+    def write_report(self):
+        # Informe de la ejecución: tiempos por etapa, bytes, reintentos y fallos por canción.
+        # Si no se llegó a procesar ninguna canción (credenciales, URL...) no se guarda
+        if not self.report_enabled or not self.metrics.track_count:
+            return
+        self.metrics.finish(
+            playlist_urls=self.playlist_urls,
+            cancelled=not self.is_running,
+            requests=self.scheduler.stats(),
+            concurrency=self.concurrency()
+        )
+        try:
+            path = self.metrics.write(self.report_path)
+            self.progress.status(f"Informe de la ejecución: {path}")
+        except Exception as e:
+            self.progress.status(f"No se pudo guardar el informe de la ejecución: {str(e)}")
+
+    def concurrency(self):
+        """Límite actual e historial de los límites adaptativos."""
+        return {
+            limit.name: limit.snapshot()
+            for limit in (self.search_limit, self.download_limit) if limit is not None
+        }
+
+    def limit_changed(self, entry):
+        self.progress.status(
+            f"Concurrencia: {entry['previous']} → {entry['limit']} ({entry['decision']}, "
+            f"{entry['bytes_per_second'] / 1024:.0f} KB/s, {entry['error_rate']:.0%} errores)",
+            transient=True
+        )
+
+    def open_playlist(self, listing):
+        download_dir = os.path.join(self.output_dir, listing.name)
+        os.makedirs(download_dir, exist_ok=True)
+        if not os.access(download_dir, os.W_OK):
+            raise Exception(f"No hay permisos de escritura en el directorio: {download_dir}")
+        self.progress.status(f"Directorio de descarga: {download_dir}")
+        return {
+            'name': listing.name,
+            'listing': listing,
+            'download_dir': download_dir,
+            'manifest': PlaylistManifest(download_dir) if self.incremental else None,
+            'keys': [],
+            'complete': False,
+        }
+
+    async def stream_playlist(self, playlist, context):
+        """Recorrer el listado de la playlist por páginas y lanzar cada canción en cuanto llega."""
+        loop = context['loop']
+        records = iter(playlist['listing'])
+        count = 0
+        try:
+            while self.is_running:
+                # El listado hace peticiones bloqueantes: se avanza en el pool de hilos, una página cada vez
+                page = await loop.run_in_executor(None, lambda: list(islice(records, PAGE_SIZE)))
+                if not page:
+                    playlist['complete'] = True
+                    break
+                jobs = [make_job(context['jobs'] + i, track) for i, track in enumerate(page)]
+                context['jobs'] += len(jobs)
+                count += len(jobs)
+                # Una sola consulta al índice local por página; solo las que falten se buscarán
+                context['match_cache'].preload([(job['track'], job['search_query']) for job in jobs])
+                for job in jobs:
+                    job['playlist'] = playlist
+                    playlist['keys'].append(job['key'])
+                    if self.plan_job(job, context):
+                        task = asyncio.create_task(self.process_track(job, context))
+                        context['tasks'].add(task)
+                        task.add_done_callback(context['tasks'].discard)
+        except Exception as e:
+            self.progress.status(f"Error al obtener las canciones de la playlist '{playlist['name']}': {str(e)}")
+        if playlist['complete']:
+            # El total de Spotify incluye las canciones eliminadas; al terminar se conoce el real
+            context['expected'] -= playlist['listing'].total - count
+            self.progress.set_total(context['expected'])
+        else:
+            # Cancelada o con error: cerrar el listado (descarta la caché a medio escribir)
+            await loop.run_in_executor(None, records.close)
+
+    def plan_job(self, job, context):
+        """Omitir la canción si no cambió y agrupar las repetidas entre playlists.
+
+        Devuelve True si hay que procesarla. Una repetición de una canción que
+        todavía está en curso se añade a la lista `copies` de la principal y
+        recibe el mismo archivo al terminar; si la principal ya terminó, la
+        repetición se procesa sola y la encuentra en la caché y el almacén.
+        """
+        manifest = job['playlist']['manifest']
+        if manifest is not None:
+            video_id = context['match_cache'].get(job['track'], job['search_query'])
+            if manifest.is_current(job['key'], video_id, self.transcoder.extension):
+                self.metrics.skip(job, 'sin_cambios')
+                # Un archivo intacto en cualquier playlist sirve de origen para las demás
+                context['existing'].setdefault(job['key'], manifest.path_for(job['key']))
+                self.set_track_progress(job, 100)
+                context['skipped'] += 1
+                return False
+
+        primary = context['primaries'].get(job['key'])
+        if primary is not None:
+            primary['copies'].append(job)
+            context['repeated'] += 1
+            return False
+
+        job['copies'] = []
+        job['source'] = context['existing'].get(job['key'])
+        context['primaries'][job['key']] = job
+        return True
+
+    def release(self, job, context):
+        # A partir de aquí la lista de copias ya no se amplía
+        if context['primaries'].get(job['key']) is job:
+            del context['primaries'][job['key']]
+
+    def track_failed(self, job, error, stage):
+        self.metrics.fail(stage, job, error)
+        self.progress.status(f"❌ Error al descargar {job['song_name']}: {str(error)}")
+        for target in [job] + job['copies']:
+            self.set_track_progress(target, 100)
+
+    async def process_track(self, job, context):
+        if not await self.wait_if_paused():
+            return
+        stage = 'busqueda'
+        try:
+            # Ya existe en otra playlist: solo hay que colocarla, sin tráfico de red
+            if job['source']:
+                job['video_id'] = None
+                self.metrics.skip(job, 'reutilizada')
+                await self.finish_track(job, context, job['source'])
+                return
+            if not await self.search_track(job, context) or not await self.wait_if_paused():
+                return
+            # El audio ya está en el almacén: no hace falta resolver ni descargar. Si otra
+            # canción está descargando el mismo video, se espera a que termine y se enlaza
+            reserved = await context['store'].reserve_async(job['video_id'], lambda: self.is_running)
+            if reserved is None:
+                return
+            if not reserved:
+                self.metrics.skip(job, 'reutilizada')
+                await self.finish_track(job, context, context['store'].path_for(job['video_id']), reused=True)
+                return
+            job['reserved'] = True
+            stage = 'resolucion'
+            if not await self.resolve_stream(job, context) or not await self.wait_if_paused():
+                return
+            stage = 'descarga'
+            if await self.download_track(job, context):
+                stage = 'conversion'
+                await self.convert_track(job, context)
+        except Exception as e:
+            self.track_failed(job, e, stage)
+        finally:
+            self.release(job, context)
+            # Con el archivo en el almacén (o sin él, si falló) el video pasa a quien lo espera
+            if job.pop('reserved', False):
+                context['store'].release(job['video_id'])
+
+    async def search_track(self, job, context):
+        search_query = job['search_query']
+        track = job['track']
+        match_cache = context['match_cache']
+
+        # Índice local por ID de Spotify, ISRC o búsqueda (ya consultado por página en stream_playlist)
+        video_id = match_cache.get(track, search_query)
+        if not video_id:
+            # Hueco del límite adaptativo de búsquedas en curso
+            if not await self.search_limit.acquire_async(lambda: self.is_running):
+                return False
+            self.progress.status(f"Buscando: {search_query}")
+            started = time.monotonic()
+            try:
+                with self.metrics.stage('busqueda', job):
+                    search_results = await context['loop'].run_in_executor(
+                        None,
+                        lambda: self.scheduler.call(
+                            'ytmusic', context['ytmusic'].search, search_query, filter="songs",
+                            observer=self.search_limit.scheduler_error,
+                            keep_waiting=lambda: self.is_running
+                        )
+                    )
+            except Exception:
+                self.search_limit.record(error=True)
+                raise
+            finally:
+                self.search_limit.release()
+            self.search_limit.record(time.monotonic() - started)
+            if not search_results:
+                self.metrics.skip(job, 'no_encontrada')
+                self.progress.status(f"No se encontró: {search_query}")
+                for target in [job] + job['copies']:
+                    self.set_track_progress(target, 100)
+                return False
+            # Elegir el resultado que corresponde a la canción antes de descargar nada
+            match, score = self.matcher.select(track, [candidate_from_ytmusic(r) for r in search_results])
+            if match is None:
+                self.metrics.skip(job, 'sin_coincidencia')
+                self.progress.status(f"Ninguna coincidencia fiable para: {search_query} (mejor puntuación {score})")
+                for target in [job] + job['copies']:
+                    self.set_track_progress(target, 100)
+                return False
+            video_id = match['video_id']
+            match_cache.put(track, search_query, video_id, match, score)
+
+        job['video_id'] = video_id
+        return True
+
+    async def resolve_stream(self, job, context):
+        # Reutilizar el stream ya resuelto (reintentos, repeticiones, ejecuciones anteriores)
+        stream = context['stream_cache'].get(job['video_id'])
+        if stream is None:
+            stream = await self.extract_stream(job, context)
+
+        if not stream:
+            self.metrics.skip(job, 'sin_stream')
+            self.progress.status(f"Error: No se encontró stream de audio para {job['song_name']}")
+            for target in [job] + job['copies']:
+                self.set_track_progress(target, 100)
+            return False
+
+        self.use_stream(job, stream)
+        return True
+
+    async def extract_stream(self, job, context):
+        """Resolver con pytube el stream de audio de mejor calidad y guardarlo en la caché."""
+        youtube_url = f"https://www.youtube.com/watch?v={job['video_id']}"
+
+        def resolve():
+            # pytube se importa con la primera canción que hay que resolver, no al arrancar
+            from pytube import YouTube
+
+            yt = YouTube(youtube_url, use_oauth=False, allow_oauth_cache=False)
+            audio_stream = yt.streams.filter(only_audio=True).order_by('abr').desc().first()
+            return stream_from_pytube(audio_stream) if audio_stream else None
+
+        async with context['resolve_sem']:
+            with self.metrics.stage('resolucion', job):
+                stream = await context['loop'].run_in_executor(
+                    None, lambda: self.scheduler.call('youtube', resolve, keep_waiting=lambda: self.is_running)
+                )
+        if stream:
+            context['stream_cache'].put(job['video_id'], stream)
+        return stream
+
+    def use_stream(self, job, stream):
+        job['itag'] = stream['itag']
+        job['stream_url'] = stream['url']
+        job['filesize'] = stream['filesize']
+        job['source_extension'] = stream['extension']
+        job['source_codec'] = stream['codec']
+        job['source_bitrate'] = stream['bitrate']
+
+    async def download_track(self, job, context):
+        """Descargar el audio original; devuelve False si se canceló."""
+        # El original se descarga con su extensión real y se convierte después al formato del almacén
+        temp_path = job['source_path'] = context['store'].source_path(job['video_id'], job['source_extension'])
+
+        def part_size():
+            return os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
+
+        max_retries = 3
+        retry_count = 0
+        while True:
+            if not await self.wait_if_paused():
+                return False
+            # Hueco del límite adaptativo y, después, del presupuesto común de la cola (por prioridad)
+            if not await self.download_limit.acquire_async(lambda: self.is_running):
+                return False
+            if self.budget is not None and not await self.budget.acquire_async(self.control, lambda: self.is_running):
+                self.download_limit.release()
+                return False
+            start_size = part_size()
+            started = time.monotonic()
+            try:
+                with self.metrics.stage('descarga', job) as span:
+                    try:
+                        size = await self.scheduler.acall(
+                            'download', self.fetch_to_file, job, context['session'], temp_path,
+                            observer=self.download_limit.scheduler_error,
+                            keep_waiting=lambda: self.is_running
+                        )
+                    finally:
+                        # Bytes recibidos en este intento, aunque termine en un corte
+                        span['bytes'] = max(0, part_size() - start_size)
+                if size is None:
+                    if self.is_running:
+                        # En pausa: se libera el hueco y se continúa al reanudar
+                        continue
+                    return False
+                try:
+                    # Única verificación del original: el tamaño contado durante la descarga;
+                    # el hash se calcula sobre el archivo convertido
+                    with self.metrics.stage('verificacion', job):
+                        check_download(size, job.get('filesize'))
+                except Exception:
+                    # Un archivo completo pero inválido no se reanuda
+                    os.remove(temp_path)
+                    raise
+                self.download_limit.record(time.monotonic() - started)
+                break
+            except Exception as e:
+                # Cada intento fallido cuenta para el límite adaptativo, también los cortes que se reanudan
+                self.download_limit.record(error=True)
+                # Los cortes que avanzaron se reanudan sin gastar un reintento
+                if part_size() > start_size:
+                    self.metrics.retry('descarga', job, e)
+                    continue
+                retry_count += 1
+                if retry_count == max_retries:
+                    raise Exception(f"Error después de {max_retries} intentos: {str(e)}")
+                self.metrics.retry('descarga', job, e)
+                self.progress.status(f"Reintento {retry_count} de {max_retries}: {str(e)}")
+                # URL caducada o rechazada: resolver el stream de nuevo para el reintento
+                if is_expired_url_error(e):
+                    context['stream_cache'].invalidate(job['video_id'])
+                    stream = await self.extract_stream(job, context)
+                    if not stream:
+                        raise Exception(f"No se encontró stream de audio para {job['song_name']}")
+                    if stream['itag'] != job['itag']:
+                        # Otro formato: lo descargado del anterior no sirve
+                        if os.path.exists(temp_path):
+                            os.remove(temp_path)
+                        temp_path = job['source_path'] = context['store'].source_path(job['video_id'], stream['extension'])
+                    self.use_stream(job, stream)
+                    continue
+                await asyncio.sleep(retry_count)
+            finally:
+                if self.budget is not None:
+                    self.budget.release()
+                self.download_limit.release()
+        return True
+
+    async def convert_track(self, job, context):
+        song_name = job['song_name']
+        artist = job['artist']
+        # La conversión se hace en otro proceso; el bucle sigue atendiendo las demás descargas.
+        # El archivo convertido llega al almacén con un fsync y un rename atómico
+        self.progress.status(f"Convirtiendo: {song_name} - {artist}")
+        stored_path = context['store'].path_for(job['video_id'])
+        staging_path = self.tagger.staging_path(stored_path, job['track'])
+        future = self.transcoder.submit(
+            job['source_path'], staging_path, source_codec=job['source_codec'], source_bitrate=job['source_bitrate'],
+            final=staging_path == stored_path
+        )
+        # Las etiquetas se escriben en su pool en cuanto termina la conversión; después el
+        # archivo entra en el almacén, así ninguna playlist lo enlaza sin ellas
+        tagging = self.tagger.submit(staging_path, job['track'], after=future, destination=stored_path)
+        conversion = await asyncio.wrap_future(future)
+        self.metrics.record('conversion', conversion['seconds'], job)
+        os.remove(job['source_path'])
+        if tagging is not None:
+            try:
+                tagged = await asyncio.wrap_future(tagging)
+            except Exception as e:
+                self.progress.status(f"No se pudieron escribir las etiquetas de {song_name}: {str(e)}")
+            else:
+                self.metrics.record('etiquetas', tagged['seconds'], job)
+                conversion = dict(conversion, size=tagged['size'], sha256=tagged['sha256'])
+        mode = "sin recodificar" if conversion['mode'] == 'copy' else "convertido"
+        self.progress.status(f"✅ Descargado: {song_name} - {artist} ({conversion['size']} bytes, {mode})")
+        await self.finish_track(job, context, stored_path, conversion['size'], conversion['sha256'])
+
+    async def finish_track(self, job, context, source_path, size=None, sha256=None, reused=False):
+        """Colocar el archivo en cada playlist que contiene la canción y registrarlo.
+
+        Con `reused`, el audio ya estaba en el almacén y puede llevar las
+        etiquetas de otra canción con el mismo video: se coloca con `place_track`.
+        """
+        self.release(job, context)
+        loop = context['loop']
+        placed = []
+        for target in [job] + job['copies']:
+            file_name = safe_file_name(target['song_name'], target['artist'])
+            path = os.path.join(target['playlist']['download_dir'], f"{file_name}.{self.transcoder.extension}")
+            tagged = None
+            if reused:
+                tagged = await loop.run_in_executor(None, self.place_track, target, context['store'], job['video_id'], path)
+            elif job['video_id']:
+                await loop.run_in_executor(None, context['store'].link, job['video_id'], path)
+            else:
+                # Canción descargada antes de existir el almacén: se reutiliza su archivo
+                await loop.run_in_executor(None, place_copy, source_path, path)
+            placed.append((target, path, tagged))
+
+        # Después de colocar: un archivo del almacén sin etiquetas se acaba de etiquetar en su sitio
+        if size is None:
+            size = os.path.getsize(source_path)
+        if sha256 is None and self.incremental:
+            # Audio reutilizado sin descarga: el hash se calcula una vez fuera del bucle
+            sha256 = await loop.run_in_executor(None, file_sha256, source_path)
+
+        for target, path, tagged in placed:
+            manifest = target['playlist']['manifest']
+            if manifest is not None:
+                video_id = job['video_id'] or context['match_cache'].get(target['track'], target['search_query'])
+                if tagged is None:
+                    manifest.record(target['key'], video_id, path, size, sha256)
+                else:
+                    # Copia con sus propias etiquetas
+                    manifest.record(target['key'], video_id, path, tagged['size'], tagged['sha256'])
+            self.set_track_progress(target, 100)
+
+    def place_track(self, job, store, video_id, path):
+        """Colocar el audio del almacén con las etiquetas de la canción; si fallan, se enlaza sin ellas.
+
+        Devuelve el resultado del etiquetado, o None si solo se enlazó.
+        """
+        try:
+            tagged = self.tagger.place(store, video_id, job['track'], path)
+        except Exception as e:
+            self.progress.status(f"No se pudieron escribir las etiquetas de {job['song_name']}: {str(e)}")
+            store.link(video_id, path)
+            return None
+        if tagged is not None:
+            self.metrics.record('etiquetas', tagged['seconds'], job)
+        return tagged
+
+    async def fetch_to_file(self, job, session, path):
+        """Descargar el stream en el archivo `.part`, continuando con Range desde lo ya escrito.
+
+        Devuelve el tamaño final, o None si se canceló (el `.part` se conserva).
+        """
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+
+        total = job.get('filesize')
+        if total and offset >= total:
+            return offset
+
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        async with session.get(job['stream_url'], headers=headers) as response:
+            if response.status == 416 and offset:
+                return offset
+            response.raise_for_status()
+            if offset and response.status != 206:
+                # El servidor ignoró el Range: empezar de cero
+                offset = 0
+            if not total and response.content_length is not None:
+                total = offset + response.content_length
+            with open(path, 'ab' if offset else 'wb') as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if not self.transfer_allowed():
+                        return None
+                    f.write(chunk)
+                    offset += len(chunk)
+                    self.download_limit.transferred(len(chunk))
+                    if self.budget is not None:
+                        # Esperar si la cola en conjunto va por encima del límite de ancho de banda
+                        wait = self.budget.throttle(len(chunk))
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                    if total:
+                        # La descarga cuenta hasta el 90% de la canción; el resto es la conversión
+                        self.set_track_progress(job, int(offset * 90 / total))
+
+        if total and offset < total:
+            import aiohttp
+
+            raise aiohttp.ClientPayloadError(f"Conexión cerrada tras {offset} de {total} bytes")
+        return offset
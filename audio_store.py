@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from download_core import place_copy
+from settings import BASE_DIR
+
+DEFAULT_ROOT = os.path.join(BASE_DIR, 'AudioStore')
+LINK_MODES = ('hardlink', 'symlink', 'copy')
+
+# Cada cuánto vuelven a mirar la cancelación quienes esperan la descarga de otro trabajo
+POLL_INTERVAL = 0.2
+
+# Videos que se están descargando en todo el proceso (todas las playlists y
+# trabajos de la cola): ruta del almacén -> Future que se completa al liberarla
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+class AudioStore:
+    """Almacén de audio direccionado por el ID del video de YouTube.
+
+    Guarda una sola copia de cada canción en `<root>/<xx>/<video_id>.<ext>`; las
+    carpetas de las playlists contienen enlaces a esos archivos. Así el espacio
+    y las descargas crecen con las canciones únicas, no con las entradas de
+    todas las playlists.
+
+    Dos canciones de Spotify distintas pueden llevar al mismo video (un single
+    y su versión del álbum con el mismo ISRC): antes de descargar, cada trabajo
+    reserva el video con `reserve()`. Solo uno lo descarga y convierte sobre
+    los `.part` del video; los demás esperan a que lo libere con `release()` y
+    enlazan el archivo ya terminado.
+    """
+
+    def __init__(self, root=None, link_mode=None, extension='mp3'):
+        self.root = root or os.getenv('AUDIO_STORE_DIR') or DEFAULT_ROOT
+        self.link_mode = (link_mode or os.getenv('AUDIO_STORE_LINK') or 'hardlink').strip().lower()
+        if self.link_mode not in LINK_MODES:
+            raise ValueError(f"Modo de enlace no válido: {self.link_mode} (usa {', '.join(LINK_MODES)})")
+        self.extension = extension
+        # Reservas de esta instancia, para liberarlas todas al terminar (`release_all()`)
+        self._claimed = set()
+        os.makedirs(self.root, exist_ok=True)
+
+    def shard_dir(self, video_id):
+        # Subcarpetas por prefijo para no acumular miles de archivos en un directorio
+        return os.path.join(self.root, video_id[:2].lower() or '_')
+
+    def path_for(self, video_id):
+        return os.path.join(self.shard_dir(video_id), f"{video_id}.{self.extension}")
+
+    def get(self, video_id):
+        """Ruta del audio guardado para el video, o None si todavía no se descargó."""
+        path = self.path_for(video_id)
+        return path if os.path.exists(path) else None
+
+    def _claim(self, video_id):
+        """Reservar el video; devuelve None si se consiguió o el Future de quien ya lo tiene."""
+        path = self.path_for(video_id)
+        with _in_flight_lock:
+            pending = _in_flight.get(path)
+            if pending is not None:
+                return pending
+            _in_flight[path] = Future()
+            self._claimed.add(path)
+        return None
+
+    def _claimed_or_stored(self, video_id):
+        # Con la reserva tomada: si el audio ya está, no hace falta descargarlo
+        if self.get(video_id):
+            self.release(video_id)
+            return False
+        return True
+
+    def reserve(self, video_id, is_running=None):
+        """Reservar la descarga del video o esperar a que termine la de otro trabajo.
+
+        Devuelve True si la descarga queda a cargo de quien llama (que debe
+        llamar a `release()` al terminar, haya ido bien o no), False si el audio
+        ya está en el almacén y None si se canceló mientras esperaba.
+        """
+        is_running = is_running or (lambda: True)
+        while True:
+            pending = self._claim(video_id)
+            if pending is None:
+                return self._claimed_or_stored(video_id)
+            while not pending.done():
+                if not is_running():
+                    return None
+                time.sleep(POLL_INTERVAL)
+
+    async def reserve_async(self, video_id, is_running=None):
+        """Versión de `reserve` para el motor asyncio (no bloquea el bucle)."""
+        import asyncio
+
+        is_running = is_running or (lambda: True)
+        while True:
+            pending = self._claim(video_id)
+            if pending is None:
+                return self._claimed_or_stored(video_id)
+            while not pending.done():
+                if not is_running():
+                    return None
+                await asyncio.sleep(POLL_INTERVAL)
+
+    def release(self, video_id):
+        """Liberar la reserva del video (si es de esta instancia) y despertar a quien la espera."""
+        self._release_path(self.path_for(video_id))
+
+    def release_all(self):
+        """Liberar las reservas que queden (descarga cancelada o con error)."""
+        for path in list(self._claimed):
+            self._release_path(path)
+
+    def _release_path(self, path):
+        with _in_flight_lock:
+            if path not in self._claimed:
+                return
+            self._claimed.discard(path)
+            pending = _in_flight.pop(path)
+        # Quien espera vuelve a mirar el almacén: si el archivo no llegó, lo descarga él
+        pending.set_result(os.path.exists(path))
+
+    def source_path(self, video_id, extension):
+        """Ruta temporal del audio original, que se descarga aquí y se convierte al formato del almacén."""
+        os.makedirs(self.shard_dir(video_id), exist_ok=True)
+        return os.path.join(self.shard_dir(video_id), f"{video_id}.source.{extension}.part")
+
+    def link(self, video_id, destination):
+        """Colocar el audio del almacén en la ruta de la playlist según el modo de enlace."""
+        source = self.path_for(video_id)
+        if self.link_mode == 'symlink':
+            if os.path.lexists(destination):
+                os.remove(destination)
+            os.symlink(os.path.relpath(source, os.path.dirname(destination)), destination)
+        elif self.link_mode == 'copy':
+            place_copy(source, destination, hardlink=False)
+        else:
+            place_copy(source, destination)
+        return destination
@@ -0,0 +1,584 @@
+"""Benchmark sin conexión del descargador de playlists.
+
+Uso:
+    python benchmark.py
+    python benchmark.py --sizes 10,1000 --backends asyncio,thread-concurrent
+    python benchmark.py --error-rate 0.05 --bandwidth 2000000 --output bench.json
+    python benchmark.py --link-bandwidth 4000000 --max-streams 6 --track-size 1000000
+
+Sustituye Spotify (con paginación), YouTube Music, la resolución de streams
+de YouTube y el servidor de medios por dobles locales con latencia, ancho de
+banda (por conexión o compartido entre todas, como un enlace lento), tasa de
+errores y un máximo de transferencias simultáneas por encima del cual el
+servidor responde 429. Para cada motor y tamaño de playlist mide las
+canciones por minuto, la memoria máxima, el tiempo de CPU, hasta dónde llevó
+el límite adaptativo las búsquedas y descargas en curso y cuántas portadas
+de álbum se descargaron para etiquetar (una por álbum). Cada
+escenario se ejecuta en un proceso aparte para que las mediciones no se
+mezclen; el servidor de medios corre en el proceso principal.
+
+Motores:
+    thread             DownloadWorker (el motor de DownloadThread) en modo secuencial
+    thread-concurrent  DownloadWorker con las etapas en paralelo
+    asyncio            AsyncDownloadEngine (el mismo que usa cli.py)
+    script             download_playlist de test_download.py
+
+La conversión real con ffmpeg se sustituye por una copia del archivo en el
+mismo pool de procesos, así se mide el coste del pool sin depender de ffmpeg.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BACKENDS = ('thread', 'thread-concurrent', 'asyncio', 'script')
+PLAYLIST_ID = 'benchmark'
+PLAYLIST_NAME = 'Benchmark'
+PAGE_SIZE = 100
+SEND_CHUNK = 16 * 1024
+# Canciones por álbum y bytes de cada portada
+ALBUM_TRACKS = 10
+ART_SIZE = 64 * 1024
+
+# Configuración del escenario en el proceso hijo (la usan los dobles)
+CONFIG = {}
+
+
+# --- Servidor de medios ---------------------------------------------------
+
+def media_bytes(video_id, size):
+    """Contenido determinista de cada video, para que las reanudaciones con Range cuadren."""
+    seed = hashlib.sha256(video_id.encode()).digest()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """CDN de audio falsa con latencia, ancho de banda por conexión y compartido, errores 503, 429 y cortes."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        config = self.server.config
+        time.sleep(config['latency'])
+        video_id = self.path.rstrip('/').rsplit('/', 1)[-1]
+        size = config['track_size']
+        if self.path.startswith('/art/'):
+            self.send_art(video_id)
+            return
+
+        start = 0
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+        if start >= size:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        # Con más transferencias en curso de las admitidas el servidor limita, como un CDN real
+        server = self.server
+        with server.lock:
+            busy = config['max_streams'] and server.active >= config['max_streams']
+            if not busy:
+                server.active += 1
+        if busy:
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            self.send_media(video_id, size, start, match)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def send_art(self, album_id):
+        body = media_bytes(album_id, ART_SIZE)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_media(self, video_id, size, start, match):
+        config = self.server.config
+        # La mitad de los errores son 503 y la otra mitad cortes a mitad de transferencia
+        roll = random.random()
+        if roll < config['error_rate'] / 2:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        drop = roll < config['error_rate']
+
+        body = media_bytes(video_id, size)[start:]
+        self.send_response(206 if match else 200)
+        if match:
+            self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        self.send_header('Content-Type', 'audio/webm')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        limit = len(body) // 2 if drop else len(body)
+        try:
+            for offset in range(0, limit, SEND_CHUNK):
+                chunk = body[offset:min(offset + SEND_CHUNK, limit)]
+                self.wfile.write(chunk)
+                if config['bandwidth']:
+                    time.sleep(len(chunk) / config['bandwidth'])
+                if self.server.link is not None:
+                    # Enlace compartido: todas las conexiones se reparten el mismo ancho de banda
+                    wait = self.server.link.reserve(len(chunk))
+                    if wait > 0:
+                        time.sleep(wait)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        if drop:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_media_server(config):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.lock = threading.Lock()
+    server.active = 0
+    server.link = None
+    if config['link_bandwidth']:
+        from rate_limit import TokenBucket
+
+        # Ráfaga de un bloque: el ancho de banda del enlace se reparte desde el primer byte
+        server.link = TokenBucket(config['link_bandwidth'], SEND_CHUNK)
+    threading.Thread(target=server.serve_forever, name='media', daemon=True).start()
+    return server
+
+
+# --- Dobles de Spotify, YouTube Music, pytube y yt-dlp -----------------------
+
+def fake_track(index):
+    album = index // ALBUM_TRACKS
+    return {'track': {
+        'id': f'bench{index:06d}',
+        'name': f'Track {index}',
+        'duration_ms': 180000 + index % 60000,
+        'track_number': index % ALBUM_TRACKS + 1,
+        'disc_number': 1,
+        'external_ids': {'isrc': f'XXBEN{index:07d}'},
+        'artists': [{'name': f'Artist {index % 500}'}],
+        'album': {
+            'id': f'album{album:05d}',
+            'name': f'Album {album}',
+            'release_date': '2024-01-01',
+            'total_tracks': ALBUM_TRACKS,
+            'artists': [{'name': f'Artist {index % 500}'}],
+            'images': [{'url': f"{CONFIG['media_url']}/art/album{album:05d}", 'width': 640, 'height': 640}],
+        },
+    }}
+
+
+def video_id_for(query):
+    return 'v' + hashlib.sha1(query.lower().encode()).hexdigest()[:10]
+
+
+def search_results(query):
+    """Resultados de búsqueda: primero una versión en directo (más larga) y después la canción."""
+    match = re.match(r'Track (\d+) ', query)
+    index = int(match.group(1)) if match else 0
+    track = fake_track(index)['track']
+    seconds = track['duration_ms'] // 1000
+    artist = track['artists'][0]['name']
+    return [
+        {'id': video_id_for(query + ' live'), 'title': f"{track['name']} (Live)", 'artist': artist, 'duration': seconds + 45},
+        {'id': video_id_for(query), 'title': track['name'], 'artist': artist, 'duration': seconds},
+    ]
+
+
+class FakeSpotify:
+    """Paginación de `playlist` y `playlist_items` como la API de Spotify."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def playlist(self, playlist_id, fields=None, **kwargs):
+        time.sleep(CONFIG['api_latency'])
+        total = CONFIG['tracks']
+        return {
+            'name': PLAYLIST_NAME,
+            'snapshot_id': f"snapshot-{total}",
+            'tracks': {'total': total, 'items': [fake_track(i) for i in range(min(PAGE_SIZE, total))]},
+        }
+
+    def playlist_items(self, playlist_id, fields=None, limit=PAGE_SIZE, offset=0, **kwargs):
+        time.sleep(CONFIG['api_latency'])
+        end = min(offset + limit, CONFIG['tracks'])
+        return {'items': [fake_track(i) for i in range(offset, end)]}
+
+
+class FakeYTMusic:
+    def search(self, query, filter=None):
+        time.sleep(CONFIG['api_latency'])
+        return [
+            {'videoId': result['id'], 'title': result['title'], 'artists': [{'name': result['artist']}],
+             'duration_seconds': result['duration']}
+            for result in search_results(query)
+        ]
+
+
+class FakeStream:
+    itag = 251
+    mime_type = 'audio/webm'
+    subtype = 'webm'
+    audio_codec = 'opus'
+    abr = '160kbps'
+
+    def __init__(self, video_id):
+        self.url = f"{CONFIG['media_url']}/media/{video_id}"
+        self.filesize = CONFIG['track_size']
+
+
+class FakeYouTube:
+    """Lo mínimo de `pytube.YouTube` que usan los motores: `streams.filter(...).order_by(...).desc().first()`."""
+
+    def __init__(self, url, **kwargs):
+        self.video_id = url.split('v=')[-1]
+        self.streams = self
+
+    def filter(self, **kwargs):
+        return self
+
+    def order_by(self, attribute):
+        return self
+
+    def desc(self):
+        return self
+
+    def first(self):
+        time.sleep(CONFIG['api_latency'])
+        return FakeStream(self.video_id)
+
+
+class FakeYoutubeDL:
+    """Doble de `yt_dlp.YoutubeDL` para `download_playlist`: búsqueda y resolución del stream local."""
+
+    def __init__(self, options=None):
+        self.options = options or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False):
+        time.sleep(CONFIG['api_latency'])
+        if url.startswith('ytsearch'):
+            results = search_results(url.split(':', 1)[1])
+            return {'entries': [{'id': r['id'], 'title': r['title'], 'channel': r['artist'], 'duration': r['duration']}
+                                for r in results]}
+        stream = FakeStream(url.split('v=')[-1])
+        return {'id': url.split('v=')[-1], 'format_id': str(stream.itag), 'url': stream.url,
+                'filesize': stream.filesize, 'ext': 'webm', 'acodec': 'opus', 'abr': 160}
+
+
+def bench_transcode(source, destination, fmt='mp3', bitrate=192, source_codec=None, passthrough=True, final=True):
+    """Sustituto de `transcode.transcode_file`: copia el archivo y calcula su hash en el pool."""
+    from manifest import file_sha256
+
+    start = time.monotonic()
+    temp_path = destination + '.part'
+    shutil.copyfile(source, temp_path)
+    sha256 = file_sha256(temp_path) if final else None
+    os.replace(temp_path, destination)
+    return {'mode': 'copy', 'size': os.path.getsize(destination), 'sha256': sha256,
+            'seconds': time.monotonic() - start}
+
+
+def install_fakes(backend):
+    """Sustituir los servicios externos en los módulos que usa el motor elegido."""
+    import match_cache
+    import spotify_listing
+    import stream_cache
+    import tagging
+    import transcode
+
+    workdir = CONFIG['workdir']
+    spotify_listing.DEFAULT_CACHE_DIR = os.path.join(workdir, 'cache', 'playlists')
+    match_cache.DEFAULT_PATH = os.path.join(workdir, 'cache', 'matches.sqlite3')
+    stream_cache.DEFAULT_PATH = os.path.join(workdir, 'cache', 'streams.sqlite3')
+    tagging.DEFAULT_ART_DIR = os.path.join(workdir, 'cache', 'art')
+    transcode.transcode_file = bench_transcode
+
+    if backend == 'script':
+        import spotipy
+        import yt_dlp
+        spotipy.Spotify = FakeSpotify
+        yt_dlp.YoutubeDL = FakeYoutubeDL
+        return
+
+    # pytube y ytmusicapi se importan al usarlos: se sustituyen en su propio módulo
+    import pytube
+    import services
+    import ytmusicapi
+    services.TOKEN_CACHE_PATH = os.path.join(workdir, 'cache', 'spotify-token.json')
+    services.create_spotify_client = FakeSpotify
+    ytmusicapi.YTMusic = FakeYTMusic
+    pytube.YouTube = FakeYouTube
+    if backend == 'asyncio':
+        import async_engine as module
+    else:
+        import download_worker as module
+    module.ffmpeg_available = lambda: True
+
+
+# --- Ejecución de un escenario (proceso hijo) --------------------------------
+
+def _stage_summary(metrics):
+    stages = metrics.summary()['stages']
+    return {name: {'count': s['count'], 'mean': s['mean'], 'p90': s['p90']} for name, s in stages.items()}
+
+
+def _art_summary(engine):
+    art_cache = engine.services.art_cache()
+    return {'fetched': art_cache.fetched, 'reused': art_cache.reused}
+
+
+def _concurrency_summary(engine):
+    """Límite final, extremos y decisiones de cada límite adaptativo del motor."""
+    summary = {}
+    for name, snapshot in engine.concurrency().items():
+        limits = [entry['limit'] for entry in snapshot['history']] or [snapshot['limit']]
+        summary[name] = {
+            'limit': snapshot['limit'],
+            'min': min(limits),
+            'max': max(limits),
+            'decisions': len(snapshot['history']),
+        }
+    return summary
+
+
+def _usage():
+    if resource is None:
+        return {'cpu_seconds': round(time.process_time(), 3), 'max_rss_mb': None, 'children_max_rss_mb': None}
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'cpu_seconds': round(own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, 3),
+        'max_rss_mb': round(own.ru_maxrss / scale, 1),
+        'children_max_rss_mb': round(children.ru_maxrss / scale, 1),
+    }
+
+
+def run_scenario(config):
+    CONFIG.update(config)
+    workdir = config['workdir']
+    output_dir = os.path.join(workdir, 'out')
+    os.environ.update({
+        'SPOTIFY_CLIENT_ID': 'benchmark',
+        'SPOTIFY_CLIENT_SECRET': 'benchmark',
+        'AUDIO_STORE_DIR': os.path.join(workdir, 'store'),
+        'RUN_REPORT': '0',
+    })
+    if not config['real_limits']:
+        # Sin los límites de los servicios reales se mide el propio programa
+        for service in ('SPOTIFY', 'YTMUSIC', 'YOUTUBE', 'DOWNLOAD'):
+            os.environ[f'{service}_RATE'] = '100000'
+            os.environ[f'{service}_BURST'] = '100000'
+
+    backend = config['backend']
+    install_fakes(backend)
+    url = f"https://open.spotify.com/playlist/{PLAYLIST_ID}"
+    result = {'success': False, 'message': ''}
+    stages = None
+    concurrency = None
+    art = None
+
+    start = time.perf_counter()
+    if backend == 'script':
+        import test_download
+        result['success'] = test_download.download_playlist(url, output_dir=output_dir)
+    elif backend == 'asyncio':
+        from async_engine import AsyncDownloadEngine
+
+        def on_complete(success, message):
+            result.update(success=success, message=message)
+
+        engine = AsyncDownloadEngine(url, on_complete=on_complete, output_dir=output_dir)
+        engine.run_sync()
+        stages = _stage_summary(engine.metrics)
+        concurrency = _concurrency_summary(engine)
+        art = _art_summary(engine)
+    else:
+        from download_worker import DownloadWorker
+
+        def on_complete(success, message):
+            result.update(success=success, message=message)
+
+        worker = DownloadWorker(url, on_complete=on_complete, concurrent=backend == 'thread-concurrent',
+                                output_dir=output_dir)
+        worker.run()
+        stages = _stage_summary(worker.metrics)
+        concurrency = _concurrency_summary(worker)
+        art = _art_summary(worker)
+    elapsed = time.perf_counter() - start
+
+    playlist_dir = os.path.join(output_dir, PLAYLIST_NAME)
+    completed = len([n for n in os.listdir(playlist_dir) if not n.startswith('.')]) if os.path.isdir(playlist_dir) else 0
+    return {
+        'backend': backend,
+        'tracks': config['tracks'],
+        'completed': completed,
+        'seconds': round(elapsed, 3),
+        'tracks_per_minute': round(completed * 60 / elapsed, 1) if elapsed else 0.0,
+        **_usage(),
+        'success': result['success'],
+        'message': result['message'],
+        'stages': stages,
+        'concurrency': concurrency,
+        'art': art,
+    }
+
+
+# --- Proceso principal -------------------------------------------------------
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sin conexión del descargador de playlists")
+    parser.add_argument('--sizes', default='10,1000,10000', help="Tamaños de playlist separados por comas")
+    parser.add_argument('--backends', default='asyncio,thread-concurrent',
+                        help=f"Motores separados por comas ({', '.join(BACKENDS)})")
+    parser.add_argument('--track-size', type=int, default=32 * 1024, help="Bytes de audio por canción")
+    parser.add_argument('--latency', type=float, default=0.02, help="Latencia del servidor de medios (s)")
+    parser.add_argument('--api-latency', type=float, default=0.05,
+                        help="Latencia de Spotify, YouTube Music y la resolución de streams (s)")
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help="Ancho de banda por conexión en bytes/s (0 = sin límite)")
+    parser.add_argument('--link-bandwidth', type=int, default=0,
+                        help="Ancho de banda compartido por todas las conexiones en bytes/s (0 = sin límite)")
+    parser.add_argument('--max-streams', type=int, default=0,
+                        help="Transferencias simultáneas a partir de las que el servidor responde 429 (0 = sin límite)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fracción de peticiones de medios que fallan (503 o corte)")
+    parser.add_argument('--real-limits', action='store_true',
+                        help="Respetar los límites de peticiones de los servicios reales")
+    parser.add_argument('--timeout', type=int, default=3600, help="Tiempo máximo por escenario (s)")
+    parser.add_argument('--output', help="Guardar los resultados en un archivo JSON")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    args.sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    args.backends = [backend.strip() for backend in args.backends.split(',') if backend.strip()]
+    unknown = [backend for backend in args.backends if backend not in BACKENDS]
+    if unknown:
+        parser.error(f"motor desconocido: {', '.join(unknown)} (usa {', '.join(BACKENDS)})")
+    return args
+
+
+def run_in_subprocess(config, timeout):
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    try:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--scenario', json.dumps(config)],
+            capture_output=True, text=True, cwd=config['workdir'], env=env, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return {'backend': config['backend'], 'tracks': config['tracks'], 'success': False,
+                'message': f"Tiempo agotado tras {timeout} s"}
+    lines = process.stdout.strip().splitlines()
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, ValueError):
+        error = process.stderr.strip().splitlines()
+        return {'backend': config['backend'], 'tracks': config['tracks'], 'success': False,
+                'message': error[-1] if error else f"Código de salida {process.returncode}"}
+
+
+def format_row(result):
+    if 'seconds' not in result:
+        return f"{result['backend']:<18} {result['tracks']:>9}  error: {result['message']}"
+    memory = '-' if result['max_rss_mb'] is None else f"{result['max_rss_mb']:.1f}"
+    status = 'ok' if result['success'] else f"error: {result['message']}"
+    return (
+        f"{result['backend']:<18} {result['tracks']:>9} {result['completed']:>11} {result['seconds']:>10.2f} "
+        f"{result['tracks_per_minute']:>14.1f} {memory:>11} {result['cpu_seconds']:>8.2f}  {status}"
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.scenario:
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return 0
+
+    server = start_media_server({
+        'latency': args.latency,
+        'bandwidth': args.bandwidth,
+        'link_bandwidth': args.link_bandwidth,
+        'max_streams': args.max_streams,
+        'error_rate': args.error_rate,
+        'track_size': args.track_size,
+    })
+    media_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"{'motor':<18} {'canciones':>9} {'completadas':>11} {'tiempo(s)':>10} "
+          f"{'canciones/min':>14} {'memoria(MB)':>11} {'CPU(s)':>8}  estado")
+    results = []
+    try:
+        for size in args.sizes:
+            for backend in args.backends:
+                workdir = tempfile.mkdtemp(prefix='spotify-bench-')
+                config = {
+                    'backend': backend,
+                    'tracks': size,
+                    'workdir': workdir,
+                    'media_url': media_url,
+                    'track_size': args.track_size,
+                    'api_latency': args.api_latency,
+                    'real_limits': args.real_limits,
+                }
+                try:
+                    result = run_in_subprocess(config, args.timeout)
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                results.append(result)
+                print(format_row(result), flush=True)
+                if result.get('concurrency'):
+                    limits = ', '.join(
+                        f"{name} {c['limit']} (entre {c['min']} y {c['max']})" for name, c in result['concurrency'].items()
+                    )
+                    print(f"{'':<18} concurrencia final: {limits}")
+                if result.get('art'):
+                    print(f"{'':<18} portadas: {result['art']['fetched']} descargadas, "
+                          f"{result['art']['reused']} reutilizadas")
+    finally:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'settings': {k: v for k, v in vars(args).items() if k != 'scenario'}, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+    return 0 if all(result.get('success') for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Descarga por lotes de playlists de Spotify sin interfaz gráfica.
+
+Uso:
+    python cli.py URL [URL ...]
+    python cli.py --file playlists.txt --output /ruta/de/descargas
+    python cli.py --export-matches coincidencias.jsonl
+    python cli.py --import-matches coincidencias.jsonl URL
+
+Todas las playlists se descargan en un único proceso que comparte el cliente
+de Spotify, el de YouTube Music y el pool de conexiones; las canciones que
+aparecen en varias playlists se descargan una sola vez. No importa PyQt5.
+
+El índice de coincidencias Spotify -> YouTube se puede exportar e importar
+para compartirlo entre equipos; la importación se hace antes de descargar.
+"""
+import argparse
+import logging
+import sys
+
+from dotenv import load_dotenv
+
+from async_engine import AsyncDownloadEngine
+from match_cache import MatchCache
+
+
+def read_url_file(path):
+    """Leer URLs de un archivo de texto (una por línea; se ignoran vacías y comentarios)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Descargar playlists de Spotify sin interfaz gráfica")
+    parser.add_argument('urls', nargs='*', help="URLs de playlists de Spotify")
+    parser.add_argument('-f', '--file', action='append', default=[],
+                        help="Archivo con una URL de playlist por línea (se puede repetir)")
+    parser.add_argument('-o', '--output', help="Carpeta de destino (por defecto SpotifyPlaylists)")
+    parser.add_argument('--max-connections', type=int, help="Máximo de conexiones HTTP simultáneas")
+    parser.add_argument('--max-per-host', type=int, help="Máximo de descargas simultáneas por servidor")
+    parser.add_argument('--report', help="Ruta del informe de la ejecución (.json o .csv)")
+    parser.add_argument('--import-matches', metavar='PATH',
+                        help="Añadir al índice local las coincidencias de un archivo exportado")
+    parser.add_argument('--export-matches', metavar='PATH',
+                        help="Guardar el índice local de coincidencias en un archivo (JSON Lines)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Mostrar solo avisos y errores")
+    args = parser.parse_args(argv)
+
+    urls = list(args.urls)
+    for path in args.file:
+        urls.extend(read_url_file(path))
+    # Quitar URLs repetidas conservando el orden
+    args.urls = list(dict.fromkeys(urls))
+    if not args.urls and not (args.import_matches or args.export_matches):
+        parser.error("indica al menos una URL de playlist o un archivo con --file")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+
+    logging.basicConfig(
+        level=logging.WARNING if args.quiet else logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    if args.import_matches or args.export_matches:
+        match_cache = MatchCache()
+        try:
+            if args.import_matches:
+                count = match_cache.import_file(args.import_matches)
+                logging.info(f"Importadas {count} coincidencias de {args.import_matches}")
+            if args.export_matches:
+                count = match_cache.export(args.export_matches)
+                logging.info(f"Exportadas {count} coincidencias a {args.export_matches}")
+        except (OSError, ValueError) as e:
+            logging.error(f"Error con el índice de coincidencias: {str(e)}")
+            return 1
+        finally:
+            match_cache.close()
+        if not args.urls:
+            return 0
+
+    result = {'success': False}
+    last_logged = [-1]
+
+    def on_progress(current, total):
+        # Registrar el progreso general cada 10%
+        step = current * 100 // total // 10
+        if step > last_logged[0]:
+            last_logged[0] = step
+            logging.info(f"Progreso total: {current * 100 // total}%")
+
+    def on_complete(success, message):
+        result['success'] = success
+        if success:
+            logging.info(message)
+        else:
+            logging.error(message)
+
+    engine = AsyncDownloadEngine(
+        args.urls,
+        on_progress=on_progress,
+        on_status=logging.info,
+        on_complete=on_complete,
+        output_dir=args.output,
+        max_connections=args.max_connections,
+        max_per_host=args.max_per_host,
+        report_path=args.report
+    )
+
+    try:
+        engine.run_sync()
+    except KeyboardInterrupt:
+        engine.stop()
+        logging.error("Descarga cancelada por el usuario")
+        return 130
+
+    return 0 if result['success'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
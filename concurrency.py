@@ -0,0 +1,276 @@
+import threading
+import time
+from collections import deque
+
+from settings import env_bool, env_int
+
+# Cada cuánto vuelven a mirar la cancelación los hilos que esperan un hueco
+POLL_INTERVAL = 0.2
+
+# Decisiones que se guardan en el historial de cada controlador
+MAX_HISTORY = 500
+
+# Latencia media de las búsquedas, respecto a la mejor vista, a partir de la que se considera congestión.
+# En las descargas la latencia crece con el tamaño y con el reparto del ancho de banda: cuentan los bytes por segundo
+SEARCH_LATENCY_FACTOR = 3
+
+# Peso de cada ventana en la media móvil de la tasa de errores
+ERROR_AVERAGE_WEIGHT = 0.3
+
+
+def _bounds(initial, maximum_env):
+    """Márgenes del límite: de 1 al máximo configurado, o fijo en `initial` sin ADAPTIVE_CONCURRENCY."""
+    if not env_bool('ADAPTIVE_CONCURRENCY', True):
+        return initial, initial
+    return 1, max(initial, env_int(maximum_env, 16))
+
+
+def search_controller(initial, on_change=None):
+    """Límite de búsquedas en YouTube Music en curso, de 1 a SEARCH_WORKERS_MAX."""
+    minimum, maximum = _bounds(initial, 'SEARCH_WORKERS_MAX')
+    return AIMDController(
+        'busqueda', initial, minimum=minimum, maximum=maximum, latency_factor=SEARCH_LATENCY_FACTOR,
+        on_change=on_change
+    )
+
+
+def download_controller(initial, on_change=None, ceiling=None):
+    """Límite de transferencias en curso, de 1 a DOWNLOAD_WORKERS_MAX (o a `ceiling`, si es menor)."""
+    minimum, maximum = _bounds(initial, 'DOWNLOAD_WORKERS_MAX')
+    if ceiling is not None:
+        maximum = min(maximum, ceiling)
+    return AIMDController('descarga', initial, minimum=minimum, maximum=maximum, on_change=on_change)
+
+
+class AIMDController:
+    """Límite de operaciones en curso que se ajusta solo: aumento aditivo, disminución multiplicativa.
+
+    Funciona como un semáforo cuyo tamaño cambia durante la ejecución: cada
+    operación espera un hueco con `acquire()` y lo devuelve con `release()`, e
+    informa con `record()` de su duración y de si terminó en error; los bytes
+    se anotan con `transferred()` a medida que llegan. Cada `interval` segundos se evalúa lo observado:
+
+    - congestión (alguna respuesta 429, tasa de errores por encima de
+      `max_error_rate` y del doble de su media móvil o, si se indica
+      `latency_factor`, latencia media por encima de ese múltiplo de la mejor
+      vista): el límite se multiplica por `decrease`. Comparar con la media
+      evita que los errores que no dependen de la carga (un servidor que
+      siempre corta un 20 % de las conexiones) frenen las descargas;
+    - si los bytes por segundo cayeron tras la última subida, se deshace;
+    - si el límite se llegó a usar entero y el rendimiento no se estancó tras
+      la última subida, se suma `increase`.
+
+    Los errores que el planificador reintenta por su cuenta no llegan a quien
+    hace la llamada: se anotan pasando `scheduler_error` como `observer` de
+    cada llamada, de modo que solo cuentan los del trabajo que usa este
+    controlador y no los de otras descargas del proceso. `snapshot()` devuelve el límite actual y el
+    historial de decisiones; `on_change(entry)` recibe cada cambio del límite.
+    Con `minimum == maximum` el límite es fijo, pero se sigue midiendo.
+    """
+
+    def __init__(self, name, initial, minimum=1, maximum=None, increase=1, decrease=0.5,
+                 interval=None, max_error_rate=None, latency_factor=None, min_gain=0.05, on_change=None):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval or env_int('ADAPTIVE_INTERVAL', 2)
+        self.max_error_rate = (
+            max_error_rate if max_error_rate is not None else env_int('ADAPTIVE_MAX_ERROR_RATE', 10) / 100
+        )
+        self.latency_factor = latency_factor
+        # Mejora mínima de bytes por segundo para seguir subiendo
+        self.min_gain = min_gain
+        self.on_change = on_change
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self.history = deque(maxlen=MAX_HISTORY)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._started = time.monotonic()
+        self._last_decision = None
+        self._last_throughput = None
+        self._best_latency = None
+        self._average_error_rate = None
+        self._reset_window(self._started)
+
+    def _reset_window(self, now):
+        # Se llama con el lock tomado (o desde __init__)
+        self._window_start = now
+        self._requests = 0
+        self._errors = 0
+        self._throttled = 0
+        self._bytes = 0
+        self._latency = 0.0
+        self._timed = 0
+        self._peak = self._active
+
+    @property
+    def active(self):
+        with self._cond:
+            return self._active
+
+    def _take(self):
+        # Se llama con el lock tomado
+        if self._active >= self.limit:
+            return False
+        self._active += 1
+        self._peak = max(self._peak, self._active)
+        return True
+
+    def acquire(self, is_running=None):
+        """Esperar un hueco; devuelve False si se canceló antes."""
+        is_running = is_running or (lambda: True)
+        with self._cond:
+            while not self._take():
+                if not is_running():
+                    return False
+                self._cond.wait(POLL_INTERVAL)
+        return True
+
+    async def acquire_async(self, is_running=None):
+        """Versión de `acquire` para el motor asyncio (no bloquea el bucle)."""
+        import asyncio
+
+        is_running = is_running or (lambda: True)
+        while True:
+            with self._cond:
+                if self._take():
+                    return True
+            if not is_running():
+                return False
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def record(self, seconds=None, nbytes=0, error=False):
+        """Anotar una operación terminada (o un error reintentado, sin duración) y reevaluar si toca."""
+        with self._cond:
+            self._requests += 1
+            self._bytes += max(0, nbytes)
+            if error:
+                self._errors += 1
+            elif seconds is not None:
+                # La latencia de las operaciones fallidas no dice nada del servidor
+                self._latency += seconds
+                self._timed += 1
+        self._maybe_adjust()
+
+    def scheduler_error(self, throttled, retried):
+        """`observer` para `RequestScheduler.call`: anotar un error de una llamada de este trabajo.
+
+        Los reintentados cuentan como una operación fallida más; el último error,
+        que sí llega a quien llama, se anota con `record(error=True)`.
+        """
+        with self._cond:
+            if retried:
+                self._requests += 1
+                self._errors += 1
+            if throttled:
+                self._throttled += 1
+        self._maybe_adjust()
+
+    def transferred(self, nbytes):
+        """Anotar bytes recibidos por una operación en curso (el rendimiento se mide mientras llegan)."""
+        with self._cond:
+            self._bytes += max(0, nbytes)
+        self._maybe_adjust()
+
+    def _maybe_adjust(self):
+        with self._cond:
+            if time.monotonic() - self._window_start < self.interval:
+                return
+            entry = self._adjust()
+        if entry['limit'] != entry['previous'] and self.on_change is not None:
+            self.on_change(entry)
+
+    def set_limit(self, limit):
+        """Fijar el límite a mano (se sigue ajustando a partir de ese valor)."""
+        with self._cond:
+            self.limit = min(self.maximum, max(self.minimum, int(limit)))
+            self._cond.notify_all()
+
+    def _adjust(self):
+        # Se llama con el lock tomado, al cerrar cada ventana de `interval` segundos
+        now = time.monotonic()
+        elapsed = max(now - self._window_start, 1e-6)
+        requests = self._requests
+        errors = self._errors
+        error_rate = errors / requests if requests else 0.0
+        throughput = self._bytes / elapsed
+        latency = self._latency / self._timed if self._timed else None
+        if latency is not None:
+            self._best_latency = latency if self._best_latency is None else min(self._best_latency, latency)
+        gain = None
+        if self._last_throughput:
+            gain = throughput / self._last_throughput - 1
+
+        previous = self.limit
+        error_spike = error_rate > self.max_error_rate and (
+            self._average_error_rate is None or error_rate > self._average_error_rate * 2
+        )
+        if self._average_error_rate is None:
+            self._average_error_rate = error_rate
+        else:
+            self._average_error_rate += (error_rate - self._average_error_rate) * ERROR_AVERAGE_WEIGHT
+
+        if self._throttled > 0 or error_spike or (
+            self.latency_factor and latency is not None and latency > self._best_latency * self.latency_factor
+        ):
+            decision = 'congestion'
+            self.limit = max(self.minimum, int(self.limit * self.decrease))
+        elif self._last_decision == 'aumento' and gain is not None and gain < -self.min_gain:
+            # Más transferencias dieron menos rendimiento: volver al valor anterior
+            decision = 'retroceso'
+            self.limit = max(self.minimum, self.limit - self.increase)
+        elif self._peak >= self.limit and not (
+            self._last_decision == 'aumento' and self._bytes and gain is not None and gain < self.min_gain
+        ):
+            decision = 'aumento'
+            self.limit = min(self.maximum, self.limit + self.increase)
+        else:
+            decision = 'igual'
+
+        if self.limit != previous:
+            self._cond.notify_all()
+        self._last_decision = decision if self.limit != previous else 'igual'
+        self._last_throughput = throughput
+        entry = {
+            'time': round(now - self._started, 3),
+            'limit': self.limit,
+            'previous': previous,
+            'decision': decision,
+            'requests': requests,
+            'errors': errors,
+            'throttled': self._throttled,
+            'error_rate': round(error_rate, 4),
+            'bytes_per_second': round(throughput, 1),
+            'latency': round(latency, 4) if latency is not None else None,
+            'in_flight': self._peak,
+        }
+        self.history.append(entry)
+        self._reset_window(now)
+        return entry
+
+    def snapshot(self):
+        """Límite actual, márgenes e historial de decisiones (para el informe de la ejecución)."""
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'minimum': self.minimum,
+                'maximum': self.maximum,
+                'active': self._active,
+                'history': list(self.history),
+            }
+
+    def summary(self):
+        """Resumen legible: límite inicial, actual y extremos alcanzados."""
+        with self._cond:
+            limits = [entry['limit'] for entry in self.history]
+            first = self.history[0]['previous'] if self.history else self.limit
+        if not limits:
+            return f"{self.name}: {self.limit}"
+        return f"{self.name}: {first} → {self.limit} (entre {min(limits + [first])} y {max(limits + [first])})"
@@ -0,0 +1,88 @@
+import os
+import re
+import shutil
+
+# Caracteres que no se permiten en nombres de archivo
+INVALID_FILENAME_CHARS = ['/', '\\', '"', '?', ':', '*', '<', '>', '|']
+
+
+def extract_playlist_id(url):
+    # Patrones para diferentes formatos de URL de Spotify
+    patterns = [
+        r'spotify:playlist:([a-zA-Z0-9]+)',  # spotify:playlist:ID
+        r'https://open\.spotify\.com/playlist/([a-zA-Z0-9]+)',  # https://open.spotify.com/playlist/ID
+        r'https://open\.spotify\.com/playlist/([a-zA-Z0-9]+)\?',  # https://open.spotify.com/playlist/ID?si=...
+    ]
+
+    for pattern in patterns:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+
+def safe_file_name(song_name, artist):
+    """Limpiar el nombre del archivo para evitar caracteres problemáticos."""
+    file_name = f"{song_name} - {artist}"
+    for char in INVALID_FILENAME_CHARS:
+        file_name = file_name.replace(char, '_')
+    return file_name
+
+
+def place_copy(source, destination, hardlink=True):
+    """Colocar una copia de un archivo ya descargado, con enlace duro si es posible."""
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if hardlink:
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            # Otro sistema de archivos o sin soporte de enlaces: copiar el contenido
+            pass
+    shutil.copy2(source, destination)
+
+
+def make_job(index, track):
+    """Crear el diccionario de trabajo de una canción a partir de su `TrackRecord`."""
+    artist = track.artist
+    song_name = track.title
+    return {
+        'index': index,
+        # Clave estable de la canción: su ID de Spotify o, para archivos locales, la búsqueda
+        'key': track.id or f"q:{song_name} {artist}",
+        'track': track,
+        'artist': artist,
+        'song_name': song_name,
+        'search_query': f"{song_name} {artist}",
+    }
+
+
+def create_spotify_client(cache_handler=None):
+    """Crear el cliente de Spotify con las credenciales del .env, o None si faltan.
+
+    `cache_handler` (de spotipy) conserva el token de acceso entre clientes y ejecuciones.
+    """
+    client_id = os.getenv('SPOTIFY_CLIENT_ID')
+    client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
+
+    if not client_id or not client_secret:
+        return None
+
+    # spotipy se importa al crear el primer cliente, no al importar el módulo
+    import spotipy
+    from spotipy.oauth2 import SpotifyClientCredentials
+
+    client_credentials_manager = SpotifyClientCredentials(
+        client_id=client_id,
+        client_secret=client_secret,
+        cache_handler=cache_handler
+    )
+    # Sin reintentos internos: los 429 y errores 5xx los gestiona el planificador (rate_limit)
+    return spotipy.Spotify(
+        client_credentials_manager=client_credentials_manager,
+        retries=0,
+        status_retries=0
+    )
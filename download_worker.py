@@ -0,0 +1,740 @@
+import os
+import threading
+import time
+from itertools import islice
+
+from audio_store import AudioStore
+from concurrency import download_controller, search_controller
+from download_core import extract_playlist_id, make_job, safe_file_name
+from http_download import check_download, download_resumable
+from manifest import PlaylistManifest
+from matching import TrackMatcher, candidate_from_ytmusic
+from metrics import RunMetrics
+from pipeline import Pipeline, Stage
+from progress import ProgressAggregator
+from rate_limit import default_scheduler
+from settings import BASE_DIR, env_bool, env_int
+from services import Services
+from spotify_listing import PAGE_SIZE, open_playlist
+from stream_cache import is_expired_url_error, stream_from_pytube
+from tagging import Tagger
+from transcode import Transcoder, ffmpeg_available
+
+
+class DownloadWorker:
+    """Descarga de una playlist con hilos, sin interfaz gráfica.
+
+    Es el motor de `DownloadThread`: recorre el listado de Spotify, busca cada
+    canción en YouTube Music, resuelve el stream, lo descarga y lo convierte,
+    una canción tras otra o, en modo concurrente, con cada etapa en su propio
+    pool (`Pipeline`). Tras la conversión, un pool de etiquetado (`Tagger`)
+    escribe las etiquetas y la portada con los datos del listado de Spotify.
+    No importa Qt, así se puede reutilizar sin interfaz.
+
+    Emite los mismos eventos que `AsyncDownloadEngine`:
+    `on_progress(current, total)`, `on_status(message)` y
+    `on_complete(success, message)`.
+    """
+    
+    def __init__(self, playlist_url, on_progress=None, on_status=None, on_complete=None,
+                 concurrent=None, output_dir=None, services=None, control=None, budget=None):
+        self.playlist_url = playlist_url
+        self.on_complete = on_complete or (lambda success, message: None)
+        # Trabajo de la cola (pausa y prioridad) y presupuesto de transferencias común a la cola
+        self.control = control
+        self.budget = budget
+        # Clientes, sesiones y cachés de la aplicación; sin ellos el hilo usa los suyos
+        self.owns_services = services is None
+        self.services = services or Services()
+        self.output_dir = output_dir or os.path.join(BASE_DIR, "SpotifyPlaylists")
+        self.is_running = True
+        # Modo concurrente: búsqueda, resolución del stream y descarga en etapas separadas
+        self.concurrent = env_bool('CONCURRENT_DOWNLOADS') if concurrent is None else concurrent
+        self.search_workers = env_int('SEARCH_WORKERS', 4)
+        self.resolve_workers = env_int('RESOLVE_WORKERS', 4)
+        self.download_workers = env_int('DOWNLOAD_WORKERS', 3)
+        # Límites adaptativos de búsquedas y descargas en curso (modo concurrente)
+        self.search_limit = None
+        self.download_limit = None
+        # Sincronización incremental: solo se descargan canciones nuevas o cambiadas
+        self.incremental = env_bool('INCREMENTAL_SYNC', True)
+        self.prune_removed = env_bool('PRUNE_REMOVED')
+        # Progreso y mensajes agrupados: se publican a la interfaz a ritmo fijo
+        self.progress = ProgressAggregator(on_progress, on_status)
+        self.match_cache = None
+        self.stream_cache = None
+        # Elección del resultado de la búsqueda por duración, artistas, título y álbum
+        self.matcher = TrackMatcher()
+        self.manifest = None
+        self.store = None
+        self.transcoder = None
+        self.tagger = None
+        self.report_enabled = env_bool('RUN_REPORT', True)
+        self.metrics = RunMetrics()
+        # Todas las llamadas de red pasan por el planificador común de límites;
+        # la vista propia cuenta solo las peticiones de este trabajo para el informe
+        self.scheduler = default_scheduler().scoped()
+        
+    def run(self):
+        self.progress.start()
+        try:
+            # Cliente de Spotify compartido (el token se reutiliza entre descargas)
+            sp = self.services.spotify()
+            if sp is None:
+                self.complete(False, "Error: No se encontraron las credenciales de Spotify. Verifica el archivo .env")
+                return
+            
+            # Los streams de YouTube son webm/opus o m4a: hace falta ffmpeg para convertirlos
+            if not ffmpeg_available():
+                self.complete(False, "Error: No se encontró ffmpeg. Instálalo para convertir el audio")
+                return
+            
+            # Extraer ID de la playlist desde la URL
+            playlist_id = self.extract_playlist_id(self.playlist_url)
+            if not playlist_id:
+                self.complete(False, "Error: URL de playlist inválida")
+                return
+            
+            # Obtener información de la playlist
+            self.progress.status("Obteniendo información de la playlist...")
+            # Solo la cabecera y la primera página: el resto llega mientras se descarga
+            with self.metrics.stage('listado'):
+                listing = open_playlist(sp, playlist_id, scheduler=self.scheduler)
+            playlist_name = listing.name
+            
+            # Crear carpeta para la playlist
+            download_dir = os.path.join(self.output_dir, playlist_name)
+            os.makedirs(download_dir, exist_ok=True)
+            self.progress.status(f"Directorio de descarga: {download_dir}")
+            
+            # Verificar que el directorio se creó correctamente
+            if not os.path.exists(download_dir):
+                raise Exception(f"No se pudo crear el directorio de descarga: {download_dir}")
+            
+            # Verificar permisos de escritura
+            if not os.access(download_dir, os.W_OK):
+                raise Exception(f"No hay permisos de escritura en el directorio: {download_dir}")
+            
+            # Las canciones se recorren a medida que llegan las páginas
+            # (o desde la caché si el snapshot de la playlist no ha cambiado)
+            self.progress.status(f"Encontradas {listing.total} canciones en la playlist '{playlist_name}'")
+            
+            # YTMusic y las cachés de coincidencias y de streams se crean una vez por aplicación
+            self.ytmusic = self.services.ytmusic()
+            self.match_cache = self.services.match_cache()
+            # Streams resueltos con su caducidad, reutilizados en reintentos y ejecuciones siguientes
+            self.stream_cache = self.services.stream_cache()
+            # Conversión de formato en un pool de procesos, en paralelo con las descargas
+            self.transcoder = Transcoder()
+            # Almacén común: cada canción se descarga una vez y se enlaza en las playlists
+            self.store = AudioStore(extension=self.transcoder.extension)
+            self.http_session = self.services.http_session()
+            # Etiquetas y portada en su propio pool, con los datos que ya trae el listado
+            self.tagger = Tagger(self.transcoder.format, self.services.art_cache(), self.http_session)
+            if self.tagger.enabled and not self.tagger.active:
+                self.progress.status("No se encontró mutagen: las canciones se guardarán sin etiquetas")
+            self.download_dir = download_dir
+            self.progress.reset(listing.total)
+            
+            all_keys = []
+            jobs = self.iter_jobs(listing, all_keys)
+            
+            # Omitir las canciones que ya están descargadas y no han cambiado
+            if self.incremental:
+                self.manifest = PlaylistManifest(download_dir)
+                jobs = self.filter_unchanged(jobs)
+            
+            if self.concurrent:
+                # Búsquedas y descargas en curso se ajustan según el rendimiento y los errores
+                # observados: sus etapas tienen hilos hasta el máximo y el límite decide cuántos trabajan
+                self.search_limit = search_controller(self.search_workers, self.limit_changed)
+                self.download_limit = download_controller(self.download_workers, self.limit_changed)
+                # Cada etapa con su propio pool acotado y colas entre etapas
+                self.progress.status(
+                    f"Modo concurrente: {self.search_workers} búsquedas (hasta {self.search_limit.maximum}), "
+                    f"{self.resolve_workers} resoluciones, {self.download_workers} descargas "
+                    f"(hasta {self.download_limit.maximum}), {self.transcoder.workers} conversiones"
+                )
+                pipeline = Pipeline(
+                    [
+                        Stage('busqueda', self.search_track, self.search_limit.maximum),
+                        Stage('resolucion', self.resolve_stream, self.resolve_workers),
+                        Stage('descarga', self.download_track, self.download_limit.maximum),
+                        Stage('conversion', self.convert_track, self.transcoder.workers),
+                    ],
+                    is_running=lambda: self.is_running,
+                    on_error=self.track_failed
+                )
+                pipeline.run(jobs)
+            else:
+                # Descargar cada canción; la conversión sigue en segundo plano
+                # mientras se descarga la siguiente. Cada canción terminada de colocar
+                # (o descartada) suma uno a `finished`
+                started = 0
+                finished = threading.Semaphore(0)
+                for job in jobs:
+                    if not self.is_running:
+                        break
+                    stage = 'busqueda'
+                    try:
+                        job = self.search_track(job)
+                        if job:
+                            stage = 'resolucion'
+                            job = self.resolve_stream(job)
+                        if job:
+                            stage = 'descarga'
+                            job = self.download_track(job)
+                        if job:
+                            future = self.start_conversion(job)
+                            tagging = self.start_tagging(job, future)
+                            # Se termina la canción cuando acaba la última etapa en segundo plano
+                            last = tagging or future
+                            last.add_done_callback(
+                                lambda f, job=job, future=future, tagging=tagging:
+                                    self.conversion_done(job, future, tagging, finished)
+                            )
+                            started += 1
+                    except Exception as e:
+                        self.track_failed(stage, job, e)
+                
+                # Esperar a que las últimas canciones se coloquen y registren, sin bloquear la
+                # cancelación: wait() sobre los futures volvería antes de que acaben sus callbacks
+                while started and self.is_running:
+                    if finished.acquire(timeout=0.5):
+                        started -= 1
+            
+            if not self.is_running:
+                self.complete(False, "Descarga cancelada por el usuario")
+                return
+            
+            # Eliminar las canciones que se quitaron de la playlist
+            if self.manifest is not None and self.prune_removed:
+                removed = self.manifest.prune(all_keys)
+                if removed:
+                    self.progress.status(f"Eliminadas {len(removed)} canciones que ya no están en la playlist")
+            
+            self.progress.status(f"Peticiones: {self.scheduler.summary()}")
+            if self.tagger.active:
+                self.progress.status(f"Etiquetas: {self.services.art_cache().summary()}")
+            if self.concurrent:
+                self.progress.status(
+                    f"Concurrencia: {self.search_limit.summary()}; {self.download_limit.summary()}"
+                )
+            self.complete(True, f"Descarga completada. Las canciones se guardaron en: {download_dir}")
+            
+        except Exception as e:
+            self.complete(False, f"Error: {str(e)}")
+        finally:
+            # Al cancelar se descartan las conversiones que aún no empezaron
+            if self.transcoder is not None:
+                self.transcoder.shutdown(wait=self.is_running)
+            # Y los etiquetados pendientes; al terminar se espera a que se coloquen las últimas canciones
+            if self.tagger is not None:
+                self.tagger.shutdown(wait=self.is_running)
+            # Los videos que quedaron reservados pasan a otros trabajos que los esperan
+            if self.store is not None:
+                self.store.release_all()
+            # Guardar las coincidencias aunque la descarga se cancele o falle
+            if self.match_cache is not None:
+                try:
+                    self.match_cache.save()
+                except Exception as e:
+                    self.progress.status(f"No se pudo guardar la caché de búsquedas: {str(e)}")
+            if self.stream_cache is not None:
+                try:
+                    self.stream_cache.save()
+                except Exception as e:
+                    self.progress.status(f"No se pudo guardar la caché de streams: {str(e)}")
+            if self.manifest is not None:
+                try:
+                    self.manifest.save()
+                except Exception as e:
+                    self.progress.status(f"No se pudo guardar el manifiesto de la playlist: {str(e)}")
+            if self.owns_services:
+                self.services.close()
+            self.write_report()
+            self.progress.close()
+    
+    def write_report(self):
+        # Informe de la ejecución: tiempos por etapa, bytes, reintentos y fallos por canción.
+        # Si no se llegó a procesar ninguna canción (credenciales, URL...) no se guarda
+        if not self.report_enabled or not self.metrics.track_count:
+            return
+        self.metrics.finish(
+            playlist_url=self.playlist_url,
+            cancelled=not self.is_running,
+            requests=self.scheduler.stats(),
+            concurrency=self.concurrency()
+        )
+        try:
+            path = self.metrics.write()
+            self.progress.status(f"Informe de la ejecución: {path}")
+        except Exception as e:
+            self.progress.status(f"No se pudo guardar el informe de la ejecución: {str(e)}")
+    
+    def concurrency(self):
+        """Límite actual e historial de los límites adaptativos (vacío en modo secuencial)."""
+        return {
+            limit.name: limit.snapshot()
+            for limit in (self.search_limit, self.download_limit) if limit is not None
+        }
+    
+    def limit_changed(self, entry):
+        self.progress.status(
+            f"Concurrencia: {entry['previous']} → {entry['limit']} ({entry['decision']}, "
+            f"{entry['bytes_per_second'] / 1024:.0f} KB/s, {entry['error_rate']:.0%} errores)",
+            transient=True
+        )
+    
+    def iter_jobs(self, listing, keys):
+        """Crear los trabajos a medida que se recorre el listado, anotando sus claves en `keys`."""
+        records = iter(listing)
+        index = 0
+        while True:
+            page = list(islice(records, PAGE_SIZE))
+            if not page:
+                break
+            jobs = [make_job(index + i, track) for i, track in enumerate(page)]
+            index += len(jobs)
+            # Una sola consulta al índice local por página; solo las que falten se buscarán
+            self.match_cache.preload([(job['track'], job['search_query']) for job in jobs])
+            for job in jobs:
+                keys.append(job['key'])
+                yield job
+        # El total de Spotify incluye las canciones eliminadas, que no llegan al listado
+        self.progress.set_total(len(keys))
+    
+    def filter_unchanged(self, jobs):
+        skipped = 0
+        pending = 0
+        for job in jobs:
+            # Si la caché conoce un video distinto al descargado, la canción cambió
+            video_id = self.match_cache.get(job['track'], job['search_query'])
+            if self.manifest.is_current(job['key'], video_id, self.transcoder.extension):
+                self.metrics.skip(job, 'sin_cambios')
+                self.set_track_progress(job, 100)
+                skipped += 1
+            else:
+                pending += 1
+                yield job
+        if skipped:
+            self.progress.status(f"{skipped} canciones sin cambios; {pending} por descargar")
+    
+    def complete(self, success, message):
+        # Entregar el progreso y los mensajes pendientes antes del resultado
+        self.progress.close()
+        self.on_complete(success, message)
+    
+    def set_track_progress(self, job, percent):
+        # El progreso general es la media del progreso de cada canción,
+        # válido tanto con una descarga a la vez como con varias en paralelo
+        self.progress.set_track(job['index'], percent)
+    
+    def track_failed(self, stage, job, error):
+        self.release_video(job)
+        self.metrics.fail(stage, job, error)
+        self.progress.status(f"❌ Error al descargar {job['song_name']}: {str(error)}")
+        # Continuar con la siguiente canción pero actualizar el progreso
+        self.set_track_progress(job, 100)
+    
+    def wait_if_paused(self):
+        """Esperar mientras el trabajo de la cola está en pausa; devuelve False si se canceló."""
+        if self.control is None:
+            return self.is_running
+        return self.control.wait_if_paused(lambda: self.is_running)
+    
+    def acquire_transfer(self):
+        """Hueco del límite adaptativo de la descarga y, después, del presupuesto común de la cola."""
+        if self.download_limit is not None and not self.download_limit.acquire(lambda: self.is_running):
+            return False
+        # El presupuesto reparte los huecos por prioridad entre los trabajos de la cola
+        if self.budget is not None and not self.budget.acquire(self.control, lambda: self.is_running):
+            if self.download_limit is not None:
+                self.download_limit.release()
+            return False
+        return True
+    
+    def release_transfer(self):
+        if self.budget is not None:
+            self.budget.release()
+        if self.download_limit is not None:
+            self.download_limit.release()
+    
+    def transfer_allowed(self):
+        # Una pausa corta la transferencia; el .part se reanuda al continuar
+        return self.is_running and not (self.control is not None and self.control.paused)
+    
+    def search_track(self, job):
+        search_query = job['search_query']
+        track = job['track']
+        if not self.wait_if_paused():
+            return None
+        
+        # Reutilizar la coincidencia del índice local (por ID de Spotify, ISRC o búsqueda)
+        video_id = self.match_cache.get(track, search_query)
+        if video_id:
+            job['video_id'] = video_id
+            return job
+        
+        # Hueco del límite adaptativo de búsquedas en curso
+        if self.search_limit is not None and not self.search_limit.acquire(lambda: self.is_running):
+            return None
+        self.progress.status(f"Buscando: {search_query}")
+        
+        # Buscar en YouTube Music
+        started = time.monotonic()
+        try:
+            with self.metrics.stage('busqueda', job):
+                search_results = self.scheduler.call(
+                    'ytmusic', self.ytmusic.search, search_query, filter="songs",
+                    observer=self.search_limit.scheduler_error if self.search_limit is not None else None,
+                    keep_waiting=lambda: self.is_running
+                )
+        except Exception:
+            if self.search_limit is not None:
+                self.search_limit.record(error=True)
+            raise
+        finally:
+            if self.search_limit is not None:
+                self.search_limit.release()
+        if self.search_limit is not None:
+            self.search_limit.record(time.monotonic() - started)
+        if not search_results:
+            self.metrics.skip(job, 'no_encontrada')
+            self.progress.status(f"No se encontró: {search_query}")
+            self.set_track_progress(job, 100)
+            return None
+        
+        # Elegir entre los primeros resultados el que corresponde a la canción;
+        # una coincidencia dudosa se descarta antes de descargar nada
+        match, score = self.matcher.select(track, [candidate_from_ytmusic(r) for r in search_results])
+        if match is None:
+            self.metrics.skip(job, 'sin_coincidencia')
+            self.progress.status(f"Ninguna coincidencia fiable para: {search_query} (mejor puntuación {score})")
+            self.set_track_progress(job, 100)
+            return None
+        
+        # Obtener el ID del video de YouTube
+        job['video_id'] = match['video_id']
+        self.match_cache.put(track, search_query, job['video_id'], match, score)
+        return job
+    
+    def resolve_stream(self, job):
+        song_name = job['song_name']
+        artist = job['artist']
+        if not self.wait_if_paused():
+            return None
+        
+        # Si el audio ya está en el almacén no hace falta resolver el stream. Si otro
+        # trabajo está descargando el mismo video, se espera a que termine y se enlaza
+        reserved = self.store.reserve(job['video_id'], lambda: self.is_running)
+        if reserved is None:
+            return None
+        if not reserved:
+            job['stream'] = None
+            return job
+        job['reserved'] = True
+        
+        # Reutilizar el stream ya resuelto (reintentos, repeticiones, ejecuciones anteriores)
+        stream = self.stream_cache.get(job['video_id'])
+        if stream is None:
+            self.progress.status(f"Buscando y descargando: {song_name} - {artist}")
+            stream = self.extract_stream(job)
+        
+        # Verificar que se obtuvo un stream de audio
+        if not stream:
+            self.release_video(job)
+            self.metrics.skip(job, 'sin_stream')
+            self.progress.status(f"Error: No se encontró stream de audio para {song_name}")
+            self.set_track_progress(job, 100)
+            return None
+        
+        job['stream'] = stream
+        return job
+    
+    def release_video(self, job):
+        """Liberar el video si este trabajo lo reservó para descargarlo."""
+        if job.pop('reserved', False):
+            self.store.release(job['video_id'])
+    
+    def extract_stream(self, job):
+        """Resolver con pytube el stream de audio de mejor calidad y guardarlo en la caché."""
+        # pytube se importa con la primera canción que hay que resolver, no al arrancar
+        from pytube import YouTube
+        
+        # Crear URL de YouTube
+        youtube_url = f"https://www.youtube.com/watch?v={job['video_id']}"
+        
+        # Configurar YouTube con opciones para evitar errores comunes
+        yt = YouTube(
+            youtube_url,
+            use_oauth=False,
+            allow_oauth_cache=False
+        )
+        
+        # Obtener el stream de audio con la mejor calidad (la extracción hace las peticiones)
+        with self.metrics.stage('resolucion', job):
+            audio_stream = self.scheduler.call(
+                'youtube',
+                lambda: yt.streams.filter(only_audio=True).order_by('abr').desc().first(),
+                keep_waiting=lambda: self.is_running
+            )
+            if not audio_stream:
+                return None
+            stream = stream_from_pytube(audio_stream)
+        self.stream_cache.put(job['video_id'], stream)
+        return stream
+    
+    def download_track(self, job):
+        song_name = job['song_name']
+        artist = job['artist']
+        stream = job['stream']
+        download_dir = self.download_dir
+        
+        # Limpiar el nombre del archivo para evitar caracteres problemáticos
+        file_name = safe_file_name(song_name, artist)
+        # Ruta final de la canción dentro de la carpeta de la playlist
+        audio_file_path = os.path.join(download_dir, f"{file_name}.{self.transcoder.extension}")
+        job['file_path'] = audio_file_path
+        
+        # Reutilizar el audio del almacén si otra playlist ya lo descargó
+        if stream is None:
+            tagged = self.place_track(job, job['video_id'], audio_file_path)
+            self.metrics.skip(job, 'reutilizada')
+            self.progress.status(f"♻️ Reutilizado del almacén: {song_name} - {artist}")
+            self.set_track_progress(job, 100)
+            if self.manifest is not None:
+                if tagged is None:
+                    self.manifest.record(job['key'], job['video_id'], audio_file_path)
+                else:
+                    self.manifest.record(
+                        job['key'], job['video_id'], audio_file_path, tagged['size'], tagged['sha256']
+                    )
+            # Nada que convertir
+            return None
+        
+        # El original se descarga con su extensión real; la conversión produce el archivo del almacén
+        source_part = self.store.source_path(job['video_id'], stream['extension'])
+        job['source_path'] = source_part
+        job['source_codec'] = stream['codec']
+        job['source_bitrate'] = stream['bitrate']
+        
+        # Descargar el original al almacén; tras convertirlo se enlaza en la carpeta de la playlist
+        self.progress.status(f"Descargando: {song_name} - {artist}")
+        
+        # Bytes ya contados en el ancho de banda común de la cola y en el límite adaptativo
+        counted = [0]
+        
+        # Configurar el callback de progreso para actualizar tanto el estado como la barra de progreso
+        def progress_callback(received, total):
+            new_bytes, counted[0] = received - counted[0], received
+            if self.budget is not None:
+                # Esperar si la cola en conjunto va por encima del límite de ancho de banda
+                self.budget.consume(new_bytes)
+            if self.download_limit is not None:
+                self.download_limit.transferred(new_bytes)
+            if not total:
+                return
+            file_progress = int(received * 100 / total)
+            # Se llama con cada bloque: solo se acumula, el agregador publica a ritmo fijo
+            self.progress.status(f"Descargando {song_name} - {artist}: {file_progress}%", transient=True)
+            # La descarga cuenta hasta el 90% de la canción; el resto es la conversión
+            self.set_track_progress(job, file_progress * 9 // 10)
+        
+        def part_size():
+            return os.path.getsize(source_part) if os.path.exists(source_part) else 0
+        
+        # Intentar la descarga con reintentos
+        max_retries = 3
+        retry_count = 0
+        download_success = False
+        
+        while retry_count < max_retries and not download_success:
+            if not self.wait_if_paused():
+                return None
+            if not self.acquire_transfer():
+                return None
+            result = None
+            started = time.monotonic()
+            try:
+                # Descarga por rangos sobre un archivo .part: tras un corte, un
+                # reintento, una pausa o una cancelación se continúa desde el último byte
+                resumed_from = counted[0] = part_size()
+                with self.metrics.stage('descarga', job) as span:
+                    try:
+                        result = self.scheduler.call(
+                            'download',
+                            download_resumable,
+                            stream['url'],
+                            source_part,
+                            session=self.http_session,
+                            expected_size=stream['filesize'],
+                            timeout=30,
+                            on_progress=progress_callback,
+                            is_running=self.transfer_allowed,
+                            on_retry=self.transfer_retried,
+                            # El original se borra tras convertirlo: ni hash ni fsync
+                            digest=False,
+                            durable=False,
+                            observer=self.download_limit.scheduler_error if self.download_limit is not None else None,
+                            keep_waiting=lambda: self.is_running
+                        )
+                    finally:
+                        # Bytes recibidos en este intento, aunque termine en un corte
+                        span['bytes'] = part_size() - resumed_from
+                if result is None:
+                    if self.is_running:
+                        # En pausa: se libera el hueco y se continúa al reanudar
+                        continue
+                    return None
+                
+                # Única verificación: el tamaño contado durante la descarga (el original
+                # es temporal; el hash se calcula sobre el archivo definitivo)
+                file_size, _ = result
+                with self.metrics.stage('verificacion', job):
+                    check_download(file_size, stream['filesize'])
+                download_success = True
+                if self.download_limit is not None:
+                    self.download_limit.record(time.monotonic() - started)
+                    
+            except Exception as e:
+                retry_count += 1
+                # Cada intento fallido cuenta para el límite adaptativo, aunque se reintente
+                if self.download_limit is not None:
+                    self.download_limit.record(error=True)
+                # Un archivo completo pero inválido no se reanuda: se descarta para empezar de cero
+                if result is not None and os.path.exists(source_part):
+                    os.remove(source_part)
+                # URL caducada o rechazada: resolver el stream de nuevo para el reintento
+                if is_expired_url_error(e) and retry_count < max_retries:
+                    self.stream_cache.invalidate(job['video_id'])
+                    previous, stream = stream, self.extract_stream(job)
+                    if not stream:
+                        raise Exception(f"No se encontró stream de audio para {song_name}")
+                    if stream['itag'] != previous['itag']:
+                        # Otro formato: lo descargado del anterior no sirve
+                        if os.path.exists(source_part):
+                            os.remove(source_part)
+                        source_part = job['source_path'] = self.store.source_path(job['video_id'], stream['extension'])
+                        job['source_codec'] = stream['codec']
+                        job['source_bitrate'] = stream['bitrate']
+                    job['stream'] = stream
+                if retry_count < max_retries:
+                    self.metrics.retry('descarga', job, e)
+                    self.progress.status(f"Reintento {retry_count} de {max_retries}: {str(e)}")
+                else:
+                    raise Exception(f"Error después de {max_retries} intentos: {str(e)}")
+            finally:
+                self.release_transfer()
+        
+        # Si la conversión no llega a hacerse, la próxima ejecución encuentra el
+        # original completo y no lo vuelve a descargar
+        return job
+    
+    def transfer_retried(self, error):
+        # Cortes que download_resumable reanuda por su cuenta: también son errores para el límite
+        if self.download_limit is not None:
+            self.download_limit.record(error=True)
+    
+    def start_conversion(self, job):
+        self.progress.status(f"Convirtiendo: {job['song_name']} - {job['artist']}")
+        # Con etiquetas, la conversión queda fuera del almacén hasta que se escriben
+        # y el fsync y el hash los hace esa etapa sobre el archivo definitivo
+        stored_path = self.store.path_for(job['video_id'])
+        staging_path = self.tagger.staging_path(stored_path, job['track'])
+        return self.transcoder.submit(
+            job['source_path'],
+            staging_path,
+            source_codec=job['source_codec'],
+            source_bitrate=job['source_bitrate'],
+            final=staging_path == stored_path
+        )
+    
+    def start_tagging(self, job, conversion):
+        """Encolar las etiquetas del archivo convertido para cuando termine su conversión (None si no hay).
+
+        Al terminar, el archivo entra en el almacén ya etiquetado.
+        """
+        stored_path = self.store.path_for(job['video_id'])
+        return self.tagger.submit(
+            self.tagger.staging_path(stored_path, job['track']), job['track'],
+            after=conversion, destination=stored_path
+        )
+    
+    def place_track(self, job, video_id, path):
+        """Colocar el audio del almacén con las etiquetas de la canción; si fallan, se enlaza sin ellas.
+
+        Devuelve el resultado del etiquetado, o None si solo se enlazó.
+        """
+        try:
+            tagged = self.tagger.place(self.store, video_id, job['track'], path)
+        except Exception as e:
+            self.progress.status(f"No se pudieron escribir las etiquetas de {job['song_name']}: {str(e)}")
+            self.store.link(video_id, path)
+            return None
+        if tagged is not None:
+            self.metrics.record('etiquetas', tagged['seconds'], job)
+        return tagged
+    
+    def tagging_result(self, job, conversion, tagging):
+        """Tamaño y hash del archivo ya etiquetado; si las etiquetas fallan, la canción se conserva sin ellas."""
+        if tagging is None:
+            return conversion
+        try:
+            tagged = tagging.result()
+        except Exception as e:
+            self.progress.status(f"No se pudieron escribir las etiquetas de {job['song_name']}: {str(e)}")
+            return conversion
+        self.metrics.record('etiquetas', tagged['seconds'], job)
+        return dict(conversion, size=tagged['size'], sha256=tagged['sha256'])
+    
+    def finish_conversion(self, job, future, tagging=None):
+        song_name = job['song_name']
+        artist = job['artist']
+        audio_file_path = job['file_path']
+        
+        # El rename atómico dentro del almacén es el punto en que el archivo queda completo;
+        # la carpeta de la playlist recibe un enlace
+        conversion = future.result()
+        self.metrics.record('conversion', conversion['seconds'], job)
+        os.remove(job['source_path'])
+        # Las etiquetas se escriben antes de que el archivo entre en el almacén y se enlace
+        conversion = self.tagging_result(job, conversion, tagging)
+        # Archivo terminado en el almacén: quien espera el mismo video ya lo puede enlazar
+        self.release_video(job)
+        self.store.link(job['video_id'], audio_file_path)
+        
+        self.set_track_progress(job, 100)
+        mode = "sin recodificar" if conversion['mode'] == 'copy' else "convertido"
+        self.progress.status(
+            f"✅ Descargado: {song_name} - {artist} ({conversion['size']} bytes, {mode}) en {self.download_dir}"
+        )
+        
+        # Registrar la canción para que la próxima sincronización la omita
+        if self.manifest is not None:
+            self.manifest.record(
+                job['key'], job['video_id'], audio_file_path, conversion['size'], conversion['sha256']
+            )
+        
+        return job
+    
+    def convert_track(self, job):
+        future = self.start_conversion(job)
+        return self.finish_conversion(job, future, self.start_tagging(job, future))
+    
+    def conversion_done(self, job, future, tagging=None, finished=None):
+        try:
+            if future.cancelled() or (tagging is not None and tagging.cancelled()):
+                return
+            self.finish_conversion(job, future, tagging)
+        except Exception as e:
+            self.track_failed('conversion', job, e)
+        finally:
+            if finished is not None:
+                finished.release()
+    
+    def extract_playlist_id(self, url):
+        return extract_playlist_id(url)
+    
+    def stop(self):
+        self.is_running = False
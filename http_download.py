@@ -0,0 +1,139 @@
+import hashlib
+import os
+import re
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _total_from_response(response, offset):
+    """Obtener el tamaño total del recurso a partir de Content-Range o Content-Length."""
+    content_range = response.headers.get('Content-Range', '')
+    match = re.search(r'/(\d+)$', content_range)
+    if match:
+        return int(match.group(1))
+    length = response.headers.get('Content-Length')
+    if length is not None:
+        return offset + int(length) if response.status_code == 206 else int(length)
+    return None
+
+
+def update_digest_from_file(path, hasher, chunk_size=1024 * 1024):
+    """Añadir al hash el contenido ya escrito de un archivo (al reanudar un .part)."""
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+
+
+def fsync_file(path):
+    """Forzar a disco un único archivo (en lugar de un os.sync() global)."""
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def check_download(size, expected_size=None, sha256=None, expected_sha256=None, min_size=1024):
+    """Verificación única de una descarga, sin volver a leer el archivo.
+
+    Comprueba el tamaño contado durante la descarga contra el mínimo y, si se
+    conocen, contra el tamaño y el SHA-256 esperados.
+    """
+    if size < min_size:  # Menos de 1KB probablemente es un error
+        raise Exception(f"El archivo descargado es demasiado pequeño: {size} bytes")
+    if expected_size and size != expected_size:
+        raise Exception(f"Tamaño incorrecto: se recibieron {size} de {expected_size} bytes")
+    if expected_sha256 and sha256 and sha256 != expected_sha256:
+        raise Exception("El hash del archivo descargado no coincide")
+
+
+def download_resumable(url, part_path, final_path=None, session=None, expected_size=None,
+                       timeout=30, max_attempts=5, on_progress=None, is_running=None, on_retry=None,
+                       digest=True, durable=True):
+    """Descargar `url` en `part_path` reanudando con peticiones Range tras un corte.
+
+    Si `part_path` ya contiene bytes (de un intento o ejecución anterior) se pide
+    solo el resto. El SHA-256 se calcula con cada bloque recibido, así está
+    listo al terminar sin releer el archivo. Al completarse se hace un único
+    fsync del archivo y, si se indica `final_path`, se renombra de forma
+    atómica. Devuelve `(tamaño, sha256)`, o None si se canceló (el `.part` se
+    conserva para reanudar más tarde). `on_retry(error)` recibe cada error de
+    red tras el que se reanuda, que de otro modo no llega a quien llama.
+
+    Para un original temporal, que se borra tras convertirlo, `digest=False`
+    evita el hash (y releer el `.part` al reanudar; el sha256 devuelto es None)
+    y `durable=False` el fsync.
+    """
+    # requests se importa con la primera descarga, no al arrancar la aplicación
+    import requests
+
+    # Errores de red tras los que se puede reanudar desde el último byte escrito
+    resumable_errors = (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    )
+    session = session or requests.Session()
+    is_running = is_running or (lambda: True)
+    total = expected_size
+    attempt = 0
+    hasher = hashlib.sha256() if digest else None
+    if hasher is not None and os.path.exists(part_path):
+        update_digest_from_file(part_path, hasher)
+
+    while True:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if total and offset >= total:
+            break
+
+        start_offset = offset
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 416 and offset:
+                    # El servidor indica que no queda nada por enviar
+                    break
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # El servidor ignoró el Range: empezar de cero
+                    offset = 0
+                    hasher = hashlib.sha256() if digest else None
+                total = total or _total_from_response(response, offset)
+
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        if not is_running():
+                            return None
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        offset += len(chunk)
+                        if on_progress:
+                            on_progress(offset, total)
+
+                    if durable and (total is None or offset >= total):
+                        # Durabilidad: un solo fsync del archivo propio antes del rename
+                        f.flush()
+                        os.fsync(f.fileno())
+
+            if total is None or offset >= total:
+                break
+            # La conexión terminó antes de tiempo sin error: tratarlo como un corte
+            raise requests.exceptions.ChunkedEncodingError(
+                f"Conexión cerrada tras {offset} de {total} bytes"
+            )
+        except resumable_errors as e:
+            if on_retry:
+                on_retry(e)
+            # Solo cuentan como fallidos los intentos que no avanzaron nada
+            attempt = 0 if offset > start_offset else attempt + 1
+            if not is_running():
+                return None
+            if attempt >= max_attempts:
+                raise
+            time.sleep(min(2 ** attempt, 10) * 0.5)
+
+    size = os.path.getsize(part_path)
+    if final_path:
+        os.replace(part_path, final_path)
+    return size, hasher.hexdigest() if hasher is not None else None
@@ -0,0 +1,310 @@
+import itertools
+import threading
+import time
+
+from rate_limit import TokenBucket
+from settings import env_int
+
+# Estados de un trabajo de la cola
+QUEUED = 'en cola'
+RUNNING = 'descargando'
+PAUSED = 'en pausa'
+DONE = 'completada'
+FAILED = 'error'
+CANCELLED = 'cancelada'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# Cada cuánto vuelven a mirar la cancelación los hilos en espera (pausa o hueco de transferencia)
+POLL_INTERVAL = 0.2
+
+
+class QueueJob:
+    """Una playlist de la cola de descargas: prioridad, estado, progreso y pausa.
+
+    El hilo de descarga recibe el trabajo como `control`: antes de cada etapa
+    espera con `wait_if_paused()` y deja de transferir mientras `paused` es
+    verdadero. Con mayor `priority` se descarga antes.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, url, priority=0):
+        self.id = next(self._ids)
+        self.url = url
+        self.priority = priority
+        self.state = QUEUED
+        self.percent = 0
+        self.message = ''
+        self.cancelled = False
+        # Hilo que descarga el trabajo, una vez arrancado (con método `stop()`)
+        self.worker = None
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    @property
+    def paused(self):
+        return not self._resumed.is_set()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def wait_if_paused(self, is_running=None):
+        """Bloquear mientras el trabajo está en pausa; devuelve False si se canceló."""
+        is_running = is_running or (lambda: True)
+        while not self._resumed.wait(POLL_INTERVAL):
+            if not is_running():
+                return False
+        return is_running()
+
+    async def wait_if_paused_async(self, is_running=None):
+        """Versión de `wait_if_paused` para el motor asyncio."""
+        import asyncio
+
+        is_running = is_running or (lambda: True)
+        while self.paused:
+            if not is_running():
+                return False
+            await asyncio.sleep(POLL_INTERVAL)
+        return is_running()
+
+    def __repr__(self):
+        return f"QueueJob({self.id}, {self.url!r}, {self.state!r}, prioridad={self.priority})"
+
+
+class TransferBudget:
+    """Presupuesto de transferencias que comparten todos los trabajos de la cola.
+
+    Limita las descargas simultáneas entre todas las playlists
+    (`max_transfers`) y, si se indica, los bytes por segundo entre todas
+    (`max_rate`, 0 = sin límite). Cuando se libera un hueco lo recibe el
+    trabajo en espera de mayor prioridad que no está en pausa; con la misma
+    prioridad, el que lleva más tiempo esperando.
+    """
+
+    def __init__(self, max_transfers=None, max_rate=None):
+        self.max_transfers = max_transfers or env_int('QUEUE_MAX_TRANSFERS', 6)
+        self._cond = threading.Condition()
+        self._active = 0
+        # Turnos en espera: (orden de llegada, trabajo)
+        self._waiting = []
+        self._order = itertools.count()
+        self._bucket = None
+        self.set_rate(env_int('QUEUE_MAX_KBPS', 0) * 1024 if max_rate is None else max_rate)
+
+    @property
+    def active(self):
+        with self._cond:
+            return self._active
+
+    def set_rate(self, max_rate):
+        """Cambiar el límite de bytes por segundo (0 = sin límite), también con descargas en curso."""
+        self.max_rate = max_rate or 0
+        # Ráfaga de un segundo de transferencia
+        self._bucket = TokenBucket(self.max_rate) if self.max_rate else None
+
+    def set_max_transfers(self, max_transfers):
+        with self._cond:
+            self.max_transfers = max(1, max_transfers)
+            self._cond.notify_all()
+
+    def wake(self):
+        """Reevaluar los turnos (tras un cambio de prioridad o una pausa)."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def _take(self, ticket):
+        # Se llama con el lock tomado
+        if self._active >= self.max_transfers:
+            return False
+        candidates = [t for t in self._waiting if t[1] is None or not t[1].paused]
+        if not candidates:
+            return False
+        best = min(candidates, key=lambda t: (-(t[1].priority if t[1] is not None else 0), t[0]))
+        if best is not ticket:
+            return False
+        self._waiting.remove(ticket)
+        self._active += 1
+        return True
+
+    def _leave(self, ticket):
+        with self._cond:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def acquire(self, control=None, is_running=None):
+        """Esperar un hueco de transferencia para `control`; devuelve False si se canceló antes."""
+        is_running = is_running or (lambda: True)
+        ticket = (next(self._order), control)
+        with self._cond:
+            self._waiting.append(ticket)
+        try:
+            with self._cond:
+                while not self._take(ticket):
+                    if not is_running():
+                        return False
+                    self._cond.wait(POLL_INTERVAL)
+            return True
+        finally:
+            self._leave(ticket)
+
+    async def acquire_async(self, control=None, is_running=None):
+        """Versión de `acquire` para el motor asyncio (no bloquea el bucle)."""
+        import asyncio
+
+        is_running = is_running or (lambda: True)
+        ticket = (next(self._order), control)
+        with self._cond:
+            self._waiting.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    if self._take(ticket):
+                        return True
+                if not is_running():
+                    return False
+                await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            self._leave(ticket)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def throttle(self, nbytes):
+        """Segundos que hay que esperar tras recibir `nbytes` para no pasar del límite común."""
+        bucket = self._bucket
+        if bucket is None or nbytes <= 0:
+            return 0.0
+        return bucket.reserve(nbytes)
+
+    def consume(self, nbytes):
+        wait = self.throttle(nbytes)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class JobQueue:
+    """Cola de playlists por prioridad con un máximo de trabajos descargando a la vez.
+
+    No depende de Qt: `start_job(job)` crea y arranca el hilo de descarga del
+    trabajo (y lo guarda en `job.worker`), y quien lo escucha llama a `finish()`
+    cuando termina. Un trabajo en pausa no ocupa plaza, así mientras está
+    parado empieza el siguiente de la cola. Todos comparten `budget`.
+    """
+
+    def __init__(self, start_job, max_active=None, budget=None):
+        self.start_job = start_job
+        self.max_active = max_active or env_int('QUEUE_MAX_JOBS', 2)
+        self.budget = budget or TransferBudget()
+        self.jobs = []
+        self._lock = threading.RLock()
+
+    def add(self, url, priority=0):
+        """Añadir una playlist a la cola; empieza con el siguiente `dispatch()`."""
+        job = QueueJob(url, priority)
+        with self._lock:
+            self.jobs.append(job)
+        return job
+
+    def pending(self):
+        """Trabajos por empezar, en el orden en que se arrancarán."""
+        with self._lock:
+            queued = [job for job in self.jobs if job.state == QUEUED]
+        return sorted(queued, key=lambda job: (-job.priority, job.id))
+
+    def active(self):
+        with self._lock:
+            return [job for job in self.jobs if job.state == RUNNING]
+
+    def dispatch(self):
+        """Arrancar trabajos de la cola, de mayor a menor prioridad, hasta llenar las plazas."""
+        started = []
+        with self._lock:
+            free = self.max_active - len(self.active())
+            for job in self.pending()[:max(0, free)]:
+                job.state = RUNNING
+                started.append(job)
+        for job in started:
+            try:
+                self.start_job(job)
+            except Exception as e:
+                job.state = FAILED
+                job.message = f"Error: {str(e)}"
+        return started
+
+    def set_priority(self, job, priority):
+        job.priority = priority
+        self.budget.wake()
+
+    def pause(self, job):
+        with self._lock:
+            if job.finished or job.paused:
+                return
+            job.pause()
+            job.state = PAUSED
+        # Sus transferencias dejan el hueco a otros trabajos y su plaza la ocupa el siguiente
+        self.budget.wake()
+        self.dispatch()
+
+    def resume(self, job):
+        with self._lock:
+            if job.finished or not job.paused:
+                return
+            job.resume()
+            job.state = RUNNING if job.worker is not None else QUEUED
+        self.budget.wake()
+        self.dispatch()
+
+    def cancel(self, job):
+        with self._lock:
+            if job.finished:
+                return
+            job.cancelled = True
+            if job.worker is None:
+                job.state = CANCELLED
+            else:
+                # El estado final llega con finish() cuando el hilo termina
+                job.worker.stop()
+            job.resume()
+        self.budget.wake()
+
+    def finish(self, job, success, message):
+        """Anotar el resultado de un trabajo y arrancar los siguientes de la cola."""
+        with self._lock:
+            job.resume()
+            job.message = message
+            if success:
+                job.state = DONE
+                job.percent = 100
+            else:
+                job.state = CANCELLED if job.cancelled else FAILED
+        return self.dispatch()
+
+    def overall_progress(self):
+        """Progreso conjunto (0-100) de los trabajos no cancelados."""
+        with self._lock:
+            jobs = [job for job in self.jobs if job.state != CANCELLED]
+        if not jobs:
+            return 0
+        return sum(100 if job.finished else job.percent for job in jobs) // len(jobs)
+
+    def idle(self):
+        with self._lock:
+            return all(job.finished for job in self.jobs)
+
+    def stop_all(self):
+        """Cancelar todos los trabajos sin terminar (al cerrar la aplicación)."""
+        with self._lock:
+            jobs = [job for job in self.jobs if not job.finished]
+        for job in jobs:
+            self.cancel(job)
+        return jobs
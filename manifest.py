@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+
+from storage import load_json, save_json
+
+MANIFEST_NAME = '.manifest.json'
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Calcular el SHA-256 de un archivo leyéndolo por bloques."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PlaylistManifest:
+    """Registro local de las canciones ya descargadas en una carpeta de playlist.
+
+    Cada entrada se guarda bajo el ID de Spotify de la canción con el video de
+    YouTube usado, el nombre del archivo, su tamaño y su hash. Permite saber qué
+    canciones siguen intactas en disco para no volver a descargarlas.
+    """
+
+    def __init__(self, download_dir):
+        self.download_dir = download_dir
+        self.path = os.path.join(download_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        data = load_json(self.path, {})
+        self.entries = data.get('tracks', {}) if isinstance(data, dict) else {}
+
+    def file_path(self, entry):
+        return os.path.join(self.download_dir, entry['file'])
+
+    def path_for(self, track_key):
+        """Ruta del archivo registrado para la canción, o None si no está en el manifiesto."""
+        with self._lock:
+            entry = self.entries.get(track_key)
+        return self.file_path(entry) if entry else None
+
+    def is_current(self, track_key, video_id=None, extension=None):
+        """Indicar si la canción ya está descargada y su archivo no ha cambiado.
+
+        Solo se compara el tamaño para que la comprobación sea instantánea; si se
+        conoce el video actual y difiere del registrado, la canción cambió. Con
+        `extension`, un archivo guardado en otro formato también cuenta como cambiado.
+        """
+        with self._lock:
+            entry = self.entries.get(track_key)
+        if not entry:
+            return False
+        if video_id and entry.get('video_id') != video_id:
+            return False
+        if extension and not entry['file'].endswith(f".{extension}"):
+            return False
+        try:
+            return os.path.getsize(self.file_path(entry)) == entry.get('size')
+        except OSError:
+            return False
+
+    def record(self, track_key, video_id, path, size=None, sha256=None):
+        """Registrar una canción descargada correctamente."""
+        if size is None:
+            size = os.path.getsize(path)
+        if sha256 is None:
+            sha256 = file_sha256(path)
+        relative = os.path.relpath(path, self.download_dir)
+        with self._lock:
+            previous = self.entries.get(track_key)
+            self.entries[track_key] = {
+                'video_id': video_id,
+                'file': relative,
+                'size': size,
+                'sha256': sha256,
+            }
+            # El archivo anterior en otro formato ya no corresponde a ninguna entrada
+            if previous and previous['file'] != relative:
+                if not any(e['file'] == previous['file'] for e in self.entries.values()):
+                    try:
+                        os.remove(self.file_path(previous))
+                    except FileNotFoundError:
+                        pass
+
+    def prune(self, current_keys):
+        """Eliminar del disco y del manifiesto las canciones que ya no están en la playlist.
+
+        Devuelve la lista de archivos eliminados.
+        """
+        current_keys = set(current_keys)
+        removed = []
+        with self._lock:
+            stale = [key for key in self.entries if key not in current_keys]
+            for key in stale:
+                entry = self.entries.pop(key)
+                path = self.file_path(entry)
+                # No borrar un archivo que otra entrada vigente sigue usando
+                if any(e['file'] == entry['file'] for e in self.entries.values()):
+                    continue
+                try:
+                    os.remove(path)
+                    removed.append(path)
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def save(self):
+        with self._lock:
+            data = {'tracks': dict(self.entries)}
+        save_json(self.path, data)
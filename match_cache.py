@@ -0,0 +1,242 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from settings import CACHE_DIR, env_int
+from storage import load_json
+
+DEFAULT_PATH = os.path.join(CACHE_DIR, 'matches.sqlite3')
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 50000
+
+# Escrituras pendientes tras las que se confirma la transacción
+COMMIT_EVERY = 100
+# Máximo de parámetros por consulta (límite de SQLite en versiones antiguas)
+LOOKUP_CHUNK = 900
+
+COLUMNS = ('key', 'video_id', 'title', 'duration', 'score', 'created', 'used')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    key TEXT PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    title TEXT,
+    duration INTEGER,
+    score INTEGER,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+)
+"""
+
+
+def track_keys(track, query=None):
+    """Claves del índice para una canción, de la más a la menos fiable: ID de Spotify, ISRC y búsqueda."""
+    keys = []
+    if track is not None and track.id:
+        keys.append(f"id:{track.id}")
+    if track is not None and track.isrc:
+        keys.append(f"isrc:{track.isrc.upper()}")
+    if query:
+        keys.append(f"q:{query.strip().lower()}")
+    return keys
+
+
+class MatchCache:
+    """Índice local (SQLite) de coincidencias Spotify -> YouTube Music.
+
+    Cada coincidencia se guarda bajo el ID de Spotify y el ISRC de la canción,
+    así una misma grabación en otra playlist (o con otro ID de Spotify) se
+    encuentra sin buscar; los archivos locales, sin ninguno de los dos, se
+    guardan bajo el texto de búsqueda. Junto al `videoId` se guardan el título,
+    la duración y la puntuación del resultado elegido.
+
+    `preload()` consulta de una vez todas las canciones de una página de la
+    playlist; solo las que no están pasan a la búsqueda en red. `export()` e
+    `import_file()` permiten compartir el índice entre equipos.
+
+    Las entradas caducan tras `ttl` segundos y, si se supera `max_entries`, se
+    eliminan las usadas hace más tiempo al guardar.
+    """
+
+    def __init__(self, path=None, ttl=None, max_entries=None):
+        self.path = path or DEFAULT_PATH
+        self.ttl = ttl if ttl is not None else env_int('MATCH_CACHE_TTL_DAYS', DEFAULT_TTL_DAYS) * 86400
+        self.max_entries = max_entries if max_entries is not None else env_int('MATCH_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        self._lock = threading.Lock()
+        # Entradas ya consultadas con preload(): clave -> (video_id, created) o None si no está
+        self._memory = {}
+        self._used = set()
+        self._pending = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        is_new = not os.path.exists(self.path)
+        # Una conexión compartida por los hilos de búsqueda, protegida por el lock
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(SCHEMA)
+        self._db.commit()
+        # La caché JSON de versiones anteriores (`matches.json`) se importa la primera vez
+        legacy_path = os.path.splitext(self.path)[0] + '.json'
+        if is_new and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    def _import_legacy(self, path):
+        data = load_json(path, {})
+        if not isinstance(data, dict):
+            return
+        rows = [
+            (key, entry['video_id'], None, None, None, entry.get('created', 0), entry.get('used', 0))
+            for key, entry in data.items()
+            if isinstance(entry, dict) and entry.get('video_id')
+        ]
+        with self._lock:
+            self._db.executemany(f"INSERT OR IGNORE INTO matches VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+            self._db.commit()
+
+    def _fetch(self, keys):
+        # Se llama con el lock tomado
+        found = {}
+        for start in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[start:start + LOOKUP_CHUNK]
+            rows = self._db.execute(
+                f"SELECT key, video_id, created FROM matches WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk
+            )
+            for key, video_id, created in rows:
+                found[key] = (video_id, created)
+        return found
+
+    def preload(self, tracks):
+        """Consultar de una vez las coincidencias de varias canciones, pares `(track, query)`.
+
+        Devuelve cuántas se encontraron; las siguientes llamadas a `get()` para
+        esas canciones no vuelven a consultar la base de datos.
+        """
+        keys = list(dict.fromkeys(key for track, query in tracks for key in track_keys(track, query)))
+        with self._lock:
+            keys = [key for key in keys if key not in self._memory]
+            found = self._fetch(keys)
+            for key in keys:
+                self._memory[key] = found.get(key)
+        return sum(1 for track, query in tracks if self.get(track, query, touch=False))
+
+    def get(self, track, query=None, touch=True):
+        """Devolver el videoId guardado para la canción o None si no hay o caducó."""
+        now = time.time()
+        keys = track_keys(track, query)
+        with self._lock:
+            missing = [key for key in keys if key not in self._memory]
+            if missing:
+                found = self._fetch(missing)
+                for key in missing:
+                    self._memory[key] = found.get(key)
+            for key in keys:
+                entry = self._memory[key]
+                if entry is None:
+                    continue
+                video_id, created = entry
+                if now - created > self.ttl:
+                    self._memory[key] = None
+                    self._db.execute("DELETE FROM matches WHERE key = ?", (key,))
+                    self._pending += 1
+                    continue
+                if touch:
+                    self._used.add(key)
+                return video_id
+        return None
+
+    def put(self, track, query, video_id, candidate=None, score=None):
+        """Guardar la coincidencia bajo el ID de Spotify y el ISRC, o bajo la búsqueda si no hay ninguno.
+
+        `candidate` es el resultado elegido (título y duración) y `score` su puntuación.
+        """
+        if not video_id:
+            return
+        keys = track_keys(track, query)
+        if not keys:
+            return
+        if keys[0].startswith(('id:', 'isrc:')):
+            keys = [key for key in keys if not key.startswith('q:')]
+        else:
+            keys = keys[:1]
+        candidate = candidate or {}
+        now = time.time()
+        rows = [(key, video_id, candidate.get('title'), candidate.get('duration'), score, now, now) for key in keys]
+        with self._lock:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO matches VALUES ({', '.join('?' * len(COLUMNS))})", rows
+            )
+            for key in keys:
+                self._memory[key] = (video_id, now)
+            self._pending += len(rows)
+            if self._pending >= COMMIT_EVERY:
+                self._db.commit()
+                self._pending = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+
+    def _evict(self):
+        # Se llama con el lock tomado
+        self._db.execute("DELETE FROM matches WHERE created < ?", (time.time() - self.ttl,))
+        self._db.execute(
+            "DELETE FROM matches WHERE key IN ("
+            " SELECT key FROM matches ORDER BY used DESC LIMIT -1 OFFSET ?"
+            ")",
+            (self.max_entries,)
+        )
+
+    def save(self):
+        """Anotar los usos, aplicar la expulsión por TTL y tamaño y confirmar los cambios."""
+        now = time.time()
+        with self._lock:
+            used, self._used = list(self._used), set()
+            self._db.executemany("UPDATE matches SET used = ? WHERE key = ?", [(now, key) for key in used])
+            self._evict()
+            self._db.commit()
+            self._pending = 0
+            # Las consultas de preload() eran para esta ejecución; en la siguiente se vuelve a la base
+            self._memory.clear()
+
+    def export(self, path):
+        """Escribir todas las coincidencias en `path` (JSON Lines, una por línea) y devolver cuántas."""
+        self.save()
+        count = 0
+        temp_path = path + '.part'
+        with self._lock, open(temp_path, 'w', encoding='utf-8') as f:
+            for row in self._db.execute(f"SELECT {', '.join(COLUMNS)} FROM matches ORDER BY key"):
+                f.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n')
+                count += 1
+        os.replace(temp_path, path)
+        return count
+
+    def import_file(self, path):
+        """Añadir las coincidencias de un archivo de `export()`; gana la más reciente. Devuelve cuántas se leyeron."""
+        rows = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get('key') and entry.get('video_id'):
+                    rows.append(tuple(entry.get(column) for column in COLUMNS))
+        with self._lock:
+            self._db.executemany(
+                f"INSERT INTO matches VALUES ({', '.join('?' * len(COLUMNS))}) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                + ', '.join(f"{column} = excluded.{column}" for column in COLUMNS[1:])
+                + " WHERE excluded.created > matches.created",
+                rows
+            )
+            self._db.commit()
+            self._memory.clear()
+        return len(rows)
+
+    def close(self):
+        self.save()
+        with self._lock:
+            self._db.close()
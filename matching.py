@@ -0,0 +1,167 @@
+import re
+import unicodedata
+
+from settings import env_int
+
+# Peso de cada criterio en la puntuación (sobre 100). Los criterios sin datos
+# en alguno de los dos lados no cuentan y el resto se reparte su peso.
+WEIGHTS = {'duration': 40, 'artists': 30, 'title': 20, 'album': 10}
+
+# Diferencia de duración (segundos) que se acepta sin penalizar y a partir de la cual el criterio vale 0
+DURATION_TOLERANCE = 3
+DURATION_LIMIT = 20
+
+# Versiones distintas de la grabación original: si aparecen en el título del
+# candidato y no en el de Spotify, la puntuación se reduce a la mitad
+VERSION_KEYWORDS = (
+    'live', 'en vivo', 'en directo', 'remix', 'cover', 'karaoke', 'instrumental',
+    'extended', 'sped up', 'slowed', 'nightcore', 'acoustic', 'acustico', '8d', 'demo',
+)
+VERSION_PENALTY = 0.5
+
+# Partes del título de Spotify que no aparecen en YouTube: "(feat. X)", "- Remastered 2011"...
+_TITLE_EXTRAS = re.compile(r'\((?:feat|ft|with)\.?[^)]*\)|\[(?:feat|ft)\.?[^\]]*\]|\s-\s.*(?:remaster|version|versión|edit).*$', re.I)
+# Sufijos de canales de YouTube: "Artista - Topic", "ArtistaVEVO", "Artista Official"
+_CHANNEL_SUFFIX = re.compile(r'(?:\s*-\s*topic|vevo|official)$', re.I)
+
+
+def normalize_text(text):
+    """Minúsculas, sin acentos ni puntuación, con los espacios simplificados."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return ' '.join(re.sub(r'[^\w]+', ' ', text).split())
+
+
+def _compact(text):
+    return normalize_text(text).replace(' ', '')
+
+
+def parse_duration(value):
+    """Convertir '3:45' o '1:02:03' a segundos; None si no se puede."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        seconds = 0
+        for part in str(value).split(':'):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def candidate_from_ytmusic(result):
+    """Reducir un resultado de `YTMusic.search(filter='songs')` a un candidato."""
+    return {
+        'video_id': result.get('videoId'),
+        'title': result.get('title') or '',
+        'artists': [artist['name'] for artist in result.get('artists') or () if artist.get('name')],
+        'album': (result.get('album') or {}).get('name'),
+        'duration': result.get('duration_seconds') or parse_duration(result.get('duration')),
+    }
+
+
+def candidate_from_ytdlp(entry):
+    """Reducir una entrada de `ytsearchN:` de yt-dlp a un candidato (el canal hace de artista)."""
+    artist = entry.get('artist') or entry.get('channel') or entry.get('uploader')
+    return {
+        'video_id': entry.get('id'),
+        'title': entry.get('track') or entry.get('title') or '',
+        'artists': [_CHANNEL_SUFFIX.sub('', artist).strip()] if artist else [],
+        'album': entry.get('album'),
+        'duration': parse_duration(entry.get('duration')),
+    }
+
+
+def _duration_score(track, candidate):
+    if not track.duration_ms or not candidate['duration']:
+        return None
+    difference = abs(track.duration_ms / 1000 - candidate['duration'])
+    if difference <= DURATION_TOLERANCE:
+        return 1.0
+    return max(0.0, 1 - (difference - DURATION_TOLERANCE) / (DURATION_LIMIT - DURATION_TOLERANCE))
+
+
+def _artists_score(track, candidate):
+    if not track.artists:
+        return None
+    # En YouTube el artista a veces solo aparece en el título ("Artista - Canción")
+    haystack = _compact(' '.join(candidate['artists']) + ' ' + candidate['title'])
+    found = sum(1 for artist in track.artists if _compact(artist) and _compact(artist) in haystack)
+    return found / len(track.artists)
+
+
+def _title_score(track, candidate):
+    expected = set(normalize_text(_TITLE_EXTRAS.sub('', track.title)).split())
+    if not expected:
+        return None
+    return len(expected & set(normalize_text(candidate['title']).split())) / len(expected)
+
+
+def _album_score(track, candidate):
+    if not track.album or not candidate['album']:
+        return None
+    expected, actual = _compact(track.album), _compact(candidate['album'])
+    return 1.0 if expected in actual or actual in expected else 0.0
+
+
+def _is_other_version(track, candidate):
+    expected = f" {normalize_text(track.title)} "
+    actual = f" {normalize_text(candidate['title'])} "
+    return any(f" {word} " in actual and f" {word} " not in expected for word in VERSION_KEYWORDS)
+
+
+SCORERS = {
+    'duration': _duration_score,
+    'artists': _artists_score,
+    'title': _title_score,
+    'album': _album_score,
+}
+
+
+def score_candidate(track, candidate):
+    """Puntuación de 0 a 100 de lo bien que `candidate` corresponde a la canción de Spotify."""
+    total = 0.0
+    weight = 0
+    for name, scorer in SCORERS.items():
+        value = scorer(track, candidate)
+        if value is not None:
+            total += WEIGHTS[name] * value
+            weight += WEIGHTS[name]
+    if not weight:
+        return 0
+    score = total / weight
+    if _is_other_version(track, candidate):
+        score *= VERSION_PENALTY
+    return round(score * 100)
+
+
+class TrackMatcher:
+    """Elige entre los primeros resultados de la búsqueda el que corresponde a la canción.
+
+    Compara cada candidato con la duración, los artistas, el título y el álbum
+    de Spotify y se queda con el mejor si alcanza `min_score`. Es solo
+    cálculo en memoria: una coincidencia dudosa se descarta antes de resolver
+    el stream o descargar nada.
+    """
+
+    def __init__(self, candidates=None, min_score=None):
+        self.candidates = candidates or env_int('MATCH_CANDIDATES', 5)
+        self.min_score = env_int('MATCH_MIN_SCORE', 65) if min_score is None else min_score
+
+    def select(self, track, candidates):
+        """Devolver `(candidato, puntuación)`; el candidato es None si ninguno llega al mínimo.
+
+        Con la misma puntuación gana el que aparece antes en la búsqueda.
+        """
+        best, best_score = None, -1
+        for candidate in candidates[:self.candidates]:
+            if not candidate['video_id']:
+                continue
+            score = score_candidate(track, candidate)
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is None or best_score < self.min_score:
+            return None, max(best_score, 0)
+        return best, best_score
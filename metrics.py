@@ -0,0 +1,213 @@
+import csv
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from settings import BASE_DIR
+from storage import save_json
+
+# Etapas que se miden, en el orden en que recorre cada canción
+STAGES = ('listado', 'busqueda', 'resolucion', 'descarga', 'conversion', 'etiquetas', 'verificacion')
+
+# Límites superiores (en segundos) de los intervalos del histograma de latencias
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Motivos de reintento que se guardan por canción
+MAX_REASONS = 5
+
+DEFAULT_REPORT_DIR = os.path.join(BASE_DIR, 'reports')
+REPORT_FORMATS = ('json', 'csv')
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _histogram(values):
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for value in values:
+        for i, limit in enumerate(HISTOGRAM_BUCKETS):
+            if value <= limit:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    labels = [f"<={limit}s" for limit in HISTOGRAM_BUCKETS] + [f">{HISTOGRAM_BUCKETS[-1]}s"]
+    return dict(zip(labels, counts))
+
+
+def default_report_path(fmt=None):
+    """Ruta del informe de una ejecución: `reports/run-<fecha y hora>.<formato>` o `RUN_REPORT_DIR`."""
+    fmt = (fmt or os.getenv('RUN_REPORT_FORMAT') or 'json').strip().lower()
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Formato de informe no válido: {fmt} (usa {', '.join(REPORT_FORMATS)})")
+    directory = os.getenv('RUN_REPORT_DIR') or DEFAULT_REPORT_DIR
+    return os.path.join(directory, f"run-{datetime.now():%Y%m%d-%H%M%S-%f}.{fmt}")
+
+
+class RunMetrics:
+    """Mediciones de una ejecución: tiempo de cada etapa por canción, bytes, reintentos y fallos.
+
+    Las etapas se miden con `stage()` o se registran con `record()` desde
+    cualquier hilo. `summary()` calcula por etapa el número de mediciones,
+    percentiles, histograma de latencias y bytes por segundo, y `write()`
+    guarda el informe en JSON (completo) o CSV (una fila por canción).
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self._start = time.monotonic()
+        self._end = None
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._bytes = {}
+        self._tracks = {}
+        self.extra = {}
+
+    def _track(self, job):
+        # Se llama con el lock tomado
+        track = self._tracks.get(job['key'])
+        if track is None:
+            track = self._tracks[job['key']] = {
+                'title': f"{job['song_name']} - {job['artist']}",
+                'stages': {},
+                'bytes': 0,
+                'retries': 0,
+                'retry_reasons': [],
+                'status': 'ok',
+                'failed_stage': None,
+                'error': None,
+            }
+        return track
+
+    def record(self, stage, seconds, job=None, nbytes=0):
+        """Registrar una medición de `seconds` segundos (y `nbytes` bytes) en la etapa."""
+        with self._lock:
+            self._samples.setdefault(stage, []).append(seconds)
+            self._bytes[stage] = self._bytes.get(stage, 0) + nbytes
+            if job is not None:
+                track = self._track(job)
+                track['stages'][stage] = round(track['stages'].get(stage, 0) + seconds, 4)
+                track['bytes'] += nbytes
+
+    @contextmanager
+    def stage(self, stage, job=None):
+        """Medir el bloque como una ejecución de la etapa, termine bien o con error.
+
+        El bloque puede indicar los bytes transferidos con `span['bytes'] = n`.
+        """
+        span = {'bytes': 0}
+        start = time.monotonic()
+        try:
+            yield span
+        finally:
+            self.record(stage, time.monotonic() - start, job, span['bytes'])
+
+    def retry(self, stage, job, error):
+        """Anotar un reintento de la canción y su motivo (se guardan los últimos)."""
+        with self._lock:
+            track = self._track(job)
+            track['retries'] += 1
+            reasons = track['retry_reasons'] + [f"{stage}: {type(error).__name__}: {error}"]
+            track['retry_reasons'] = reasons[-MAX_REASONS:]
+
+    def fail(self, stage, job, error):
+        """Anotar la etapa y el motivo por el que falló la canción (se conserva el primero)."""
+        with self._lock:
+            track = self._track(job)
+            if track['status'] == 'ok':
+                track['status'] = 'error'
+                track['failed_stage'] = stage
+                track['error'] = f"{type(error).__name__}: {error}"
+
+    def skip(self, job, reason):
+        """Anotar una canción que no se procesó (sin cambios, no encontrada...)."""
+        with self._lock:
+            track = self._track(job)
+            if track['status'] == 'ok':
+                track['status'] = reason
+
+    @property
+    def track_count(self):
+        """Canciones de las que se registró algo (0 si la ejecución no llegó a procesar ninguna)."""
+        with self._lock:
+            return len(self._tracks)
+
+    def finish(self, **extra):
+        """Cerrar la medición de la ejecución y añadir datos generales al informe."""
+        self._end = time.monotonic()
+        self.extra.update(extra)
+
+    def summary(self):
+        end = self._end or time.monotonic()
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            stage_bytes = dict(self._bytes)
+            tracks = {
+                key: dict(track, stages=dict(track['stages']), retry_reasons=list(track['retry_reasons']))
+                for key, track in self._tracks.items()
+            }
+
+        stages = {}
+        for stage in sorted(samples, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+            values = samples[stage]
+            total = sum(values)
+            stages[stage] = {
+                'count': len(values),
+                'total_seconds': round(total, 3),
+                'mean': round(total / len(values), 4),
+                'p50': round(_percentile(values, 0.5), 4),
+                'p90': round(_percentile(values, 0.9), 4),
+                'p99': round(_percentile(values, 0.99), 4),
+                'max': round(values[-1], 4),
+                'bytes': stage_bytes.get(stage, 0),
+                'bytes_per_second': round(stage_bytes.get(stage, 0) / total) if total else 0,
+                'histogram': _histogram(values),
+            }
+
+        statuses = {}
+        for track in tracks.values():
+            statuses[track['status']] = statuses.get(track['status'], 0) + 1
+
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'duration_seconds': round(end - self._start, 3),
+            'tracks': len(tracks),
+            'tracks_by_status': statuses,
+            'retries': sum(track['retries'] for track in tracks.values()),
+            'stages': stages,
+            'track_details': tracks,
+            **self.extra,
+        }
+
+    def write(self, path=None):
+        """Guardar el informe en `path` (JSON o CSV según la extensión) y devolver la ruta."""
+        path = path or default_report_path()
+        summary = self.summary()
+        if path.lower().endswith('.csv'):
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(
+                    ['key', 'title', 'status', 'failed_stage', 'error', 'retries', 'retry_reasons',
+                     'bytes', 'bytes_per_second']
+                    + [f"{stage}_seconds" for stage in STAGES]
+                )
+                for key, track in summary['track_details'].items():
+                    transfer = track['stages'].get('descarga')
+                    writer.writerow(
+                        [key, track['title'], track['status'], track['failed_stage'] or '',
+                         track['error'] or '', track['retries'], ' | '.join(track['retry_reasons']),
+                         track['bytes'], round(track['bytes'] / transfer) if transfer else '']
+                        + [track['stages'].get(stage, '') for stage in STAGES]
+                    )
+        else:
+            save_json(path, summary)
+        return path
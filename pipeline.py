@@ -0,0 +1,118 @@
+import queue
+import threading
+
+# Marcador que indica a los trabajadores de una etapa que no quedan elementos
+_END = object()
+
+
+class Stage:
+    """Etapa del pipeline: una función aplicada a cada elemento por un pool acotado de hilos.
+
+    La función recibe un elemento y devuelve el elemento para la siguiente etapa,
+    o None si el elemento debe descartarse (por ejemplo, canción no encontrada).
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+
+
+class Pipeline:
+    """Ejecuta varias etapas en paralelo conectadas por colas acotadas.
+
+    Cada etapa tiene su propio pool de hilos, de modo que mientras unas canciones
+    se buscan otras se resuelven y otras se descargan. Las colas acotadas evitan
+    que una etapa rápida acumule trabajo ilimitado delante de una lenta.
+    """
+
+    def __init__(self, stages, queue_size=None, is_running=None, on_error=None, on_result=None):
+        if not stages:
+            raise ValueError("El pipeline necesita al menos una etapa")
+        self.stages = stages
+        self.queue_size = queue_size
+        self.is_running = is_running or (lambda: True)
+        self.on_error = on_error
+        self.on_result = on_result
+
+    def run(self, items):
+        """Procesar todos los elementos y bloquear hasta que el pipeline termine.
+
+        `items` puede ser un generador: los elementos entran en la primera etapa
+        a medida que se producen, sin esperar a tenerlos todos.
+
+        Devuelve el número de elementos que salieron de la última etapa.
+        """
+        # Una cola de entrada por etapa, con capacidad proporcional a sus trabajadores
+        queues = []
+        for stage in self.stages:
+            size = self.queue_size if self.queue_size is not None else stage.workers * 2
+            queues.append(queue.Queue(maxsize=size))
+
+        remaining = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+        completed = [0]
+
+        def worker(index):
+            stage = self.stages[index]
+            in_queue = queues[index]
+            out_queue = queues[index + 1] if index + 1 < len(self.stages) else None
+
+            while True:
+                item = in_queue.get()
+                if item is _END:
+                    break
+                # Tras una cancelación se sigue vaciando la cola sin procesar,
+                # así ninguna etapa anterior queda bloqueada en put()
+                if not self.is_running():
+                    continue
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    if self.on_error:
+                        self.on_error(stage.name, item, e)
+                    continue
+                if result is None:
+                    continue
+                if out_queue is not None:
+                    out_queue.put(result)
+                else:
+                    with lock:
+                        completed[0] += 1
+                    if self.on_result:
+                        self.on_result(result)
+
+            # El último trabajador en salir avisa a la etapa siguiente
+            with lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and out_queue is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    out_queue.put(_END)
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=worker,
+                    args=(index,),
+                    name=f"{stage.name}-{n}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in items:
+                if not self.is_running():
+                    break
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_END)
+            # Aunque la fuente de elementos falle (una página de la playlist, por ejemplo),
+            # se espera a que terminen los elementos que ya entraron
+            for thread in threads:
+                thread.join()
+
+        return completed[0]
@@ -0,0 +1,86 @@
+import threading
+
+from settings import env_int
+
+
+class ProgressAggregator:
+    """Capa entre los hilos de descarga y la interfaz que agrupa el progreso y los mensajes.
+
+    Los hilos informan del porcentaje de cada canción y de sus mensajes tantas
+    veces como quieran; solo se publica a `on_progress(current, total)` y
+    `on_status(message)` desde un hilo propio, `hz` veces por segundo y
+    únicamente lo que cambió. El progreso general se mantiene como una suma
+    acumulada, así actualizar una canción cuesta lo mismo con 10 que con 10.000.
+
+    Los mensajes normales se entregan todos y en orden; los transitorios
+    (porcentajes de descarga) se sustituyen unos a otros y solo llega el último.
+    """
+
+    def __init__(self, on_progress=None, on_status=None, total=1, hz=None):
+        self.on_progress = on_progress or (lambda current, total: None)
+        self.on_status = on_status or (lambda message: None)
+        self.interval = 1.0 / (hz or env_int('PROGRESS_HZ', 10))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pending = []
+        self._last_transient = False
+        self.reset(total)
+
+    def reset(self, total):
+        """Empezar de cero el progreso con `total` canciones (los mensajes pendientes se conservan)."""
+        with self._lock:
+            self.total = total or 1
+            self._tracks = {}
+            self._sum = 0
+            self._published = None
+
+    def set_total(self, total):
+        """Corregir el total sin perder el progreso (p. ej. al terminar un listado por páginas)."""
+        with self._lock:
+            self.total = total or 1
+
+    def set_track(self, index, percent):
+        with self._lock:
+            self._sum += percent - self._tracks.get(index, 0)
+            self._tracks[index] = percent
+
+    def status(self, message, transient=False):
+        with self._lock:
+            if transient and self._last_transient:
+                self._pending[-1] = message
+            else:
+                self._pending.append(message)
+            self._last_transient = transient
+
+    def flush(self):
+        """Publicar ahora lo acumulado desde la última publicación."""
+        with self._lock:
+            messages, self._pending = self._pending, []
+            self._last_transient = False
+            current = int(self._sum / self.total)
+            changed = current != self._published
+            self._published = current
+        for message in messages:
+            self.on_status(message)
+        if changed:
+            self.on_progress(current, 100)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Detener el hilo de publicación y entregar lo pendiente (se puede llamar varias veces)."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
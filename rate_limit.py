@@ -0,0 +1,469 @@
+import random
+import re
+import threading
+import time
+
+from settings import env_int
+
+# Límites por defecto (peticiones por segundo, ráfaga) de cada servicio
+DEFAULT_LIMITS = {
+    'spotify': (10, 20),
+    'ytmusic': (5, 10),
+    'youtube': (5, 10),
+    'download': (20, 40),
+    'art': (10, 20),
+}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Cada cuánto vuelven a mirar el cortacircuitos (y la cancelación) las llamadas que esperan
+POLL_INTERVAL = 0.2
+
+
+class CircuitOpenError(Exception):
+    """El servicio falló demasiadas veces seguidas y las llamadas se rechazan temporalmente."""
+
+
+class TokenBucket:
+    """Cubeta de tokens: permite `rate` peticiones por segundo con ráfagas de `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Reservar `tokens` (uno por petición, o bytes en un límite de ancho de banda) y
+        devolver cuántos segundos hay que esperar para usarlos."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def pause(self, seconds):
+        """Vaciar la cubeta para que nadie llame al servicio durante `seconds` (Retry-After)."""
+        with self._lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+            self.updated = time.monotonic()
+
+
+class CircuitBreaker:
+    """Corta las llamadas a un servicio tras `threshold` fallos seguidos durante `reset_timeout` segundos.
+
+    Pasado ese tiempo queda semiabierto: deja pasar una sola llamada de prueba
+    y rechaza las demás hasta que esa informa del resultado. Si va bien se
+    cierra; si falla se vuelve a abrir.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # Inicio de la llamada de prueba en curso (estado semiabierto)
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'cerrado'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'semiabierto'
+            return 'abierto'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            # Semiabierto: solo una llamada de prueba a la vez. Si la anterior no llegó
+            # a informar (se canceló), pasado `reset_timeout` se permite otra
+            if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+                return False
+            self.probe_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started = None
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Terminar la llamada de prueba sin cambiar el estado (un error que no es del servicio)."""
+        with self._lock:
+            self.probe_started = None
+
+    def retry_in(self):
+        """Segundos hasta que `allow()` pueda volver a dejar pasar una llamada (0 si ya puede)."""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            now = time.monotonic()
+            remaining = self.reset_timeout - (now - self.opened_at)
+            if remaining <= 0 and self.probe_started is not None:
+                remaining = self.reset_timeout - (now - self.probe_started)
+            return max(0.0, remaining)
+
+
+def _error_status(error):
+    """Extraer el código HTTP de excepciones de spotipy, requests, aiohttp o ytmusicapi."""
+    for attr in ('http_status', 'status', 'status_code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, 'response', None)
+    if response is not None and isinstance(getattr(response, 'status_code', None), int):
+        return response.status_code
+    # ytmusicapi y yt-dlp solo incluyen el código en el mensaje
+    match = re.search(r'\b(429|50[0234])\b', str(error))
+    return int(match.group(1)) if match else None
+
+
+def _retry_after(error):
+    """Leer la cabecera Retry-After (en segundos) de la respuesta que causó el error."""
+    headers = getattr(error, 'headers', None)
+    if headers is None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_chain(error, depth=5):
+    """El error y los que envuelve: yt-dlp guarda el original en `exc_info`
+    (DownloadError) y en `cause` (ExtractorError y sus errores de red)."""
+    while error is not None and depth > 0:
+        yield error
+        exc_info = getattr(error, 'exc_info', None)
+        cause = getattr(error, 'cause', None)
+        if isinstance(exc_info, tuple) and len(exc_info) > 1 and isinstance(exc_info[1], BaseException) \
+                and exc_info[1] is not error:
+            error = exc_info[1]
+        elif isinstance(cause, BaseException):
+            error = cause
+        else:
+            error = error.__cause__
+        depth -= 1
+
+
+def _is_transient(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # Errores de red de requests, aiohttp y asyncio, sin importar esas librerías aquí.
+    # En Python < 3.11 `asyncio.TimeoutError` no hereda de TimeoutError pero se llama igual
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & {'ConnectionError', 'Timeout', 'TimeoutError', 'ClientConnectionError'}:
+        return True
+    return _error_status(error) in RETRYABLE_STATUS
+
+
+def _is_retryable(error):
+    # Los cortes a mitad de transferencia no cuentan: los reanuda el descargador
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & {'ChunkedEncodingError', 'ClientPayloadError'}:
+        return False
+    # Un video privado, eliminado o bloqueado (DownloadError de yt-dlp sin un
+    # error de red ni un 429/5xx detrás) no se reintenta ni cuenta para el cortacircuitos
+    return any(_is_transient(e) for e in _error_chain(error))
+
+
+class _Counters:
+    """Contadores de peticiones de un servicio: de todo el proceso o de un solo trabajo."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def snapshot(self, breaker):
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'failures': self.failures,
+                'queue_depth': self.waiting,
+                'max_queue_depth': self.max_waiting,
+                'total_wait': round(self.total_wait, 3),
+                'avg_wait': round(self.total_wait / self.calls, 3) if self.calls else 0.0,
+                'max_wait': round(self.max_wait, 3),
+                'breaker': breaker.state,
+            }
+
+
+class _ServiceState(_Counters):
+    def __init__(self, name, rate, burst, threshold, reset_timeout):
+        super().__init__()
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(threshold, reset_timeout)
+
+
+def _summary(stats):
+    parts = []
+    for name, s in sorted(stats.items()):
+        parts.append(
+            f"{name}: {s['calls']} llamadas, {s['retries']} reintentos, {s['throttled']} limitadas (429), "
+            f"cola máx. {s['max_queue_depth']}, espera media {s['avg_wait']}s"
+        )
+    return "; ".join(parts)
+
+
+class RequestScheduler:
+    """Planificador común de peticiones a Spotify, YouTube Music y las descargas.
+
+    Cada servicio tiene su cubeta de tokens y su cortacircuitos. Los errores
+    429/5xx y los fallos de conexión se reintentan respetando `Retry-After` o, si no
+    viene, con espera exponencial con jitter. Con el cortacircuitos abierto las
+    llamadas esperan a que deje pasar la de prueba, hasta `breaker_wait`
+    segundos (o hasta que `keep_waiting()` devuelva False), en lugar de fallar:
+    un corte breve del servicio no hace fallar la cola. `stats()` informa de la cola y
+    del tiempo de espera de cada servicio para ajustar la concurrencia.
+
+    Las estadísticas son de todo el proceso; quien necesite los errores de sus
+    propias llamadas (los que se reintentan no le llegan) pasa `observer`, que
+    recibe `observer(throttled, retried)` por cada error de esa llamada.
+    """
+
+    def __init__(self, limits=None, max_retries=None, base_delay=1.0, max_delay=60.0,
+                 breaker_threshold=5, breaker_reset=30, breaker_wait=None):
+        self.limits = dict(DEFAULT_LIMITS)
+        # Los límites se pueden ajustar desde el .env, p. ej. SPOTIFY_RATE=5
+        for name in self.limits:
+            rate, burst = self.limits[name]
+            self.limits[name] = (env_int(f'{name.upper()}_RATE', rate), env_int(f'{name.upper()}_BURST', burst))
+        self.limits.update(limits or {})
+        self.max_retries = max_retries if max_retries is not None else env_int('SCHEDULER_MAX_RETRIES', 5)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        # Por defecto da tiempo a una o dos pruebas fallidas y a la siguiente
+        self.breaker_wait = breaker_wait if breaker_wait is not None else 3 * breaker_reset
+        self._services = {}
+        self._lock = threading.Lock()
+
+    def service(self, name):
+        with self._lock:
+            state = self._services.get(name)
+            if state is None:
+                rate, burst = self.limits.get(name, (10, 10))
+                state = _ServiceState(name, rate, burst, self.breaker_threshold, self.breaker_reset)
+                self._services[name] = state
+            return state
+
+    def _backoff(self, attempt, error):
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+        # Jitter aleatorio para que los hilos no reintenten todos a la vez
+        return random.uniform(delay / 2, delay)
+
+    def _breaker_delay(self, state, blocked_since, keep_waiting):
+        """None si el cortacircuitos deja pasar la llamada; si no, segundos a esperar antes de volver a mirar."""
+        if state.breaker.allow():
+            return None
+        waited = time.monotonic() - blocked_since if blocked_since is not None else 0.0
+        if waited >= self.breaker_wait or (keep_waiting is not None and not keep_waiting()):
+            raise CircuitOpenError(
+                f"Servicio '{state.name}' en pausa tras {state.breaker.failures} fallos seguidos"
+            )
+        return max(0.01, min(state.breaker.retry_in(), self.breaker_wait - waited, POLL_INTERVAL))
+
+    def _before_call(self, state, counters):
+        for c in counters:
+            with c.lock:
+                c.waiting += 1
+                c.max_waiting = max(c.max_waiting, c.waiting)
+        return state.bucket.reserve()
+
+    def _after_wait(self, counters, waited):
+        for c in counters:
+            with c.lock:
+                c.waiting -= 1
+                c.calls += 1
+                c.total_wait += waited
+                c.max_wait = max(c.max_wait, waited)
+
+    def _on_error(self, state, counters, error, attempt, retry_on):
+        """Registrar el error y devolver los segundos a esperar (o None si no se reintenta) y el siguiente intento."""
+        retryable = _is_retryable(error) or (retry_on is not None and isinstance(error, retry_on))
+        for c in counters:
+            with c.lock:
+                c.failures += 1
+                if _error_status(error) == 429:
+                    c.throttled += 1
+        if not retryable:
+            state.breaker.release_probe()
+            return None, attempt
+        state.breaker.record_failure()
+        # Si el fallo deja el cortacircuitos abierto (o era la llamada de prueba), el
+        # reintento no gasta un intento: espera en _breaker_delay a que se reanude,
+        # como mucho `breaker_wait` segundos en total por llamada
+        paused = state.breaker.state != 'cerrado'
+        if attempt >= self.max_retries and not paused:
+            return None, attempt
+        delay = self._backoff(attempt, error)
+        if _error_status(error) == 429:
+            # Frenar también al resto de hilos que usan el mismo servicio
+            state.bucket.pause(delay)
+        for c in counters:
+            with c.lock:
+                c.retries += 1
+        return delay, attempt if paused else attempt + 1
+
+    def call(self, service, func, *args, retry_on=None, observer=None, keep_waiting=None, tally=None, **kwargs):
+        """Ejecutar `func(*args, **kwargs)` respetando el límite y la política de reintentos del servicio.
+
+        `tally` (de `ScopedScheduler`) cuenta además la llamada para un solo trabajo.
+        """
+        state = self.service(service)
+        counters = (state,) if tally is None else (state, tally)
+        attempt = 0
+        blocked_since = None
+        while True:
+            delay = self._breaker_delay(state, blocked_since, keep_waiting)
+            if delay is not None:
+                blocked_since = blocked_since or time.monotonic()
+                time.sleep(delay)
+                continue
+            wait = self._before_call(state, counters)
+            if wait > 0:
+                time.sleep(wait)
+            self._after_wait(counters, wait)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay, attempt = self._on_error(state, counters, e, attempt, retry_on)
+                if observer is not None:
+                    observer(_error_status(e) == 429, delay is not None)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            state.breaker.record_success()
+            return result
+
+    async def acall(self, service, func, *args, retry_on=None, observer=None, keep_waiting=None, tally=None,
+                    **kwargs):
+        """Versión asíncrona de `call` para corrutinas: `func` debe devolver un awaitable."""
+        import asyncio
+
+        state = self.service(service)
+        counters = (state,) if tally is None else (state, tally)
+        attempt = 0
+        blocked_since = None
+        while True:
+            delay = self._breaker_delay(state, blocked_since, keep_waiting)
+            if delay is not None:
+                blocked_since = blocked_since or time.monotonic()
+                await asyncio.sleep(delay)
+                continue
+            wait = self._before_call(state, counters)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._after_wait(counters, wait)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay, attempt = self._on_error(state, counters, e, attempt, retry_on)
+                if observer is not None:
+                    observer(_error_status(e) == 429, delay is not None)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            state.breaker.record_success()
+            return result
+
+    def stats(self):
+        """Métricas por servicio: llamadas, reintentos, 429, cola y tiempos de espera."""
+        with self._lock:
+            services = list(self._services.values())
+        return {state.name: state.snapshot(state.breaker) for state in services}
+
+    def summary(self):
+        """Resumen legible de `stats()` para mostrar al final de una descarga."""
+        return _summary(self.stats())
+
+    def scoped(self):
+        """Vista del planificador para un trabajo (ver `ScopedScheduler`)."""
+        return ScopedScheduler(self)
+
+
+class ScopedScheduler:
+    """Planificador de un solo trabajo de la cola: comparte límites, cortacircuitos y
+    reintentos con el de todo el proceso, pero `stats()` y `summary()` cuentan solo
+    sus propias llamadas, no las de otras descargas que se ejecutan a la vez.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._tallies = {}
+        self._lock = threading.Lock()
+
+    def _tally(self, service):
+        with self._lock:
+            tally = self._tallies.get(service)
+            if tally is None:
+                tally = self._tallies[service] = _Counters()
+            return tally
+
+    def call(self, service, func, *args, **kwargs):
+        return self.scheduler.call(service, func, *args, tally=self._tally(service), **kwargs)
+
+    async def acall(self, service, func, *args, **kwargs):
+        return await self.scheduler.acall(service, func, *args, tally=self._tally(service), **kwargs)
+
+    def stats(self):
+        with self._lock:
+            tallies = dict(self._tallies)
+        return {
+            name: tally.snapshot(self.scheduler.service(name).breaker) for name, tally in tallies.items()
+        }
+
+    def summary(self):
+        return _summary(self.stats())
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler():
+    """Planificador compartido por todo el proceso."""
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler()
+        return _default_scheduler
@@ -0,0 +1,122 @@
+import os
+import threading
+
+from download_core import create_spotify_client
+from match_cache import MatchCache
+from settings import CACHE_DIR, env_int
+from stream_cache import StreamCache
+from tagging import ArtCache
+
+TOKEN_CACHE_PATH = os.path.join(CACHE_DIR, 'spotify-token.json')
+
+
+class Services:
+    """Clientes y sesiones de larga duración que comparten todas las descargas de la aplicación.
+
+    Crear `YTMusic` y obtener el token de Spotify cuesta más que empezar una
+    playlist, así que se hace una sola vez (o en segundo plano con
+    `warm_up()` al abrir la aplicación) y cada descarga reutiliza los mismos
+    objetos: el cliente de Spotify con su token guardado en disco, YouTube
+    Music, la sesión HTTP con su pool de conexiones y las cachés de
+    coincidencias, streams y portadas de álbum.
+
+    Cada recurso se crea la primera vez que se pide, desde cualquier hilo, y
+    las librerías de red (spotipy, ytmusicapi, requests) se importan en ese
+    momento: crear `Services` no cuesta nada al arrancar la aplicación.
+    """
+
+    RESOURCES = ('spotify', 'ytmusic', 'http_session', 'match_cache', 'stream_cache', 'art_cache')
+
+    def __init__(self, token_cache_path=None):
+        self.token_cache_path = token_cache_path or TOKEN_CACHE_PATH
+        # Un lock por recurso: crear YTMusic (una petición de red) no bloquea a quien
+        # pide la sesión HTTP o una caché, y dos hilos no crean el mismo cliente dos veces
+        self._locks = {name: threading.Lock() for name in self.RESOURCES}
+        self._spotify = None
+        self._ytmusic = None
+        self._http_session = None
+        self._match_cache = None
+        self._stream_cache = None
+        self._art_cache = None
+
+    def _get(self, name, create):
+        """Devolver el recurso `name`, creándolo con `create()` la primera vez."""
+        attr = f'_{name}'
+        value = getattr(self, attr)
+        if value is None:
+            with self._locks[name]:
+                value = getattr(self, attr)
+                if value is None:
+                    value = create()
+                    setattr(self, attr, value)
+        return value
+
+    def spotify(self):
+        """Cliente de Spotify autenticado, o None si faltan las credenciales en el .env."""
+        def create():
+            from spotipy.cache_handler import CacheFileHandler
+            
+            os.makedirs(os.path.dirname(self.token_cache_path), exist_ok=True)
+            return create_spotify_client(CacheFileHandler(cache_path=self.token_cache_path))
+        return self._get('spotify', create)
+
+    def ytmusic(self):
+        def create():
+            from ytmusicapi import YTMusic
+            
+            return YTMusic()
+        return self._get('ytmusic', create)
+
+    def http_session(self):
+        """Sesión HTTP para las descargas, con tantas conexiones guardadas como descargas en paralelo."""
+        def create():
+            import requests
+            from requests.adapters import HTTPAdapter
+            
+            # El límite adaptativo puede subir las descargas hasta DOWNLOAD_WORKERS_MAX
+            downloads = max(env_int('DOWNLOAD_WORKERS', 3), env_int('DOWNLOAD_WORKERS_MAX', 16))
+            pool_size = max(10, downloads * 2)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            return session
+        return self._get('http_session', create)
+
+    def match_cache(self):
+        return self._get('match_cache', MatchCache)
+
+    def stream_cache(self):
+        return self._get('stream_cache', StreamCache)
+
+    def art_cache(self):
+        return self._get('art_cache', ArtCache)
+
+    def warm_up(self):
+        """Crear los clientes y pedir el token de Spotify por adelantado (para un hilo en segundo plano).
+
+        Los errores se ignoran: la descarga los volverá a encontrar y los mostrará.
+        """
+        try:
+            sp = self.spotify()
+            if sp is not None:
+                sp.auth_manager.get_access_token(as_dict=False)
+        except Exception:
+            pass
+        try:
+            self.ytmusic()
+        except Exception:
+            pass
+
+    def save(self):
+        """Guardar las cachés en disco; los clientes siguen abiertos para la siguiente descarga."""
+        caches = [cache for cache in (self._match_cache, self._stream_cache) if cache is not None]
+        for cache in caches:
+            cache.save()
+
+    def close(self):
+        self.save()
+        with self._locks['http_session']:
+            if self._http_session is not None:
+                self._http_session.close()
+                self._http_session = None
@@ -0,0 +1,24 @@
+import os
+
+# Directorio base del programa y carpeta para cachés persistentes
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, '.cache')
+
+
+def env_int(name, default):
+    """Leer un entero desde las variables de entorno con un valor por defecto."""
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def env_bool(name, default=False):
+    """Leer un booleano desde las variables de entorno (1/true/si/yes/on)."""
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'si', 'sí', 'yes', 'on')
@@ -0,0 +1,247 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from rate_limit import default_scheduler
+from settings import CACHE_DIR, env_int
+
+PAGE_SIZE = 100
+
+# Solo los campos que el descargador lee de cada canción (búsqueda, coincidencia y etiquetas)
+ITEM_FIELDS = (
+    'items(track(id,name,duration_ms,track_number,disc_number,external_ids(isrc),artists(name),'
+    'album(id,name,release_date,total_tracks,artists(name),images)))'
+)
+PLAYLIST_FIELDS = f'name,snapshot_id,tracks(total,{ITEM_FIELDS})'
+
+# Versión de las filas de la caché: las de otra versión se vuelven a pedir
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.path.join(CACHE_DIR, 'playlists')
+
+
+class TrackRecord:
+    """Datos de una canción que usa el descargador: ID, título, artistas, duración, ISRC y álbum.
+
+    Sustituye al item completo de Spotify; con `__slots__` cada canción ocupa
+    unos pocos campos, no un diccionario por nivel de la respuesta JSON. Del
+    álbum se guardan también los datos de las etiquetas (artista, fecha,
+    número de pista y de disco) y la URL de la portada más grande.
+    """
+
+    __slots__ = ('id', 'title', 'artists', 'duration_ms', 'isrc', 'album', 'album_id', 'album_artist',
+                 'release_date', 'track_number', 'total_tracks', 'disc_number', 'art_url')
+
+    def __init__(self, id, title, artists, duration_ms=None, isrc=None, album=None, album_id=None,
+                 album_artist=None, release_date=None, track_number=None, total_tracks=None,
+                 disc_number=None, art_url=None):
+        self.id = id
+        self.title = title
+        self.artists = tuple(artists)
+        self.duration_ms = duration_ms
+        self.isrc = isrc
+        self.album = album
+        self.album_id = album_id
+        self.album_artist = album_artist
+        self.release_date = release_date
+        self.track_number = track_number
+        self.total_tracks = total_tracks
+        self.disc_number = disc_number
+        self.art_url = art_url
+
+    @classmethod
+    def from_item(cls, item):
+        """Reducir un item de la API a un registro, o None si la canción ya no existe en Spotify."""
+        track = item.get('track')
+        if not track:
+            return None
+        album = track.get('album') or {}
+        album_artists = [artist['name'] for artist in album.get('artists') or ()]
+        # La portada más grande; al etiquetar se reduce una vez por álbum
+        images = sorted(album.get('images') or (), key=lambda image: image.get('width') or 0, reverse=True)
+        return cls(
+            track.get('id'),
+            track['name'],
+            [artist['name'] for artist in track.get('artists') or ()],
+            track.get('duration_ms'),
+            (track.get('external_ids') or {}).get('isrc'),
+            album.get('name'),
+            album.get('id'),
+            album_artists[0] if album_artists else None,
+            album.get('release_date'),
+            track.get('track_number'),
+            album.get('total_tracks'),
+            track.get('disc_number'),
+            images[0].get('url') if images else None,
+        )
+
+    @property
+    def artist(self):
+        """Artista principal, el que se usa en la búsqueda y el nombre del archivo."""
+        return self.artists[0] if self.artists else ''
+
+    def to_row(self):
+        return [self.id, self.title, list(self.artists), self.duration_ms, self.isrc, self.album, self.album_id,
+                self.album_artist, self.release_date, self.track_number, self.total_tracks, self.disc_number,
+                self.art_url]
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    def __repr__(self):
+        return f"TrackRecord({self.id!r}, {self.title!r}, {self.artists!r})"
+
+
+def read_cache_header(cache_path):
+    """Cabecera de la caché de una playlist, o None si no hay o es de otra versión."""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(header, dict) or header.get('version') != CACHE_VERSION or not header.get('snapshot_id'):
+        return None
+    return header
+
+
+class PlaylistListing:
+    """Canciones de una playlist que se recorren a medida que llegan las páginas.
+
+    `open_playlist` hace la primera petición, que trae el nombre, el
+    `snapshot_id`, el total y la primera página. Al iterar se entregan en orden
+    los `TrackRecord` de esa página y, mientras se procesan, se piden por
+    adelantado las siguientes (como mucho `max_workers` en curso). Así la
+    primera descarga empieza con la primera página y en memoria solo hay unas
+    pocas páginas, no la playlist entera.
+
+    Si hay caché en disco, `open_playlist` solo pide antes el `snapshot_id`: si
+    coincide con el guardado, las canciones se leen de la caché línea a línea
+    sin ninguna petición más (`header` es su cabecera). La caché (JSON Lines:
+    cabecera y una fila compacta por canción) se escribe mientras se recorre y
+    solo sustituye a la anterior si la playlist se recorrió completa.
+
+    Solo se puede recorrer una vez.
+    """
+
+    def __init__(self, sp, playlist_id, playlist, cache_path, max_workers, scheduler, header=None):
+        self.sp = sp
+        self.playlist_id = playlist_id
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.scheduler = scheduler
+
+        self.cached = header is not None
+        if self.cached:
+            self.name = header['name']
+            self.snapshot_id = header['snapshot_id']
+            self.total = header['total']
+            self._first_page = None
+        else:
+            self.name = playlist['name']
+            self.snapshot_id = playlist.get('snapshot_id')
+            # Incluye las canciones eliminadas de Spotify, que se descartan al recorrer
+            self.total = playlist['tracks']['total']
+            self._first_page = playlist['tracks']['items']
+        self._consumed = False
+
+    def __iter__(self):
+        if self._consumed:
+            raise RuntimeError("El listado de la playlist solo se puede recorrer una vez")
+        self._consumed = True
+        return self._read_cache() if self.cached else self._fetch()
+
+    def _read_cache(self):
+        with open(self.cache_path, 'r', encoding='utf-8') as f:
+            f.readline()
+            for line in f:
+                yield TrackRecord.from_row(json.loads(line))
+
+    def _fetch_page(self, offset):
+        return self.scheduler.call(
+            'spotify',
+            self.sp.playlist_items,
+            self.playlist_id,
+            fields=ITEM_FIELDS,
+            limit=PAGE_SIZE,
+            offset=offset,
+            additional_types=('track',)
+        )['items']
+
+    def _pages(self):
+        first_page, self._first_page = self._first_page, None
+        yield first_page
+
+        offsets = iter(range(len(first_page), self.total, PAGE_SIZE))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # Ventana de páginas pedidas por adelantado; se entregan en orden
+            window = deque(pool.submit(self._fetch_page, offset) for offset in islice(offsets, self.max_workers))
+            while window:
+                page = window.popleft().result()
+                offset = next(offsets, None)
+                if offset is not None:
+                    window.append(pool.submit(self._fetch_page, offset))
+                yield page
+
+    def _fetch(self):
+        cache = None
+        temp_path = self.cache_path + '.part'
+        if self.snapshot_id:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            cache = open(temp_path, 'w', encoding='utf-8')
+        complete = False
+        count = 0
+        try:
+            for page in self._pages():
+                for item in page:
+                    record = TrackRecord.from_item(item)
+                    if record is None:
+                        continue
+                    if cache is not None:
+                        cache.write(json.dumps(record.to_row(), ensure_ascii=False) + '\n')
+                    count += 1
+                    yield record
+            complete = True
+        finally:
+            if cache is not None:
+                cache.close()
+                if complete:
+                    self._save_cache(temp_path, count)
+                else:
+                    os.remove(temp_path)
+
+    def _save_cache(self, rows_path, count):
+        # La cabecera lleva el total real (sin canciones eliminadas) para el progreso
+        header = {'version': CACHE_VERSION, 'snapshot_id': self.snapshot_id, 'name': self.name, 'total': count}
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as out, open(rows_path, 'r', encoding='utf-8') as rows:
+            out.write(json.dumps(header, ensure_ascii=False) + '\n')
+            for line in rows:
+                out.write(line)
+        os.replace(temp_path, self.cache_path)
+        os.remove(rows_path)
+
+
+def open_playlist(sp, playlist_id, cache_dir=None, max_workers=None, scheduler=None):
+    """Pedir la cabecera y la primera página de una playlist y devolver su `PlaylistListing`.
+
+    Si hay una caché guardada, antes se pide solo el `snapshot_id`: una
+    playlist sin cambios se lee entera de la caché con esa única petición.
+    Todas las peticiones pasan por el planificador de límites de Spotify.
+    """
+    scheduler = scheduler or default_scheduler()
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    max_workers = max_workers or env_int('SPOTIFY_PAGE_WORKERS', 8)
+    cache_path = os.path.join(cache_dir, f"{playlist_id}.jsonl")
+
+    header = read_cache_header(cache_path)
+    if header is not None:
+        current = scheduler.call('spotify', sp.playlist, playlist_id, fields='snapshot_id')
+        if current.get('snapshot_id') == header['snapshot_id']:
+            return PlaylistListing(sp, playlist_id, None, cache_path, max_workers, scheduler, header=header)
+
+    playlist = scheduler.call('spotify', sp.playlist, playlist_id, fields=PLAYLIST_FIELDS)
+    return PlaylistListing(sp, playlist_id, playlist, cache_path, max_workers, scheduler)
+
@@ -0,0 +1,221 @@
+"""Benchmark del tiempo de arranque de la aplicación.
+
+Uso:
+    python startup_benchmark.py
+    python startup_benchmark.py --runs 10 --targets app,window
+    python startup_benchmark.py --history reports/startup-history.jsonl --no-save
+
+Cada medición arranca un intérprete nuevo con `python -X importtime`, así se
+mide el arranque en frío de cada módulo y no lo que otro ya dejó cargado. Se
+informa de la mediana y el mínimo del tiempo de importación (el acumulado que
+da `-X importtime`, incluido el arranque del intérprete) y del tiempo total
+del proceso, y de los módulos que más tardan por sí mismos.
+
+Objetivos:
+    app              módulo de la interfaz gráfica (PyQt5)
+    window           importar app, crear la ventana y mostrarla (sin pantalla)
+    download_worker  núcleo de descarga con hilos, sin interfaz
+    async_engine     motor asyncio
+    cli              modo sin interfaz
+
+También comprueba que el núcleo no carga Qt y que ningún módulo carga las
+librerías de red y medios (spotipy, ytmusicapi, pytube, aiohttp, requests,
+yt_dlp, mutagen) al importarse: deben llegar con la primera descarga. Si
+alguno lo hace el programa termina con código 1.
+
+Cada ejecución se añade a un historial (JSON Lines, una por línea, con la
+fecha y el commit) y se compara con la anterior para seguir la evolución.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from settings import BASE_DIR
+
+DEFAULT_HISTORY = os.path.join(BASE_DIR, 'reports', 'startup-history.jsonl')
+
+# Librerías que solo se deben importar al empezar una descarga
+NETWORK_MODULES = ('spotipy', 'ytmusicapi', 'pytube', 'aiohttp', 'requests', 'yt_dlp', 'mutagen')
+QT_MODULES = ('PyQt5',)
+
+# Código que ejecuta cada objetivo y módulos que no debe cargar
+WINDOW_CODE = (
+    "from PyQt5.QtWidgets import QApplication\n"
+    "import app\n"
+    "qt_app = QApplication([])\n"
+    "window = app.SpotifyDownloaderApp()\n"
+    "window.show()\n"
+    "qt_app.processEvents()\n"
+)
+TARGETS = {
+    'app': ("import app", NETWORK_MODULES),
+    'window': (WINDOW_CODE, NETWORK_MODULES),
+    'download_worker': ("import download_worker", NETWORK_MODULES + QT_MODULES),
+    'async_engine': ("import async_engine", NETWORK_MODULES + QT_MODULES),
+    'cli': ("import cli", NETWORK_MODULES + QT_MODULES),
+}
+
+
+def parse_importtime(stderr):
+    """Leer la salida de `-X importtime`: lista de `(módulo, propio_us, acumulado_us, nivel)`."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        own, cumulative, name = parts
+        # La sangría del nombre indica quién lo importó: dos espacios por nivel
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(own), int(cumulative), level))
+    return entries
+
+
+def measure(target, env):
+    """Arrancar un intérprete nuevo con el objetivo y devolver sus tiempos y módulos cargados."""
+    code, _ = TARGETS[target]
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, cwd=BASE_DIR, env=env
+    )
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines()
+        raise RuntimeError(error[-1] if error else f"Código de salida {process.returncode}")
+    entries = parse_importtime(process.stderr)
+    # Los módulos de nivel superior suman todo lo importado
+    top_level = [entry for entry in entries if entry[3] == 0]
+    return {
+        'wall': wall,
+        'imports': sum(entry[2] for entry in top_level) / 1e6,
+        'modules': {entry[0] for entry in entries},
+        # Los que más tardan por sí mismos, sin contar lo que importan
+        'slowest': sorted(entries, key=lambda entry: entry[1], reverse=True)[:5],
+    }
+
+
+def run_target(target, runs, env):
+    samples = [measure(target, env) for _ in range(runs)]
+    _, forbidden = TARGETS[target]
+    loaded = sorted({
+        name for sample in samples for name in sample['modules']
+        if name.split('.')[0] in forbidden
+    })
+    slowest = samples[-1]['slowest']
+    return {
+        'target': target,
+        'runs': runs,
+        'wall_median': round(statistics.median(s['wall'] for s in samples), 4),
+        'wall_min': round(min(s['wall'] for s in samples), 4),
+        'imports_median': round(statistics.median(s['imports'] for s in samples), 4),
+        'imports_min': round(min(s['imports'] for s in samples), 4),
+        'slowest': [{'module': name, 'seconds': round(own / 1e6, 4)} for name, own, _, _ in slowest],
+        'unexpected': sorted({name.split('.')[0] for name in loaded}),
+    }
+
+
+def git_commit():
+    try:
+        process = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                 cwd=BASE_DIR, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return process.stdout.strip() or None
+
+
+def load_last(path):
+    """Última entrada del historial, o None si no hay."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [line for line in f if line.strip()]
+    except OSError:
+        return None
+    try:
+        return json.loads(lines[-1]) if lines else None
+    except ValueError:
+        return None
+
+
+def append_history(path, entry):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def format_row(result, previous=None):
+    change = ''
+    if previous is not None:
+        delta = (result['wall_median'] - previous['wall_median']) * 1000
+        change = f"{delta:+.0f} ms"
+    status = 'ok' if not result['unexpected'] else f"carga {', '.join(result['unexpected'])}"
+    return (
+        f"{result['target']:<16} {result['wall_median'] * 1000:>10.0f} {result['wall_min'] * 1000:>9.0f} "
+        f"{result['imports_median'] * 1000:>13.0f} {change:>10}  {status}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del tiempo de arranque de la aplicación")
+    parser.add_argument('--targets', default=','.join(TARGETS),
+                        help=f"Objetivos separados por comas ({', '.join(TARGETS)})")
+    parser.add_argument('--runs', type=int, default=5, help="Arranques por objetivo (se toma la mediana)")
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help="Historial de mediciones (JSON Lines)")
+    parser.add_argument('--no-save', action='store_true', help="No añadir la medición al historial")
+    args = parser.parse_args(argv)
+
+    args.targets = [target.strip() for target in args.targets.split(',') if target.strip()]
+    unknown = [target for target in args.targets if target not in TARGETS]
+    if unknown:
+        parser.error(f"objetivo desconocido: {', '.join(unknown)} (usa {', '.join(TARGETS)})")
+    args.runs = max(1, args.runs)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Sin pantalla y con credenciales de prueba: la ventana no muestra el aviso de configuración
+    env = dict(
+        os.environ,
+        QT_QPA_PLATFORM='offscreen',
+        SPOTIFY_CLIENT_ID=os.getenv('SPOTIFY_CLIENT_ID') or 'benchmark',
+        SPOTIFY_CLIENT_SECRET=os.getenv('SPOTIFY_CLIENT_SECRET') or 'benchmark',
+    )
+    previous = load_last(args.history)
+    previous_results = {r['target']: r for r in previous['results']} if previous else {}
+
+    print(f"{'objetivo':<16} {'total(ms)':>10} {'mín.(ms)':>9} {'importar(ms)':>13} {'cambio':>10}  estado")
+    results = []
+    for target in args.targets:
+        try:
+            result = run_target(target, args.runs, env)
+        except RuntimeError as e:
+            print(f"{target:<16} error: {e}")
+            results.append({'target': target, 'error': str(e)})
+            continue
+        results.append(result)
+        print(format_row(result, previous_results.get(target)), flush=True)
+        slowest = ', '.join(f"{s['module']} {s['seconds'] * 1000:.0f} ms" for s in result['slowest'])
+        print(f"{'':<16} más lentos: {slowest}")
+
+    if not args.no_save:
+        append_history(args.history, {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'results': results,
+        })
+    failed = any('error' in result or result['unexpected'] for result in results)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
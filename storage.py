@@ -0,0 +1,36 @@
+import json
+import os
+import tempfile
+
+# mkstemp crea el temporal con permisos 0600; al publicarlo se le dan los de un
+# archivo normal según la umask. Se lee una vez al importar: cambiarla no es seguro entre hilos
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+
+def load_json(path, default=None):
+    """Leer un archivo JSON; devuelve `default` si no existe o está dañado."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path, data):
+    """Guardar datos como JSON de forma atómica (archivo temporal + rename)."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
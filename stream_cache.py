@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from settings import CACHE_DIR
+from transcode import SOURCE_EXTENSIONS
+
+DEFAULT_PATH = os.path.join(CACHE_DIR, 'streams.sqlite3')
+
+# Margen antes de la caducidad de la URL en el que ya no se reutiliza
+# (una descarga que empieza justo antes de caducar no llegaría a terminar)
+EXPIRY_MARGIN = 10 * 60
+# Duración supuesta si la URL no indica su caducidad (`expire=`)
+DEFAULT_TTL = 5 * 60 * 60
+
+COMMIT_EVERY = 50
+
+# Códigos con los que YouTube rechaza una URL caducada o firmada para otra IP
+EXPIRED_STATUS = (403, 410)
+
+COLUMNS = ('video_id', 'itag', 'url', 'filesize', 'extension', 'codec', 'bitrate', 'expires')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    video_id TEXT PRIMARY KEY,
+    itag TEXT,
+    url TEXT NOT NULL,
+    filesize INTEGER,
+    extension TEXT,
+    codec TEXT,
+    bitrate TEXT,
+    expires REAL NOT NULL
+)
+"""
+
+
+def stream_expiry(url, now=None):
+    """Momento hasta el que se puede usar la URL: su parámetro `expire` menos el margen."""
+    now = now or time.time()
+    try:
+        expire = int(parse_qs(urlparse(url).query)['expire'][0])
+    except (KeyError, IndexError, ValueError):
+        expire = now + DEFAULT_TTL
+    return expire - EXPIRY_MARGIN
+
+
+def stream_from_pytube(stream):
+    """Datos de un `pytube.Stream` que hacen falta para descargarlo y convertirlo."""
+    return {
+        'itag': str(stream.itag),
+        'url': stream.url,
+        'filesize': stream.filesize,
+        'extension': SOURCE_EXTENSIONS.get(stream.mime_type, stream.subtype),
+        'codec': stream.audio_codec,
+        'bitrate': str(stream.abr) if stream.abr else None,
+        'expires': stream_expiry(stream.url),
+    }
+
+
+def stream_from_ytdlp(info):
+    """Datos del formato elegido por yt-dlp (`extract_info(download=False)` con un solo formato)."""
+    return {
+        'itag': info.get('format_id'),
+        'url': info['url'],
+        'filesize': info.get('filesize') or info.get('filesize_approx'),
+        'extension': info.get('ext'),
+        'codec': info.get('acodec'),
+        'bitrate': str(info['abr']) if info.get('abr') else None,
+        'expires': stream_expiry(info['url']),
+    }
+
+
+def is_expired_url_error(error):
+    """True si la descarga falló porque la URL del stream ya no es válida."""
+    status = getattr(error, 'status', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    return status in EXPIRED_STATUS
+
+
+class StreamCache:
+    """Caché en disco de los streams resueltos, por ID del video de YouTube.
+
+    Resolver un stream con pytube o yt-dlp cuesta varias peticiones y descifrar
+    la firma; la URL directa que se obtiene vale varias horas. Se guarda el
+    itag, la URL, el tamaño, el formato y la caducidad, así los reintentos, las
+    repeticiones entre playlists y las ejecuciones reanudadas descargan sin
+    volver a extraer hasta que la URL caduca o el servidor la rechaza
+    (`invalidate()`).
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_PATH
+        self._lock = threading.Lock()
+        self._pending = 0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Una conexión compartida por los hilos de resolución, protegida por el lock
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(SCHEMA)
+        self._db.commit()
+
+    def get(self, video_id):
+        """Devolver el stream guardado para el video, o None si no hay o está por caducar."""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(COLUMNS[1:])} FROM streams WHERE video_id = ? AND expires > ?",
+                (video_id, time.time())
+            ).fetchone()
+        return dict(zip(COLUMNS[1:], row)) if row else None
+
+    def put(self, video_id, stream):
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO streams VALUES ({', '.join('?' * len(COLUMNS))})",
+                (video_id,) + tuple(stream.get(column) for column in COLUMNS[1:])
+            )
+            self._write()
+
+    def invalidate(self, video_id):
+        """Olvidar el stream del video (la URL fue rechazada) para que se vuelva a resolver."""
+        with self._lock:
+            self._db.execute("DELETE FROM streams WHERE video_id = ?", (video_id,))
+            self._write()
+
+    def _write(self):
+        # Se llama con el lock tomado
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self._db.commit()
+            self._pending = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM streams").fetchone()[0]
+
+    def save(self):
+        """Eliminar los streams caducados y confirmar los cambios."""
+        with self._lock:
+            self._db.execute("DELETE FROM streams WHERE expires <= ?", (time.time(),))
+            self._db.commit()
+            self._pending = 0
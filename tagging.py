@@ -0,0 +1,491 @@
+import base64
+import hashlib
+import importlib.util
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from http_download import fsync_file
+from manifest import file_sha256
+from rate_limit import default_scheduler
+from settings import CACHE_DIR, env_bool, env_int
+
+DEFAULT_ART_DIR = os.path.join(CACHE_DIR, 'art')
+# Lado máximo de la portada incrustada, en píxeles
+DEFAULT_ART_SIZE = 500
+DEFAULT_ART_CACHE_MB = 50
+# Portadas que se guardan en memoria durante la ejecución, en bytes
+MEMORY_BYTES = 16 * 1024 * 1024
+
+# Clave libre de MP4 (iTunes) para el ISRC
+MP4_ISRC = '----:com.apple.iTunes:ISRC'
+
+# Canción de Spotify cuyas etiquetas lleva el archivo (varias canciones pueden compartir video)
+TRACK_TAG = 'SPOTIFY_TRACK'
+MP4_TRACK = f'----:com.apple.iTunes:{TRACK_TAG}'
+
+# Extensión del archivo convertido mientras espera sus etiquetas, antes de entrar al almacén
+STAGING_SUFFIX = '.untagged'
+
+# Comprobar y etiquetar en su sitio un archivo del almacén es cosa de un solo hilo a la vez
+_place_lock = threading.Lock()
+
+
+def tagging_available():
+    """mutagen instalado (sin él los archivos se guardan sin etiquetas)."""
+    return importlib.util.find_spec('mutagen') is not None
+
+
+def track_key(track):
+    """Identificador de la canción que se guarda en sus etiquetas (el mismo que la clave del trabajo)."""
+    return track.id or f"q:{track.title} {track.artist}"
+
+
+def track_tags(track):
+    """Etiquetas de una canción a partir de su `TrackRecord`, sin ninguna petición más."""
+    return {
+        'key': track_key(track),
+        'title': track.title,
+        'artists': list(track.artists),
+        'album': track.album,
+        'album_artist': track.album_artist,
+        'date': track.release_date,
+        'track_number': track.track_number,
+        'total_tracks': track.total_tracks,
+        'disc_number': track.disc_number,
+        'isrc': track.isrc,
+    }
+
+
+def _image_mime(data):
+    return 'image/png' if data.startswith(b'\x89PNG') else 'image/jpeg'
+
+
+def _write_id3(path, tags, art):
+    from mutagen.id3 import APIC, ID3, ID3NoHeaderError, TALB, TDRC, TIT2, TPE1, TPE2, TPOS, TRCK, TSRC, TXXX
+
+    try:
+        id3 = ID3(path)
+    except ID3NoHeaderError:
+        id3 = ID3()
+    id3.add(TIT2(encoding=3, text=tags['title']))
+    if tags['artists']:
+        id3.add(TPE1(encoding=3, text=tags['artists']))
+    if tags['album']:
+        id3.add(TALB(encoding=3, text=tags['album']))
+    if tags['album_artist']:
+        id3.add(TPE2(encoding=3, text=tags['album_artist']))
+    if tags['date']:
+        id3.add(TDRC(encoding=3, text=tags['date']))
+    if tags['track_number']:
+        number = str(tags['track_number'])
+        if tags['total_tracks']:
+            number += f"/{tags['total_tracks']}"
+        id3.add(TRCK(encoding=3, text=number))
+    if tags['disc_number']:
+        id3.add(TPOS(encoding=3, text=str(tags['disc_number'])))
+    if tags['isrc']:
+        id3.add(TSRC(encoding=3, text=tags['isrc']))
+    id3.add(TXXX(encoding=3, desc=TRACK_TAG, text=tags['key']))
+    if art:
+        id3.delall('APIC')
+        id3.add(APIC(encoding=3, mime=_image_mime(art), type=3, desc='Cover', data=art))
+    id3.save(path)
+
+
+def _write_mp4(path, tags, art):
+    from mutagen.mp4 import MP4, MP4Cover
+
+    audio = MP4(path)
+    if audio.tags is None:
+        audio.add_tags()
+    audio['\xa9nam'] = [tags['title']]
+    if tags['artists']:
+        audio['\xa9ART'] = tags['artists']
+    if tags['album']:
+        audio['\xa9alb'] = [tags['album']]
+    if tags['album_artist']:
+        audio['aART'] = [tags['album_artist']]
+    if tags['date']:
+        audio['\xa9day'] = [tags['date']]
+    if tags['track_number']:
+        audio['trkn'] = [(tags['track_number'], tags['total_tracks'] or 0)]
+    if tags['disc_number']:
+        audio['disk'] = [(tags['disc_number'], 0)]
+    if tags['isrc']:
+        audio[MP4_ISRC] = [tags['isrc'].encode('utf-8')]
+    audio[MP4_TRACK] = [tags['key'].encode('utf-8')]
+    if art:
+        image_format = MP4Cover.FORMAT_PNG if _image_mime(art) == 'image/png' else MP4Cover.FORMAT_JPEG
+        audio['covr'] = [MP4Cover(art, imageformat=image_format)]
+    audio.save()
+
+
+def _write_vorbis(path, tags, art):
+    from mutagen.flac import Picture
+    from mutagen.oggopus import OggOpus
+
+    audio = OggOpus(path)
+    audio['title'] = [tags['title']]
+    if tags['artists']:
+        audio['artist'] = tags['artists']
+    if tags['album']:
+        audio['album'] = [tags['album']]
+    if tags['album_artist']:
+        audio['albumartist'] = [tags['album_artist']]
+    if tags['date']:
+        audio['date'] = [tags['date']]
+    if tags['track_number']:
+        audio['tracknumber'] = [str(tags['track_number'])]
+    if tags['total_tracks']:
+        audio['tracktotal'] = [str(tags['total_tracks'])]
+    if tags['disc_number']:
+        audio['discnumber'] = [str(tags['disc_number'])]
+    if tags['isrc']:
+        audio['isrc'] = [tags['isrc']]
+    audio[TRACK_TAG.lower()] = [tags['key']]
+    if art:
+        # Ogg no tiene un campo de imagen: se usa el bloque PICTURE de FLAC en base64
+        picture = Picture()
+        picture.type = 3
+        picture.mime = _image_mime(art)
+        picture.desc = 'Cover'
+        picture.data = art
+        audio['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+    audio.save()
+
+
+def _read_id3_key(path):
+    from mutagen.id3 import ID3
+
+    frames = ID3(path).getall(f'TXXX:{TRACK_TAG}')
+    return str(frames[0].text[0]) if frames else None
+
+
+def _read_mp4_key(path):
+    from mutagen.mp4 import MP4
+
+    values = (MP4(path).tags or {}).get(MP4_TRACK)
+    return bytes(values[0]).decode('utf-8') if values else None
+
+
+def _read_vorbis_key(path):
+    from mutagen.oggopus import OggOpus
+
+    values = OggOpus(path).get(TRACK_TAG.lower())
+    return values[0] if values else None
+
+
+# Escritor de etiquetas de cada formato de salida (ver transcode.FORMATS)
+WRITERS = {'mp3': _write_id3, 'm4a': _write_mp4, 'opus': _write_vorbis}
+# Y lector de la canción a la que pertenecen
+KEY_READERS = {'mp3': _read_id3_key, 'm4a': _read_mp4_key, 'opus': _read_vorbis_key}
+
+
+def write_tags(path, fmt, tags, art=None):
+    """Escribir las etiquetas y la portada (`art`, JPEG o PNG) en el archivo según su formato."""
+    WRITERS[fmt](path, tags, art)
+
+
+def read_track_key(path, fmt):
+    """Clave de la canción cuyas etiquetas lleva el archivo, o None si no lleva (o no se pueden leer)."""
+    try:
+        return KEY_READERS[fmt](path)
+    except Exception:
+        return None
+
+
+def resize_image(data, size):
+    """Reducir la imagen a `size` píxeles de lado como mucho, con ffmpeg; si no se puede, se devuelve igual."""
+    if not size or shutil.which('ffmpeg') is None:
+        return data
+    with tempfile.TemporaryDirectory(prefix='art-') as directory:
+        source = os.path.join(directory, 'source')
+        destination = os.path.join(directory, 'cover.jpg')
+        with open(source, 'wb') as f:
+            f.write(data)
+        result = subprocess.run(
+            ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', '-i', source,
+             '-vf', f"scale=w='min(iw,{size})':h='min(ih,{size})':force_original_aspect_ratio=decrease",
+             '-frames:v', '1', '-q:v', '3', destination],
+            capture_output=True
+        )
+        if result.returncode != 0 or not os.path.exists(destination):
+            return data
+        with open(destination, 'rb') as f:
+            resized = f.read()
+    # Una portada ya pequeña puede ocupar más al recomprimirla
+    return resized if resized and len(resized) < len(data) else data
+
+
+class ArtCache:
+    """Portadas de álbum descargadas y reducidas una sola vez, compartidas por todas sus canciones.
+
+    La primera canción de un álbum pide la portada; las que llegan mientras
+    tanto esperan ese mismo resultado en lugar de descargarla otra vez. Cada
+    portada se reduce a `size` píxeles de lado y se guarda en memoria (hasta
+    `memory_bytes`) y en disco, en `directory`, hasta `max_bytes`: al pasarse
+    se borran las usadas hace más tiempo. Una portada que no se pudo obtener
+    no se vuelve a pedir en la misma ejecución.
+    """
+
+    def __init__(self, directory=None, size=None, max_bytes=None, memory_bytes=None, scheduler=None):
+        self.directory = directory or DEFAULT_ART_DIR
+        self.size = size if size is not None else env_int('ART_SIZE', DEFAULT_ART_SIZE)
+        self.max_bytes = max_bytes if max_bytes is not None else env_int('ART_CACHE_MB', DEFAULT_ART_CACHE_MB) * 1024 * 1024
+        self.memory_bytes = memory_bytes or MEMORY_BYTES
+        self.scheduler = scheduler or default_scheduler()
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # Portadas que se están obteniendo: clave -> Future con los bytes (o None)
+        self._pending = {}
+        self._failed = set()
+        self.fetched = 0
+        self.reused = 0
+
+    def _key(self, album_id, url):
+        if album_id and re.fullmatch(r'[A-Za-z0-9_-]+', album_id):
+            return album_id
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.jpg")
+
+    def get(self, album_id, url, session=None):
+        """Portada reducida del álbum, o None si no tiene o no se pudo obtener."""
+        if not url:
+            return None
+        key = self._key(album_id, url)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.reused += 1
+                return data
+            if key in self._failed:
+                return None
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if not owner:
+            # Otra canción del mismo álbum ya la está obteniendo
+            data = future.result()
+            if data is not None:
+                with self._lock:
+                    self.reused += 1
+            return data
+
+        data = None
+        try:
+            data = self._load(key, url, session)
+        except Exception:
+            pass
+        with self._lock:
+            del self._pending[key]
+            if data is None:
+                self._failed.add(key)
+            else:
+                self._remember(key, data)
+        future.set_result(data)
+        return data
+
+    def _remember(self, key, data):
+        # Se llama con el lock tomado
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+
+    def _load(self, key, url, session):
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # La fecha de modificación marca el último uso para la expulsión por tamaño
+            os.utime(path)
+            with self._lock:
+                self.reused += 1
+            return data
+        except OSError:
+            pass
+
+        if session is None:
+            import requests
+
+            session = requests.Session()
+
+        def fetch():
+            response = session.get(url, timeout=30)
+            response.raise_for_status()
+            return response.content
+
+        data = resize_image(self.scheduler.call('art', fetch), self.size)
+        with self._lock:
+            self.fetched += 1
+        self._store(path, data)
+        return data
+
+    def _store(self, path, data):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = path + '.part'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self._evict()
+
+    def _evict(self):
+        """Borrar las portadas usadas hace más tiempo hasta quedar por debajo de `max_bytes`."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.jpg'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+
+    def summary(self):
+        return f"{self.fetched} portadas descargadas, {self.reused} reutilizadas"
+
+
+class Tagger:
+    """Etapa de etiquetado: ID3 (mp3), MP4 (m4a) o Vorbis (opus) en un pool de hilos.
+
+    Usa los datos de Spotify que ya trae el listado (`TrackRecord`), sin más
+    peticiones a la API, y la portada de `ArtCache`. Las descargas no esperan:
+    `submit()` encola el archivo y el pool lo etiqueta cuando termina su
+    conversión. La conversión escribe en `staging_path()`, fuera del almacén,
+    y el archivo entra en él con un rename atómico ya etiquetado: nunca hay un
+    enlace en una playlist a un archivo sin etiquetas ni a medias.
+
+    Cada archivo lleva la clave de su canción (`track_key`). Varias canciones de
+    Spotify pueden tener el mismo video; `place()` enlaza el del almacén solo en
+    las playlists de esa misma canción y da a las demás una copia con sus datos.
+    """
+
+    def __init__(self, fmt, art_cache=None, session=None, workers=None, enabled=None):
+        self.format = fmt
+        self.enabled = env_bool('TAG_FILES', True) if enabled is None else enabled
+        self.workers = workers or env_int('TAG_WORKERS', 2)
+        self.art_cache = art_cache
+        self.session = session
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        """Etiquetado activado y posible (con mutagen instalado)."""
+        return self.enabled and tagging_available()
+
+    def staging_path(self, path, track):
+        """Ruta en la que convertir el archivo que se publicará en `path` tras etiquetarlo.
+
+        Sin etiquetado (desactivado o sin datos de la canción) es la propia `path`.
+        """
+        if not self.active or track is None:
+            return path
+        return path + STAGING_SUFFIX
+
+    def submit(self, path, track, after=None, destination=None):
+        """Encolar el etiquetado de `path` una vez termine `after` (la conversión) y devolver un Future.
+
+        Con `destination` el archivo se publica ahí al terminar (ver `tag`).
+        Devuelve None si el etiquetado está desactivado. El resultado es un
+        diccionario con `size`, `sha256`, `seconds` y `art` (si lleva portada).
+        """
+        if not self.active or track is None:
+            return None
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='etiquetas')
+            return self._pool.submit(self.tag, path, track, after, destination)
+
+    def tag(self, path, track, after=None, destination=None):
+        """Escribir las etiquetas en `path`, en su sitio, y publicarlo en `destination` si se indica.
+
+        El archivo se publica aunque fallen las etiquetas, así la canción se
+        conserva sin ellas; el error llega igualmente a quien espera el resultado.
+        """
+        if after is not None:
+            # Si la conversión falló, el error llega a quien espera el etiquetado
+            after.result()
+        start = time.monotonic()
+        art = None
+        try:
+            if self.art_cache is not None and track.art_url:
+                art = self.art_cache.get(track.album_id, track.art_url, self.session)
+            write_tags(path, self.format, track_tags(track), art)
+        finally:
+            fsync_file(path)
+            if destination is not None:
+                os.replace(path, destination)
+                path = destination
+        return {
+            'size': os.path.getsize(path),
+            'sha256': file_sha256(path),
+            'seconds': time.monotonic() - start,
+            'art': art is not None,
+        }
+
+    def place(self, store, video_id, track, destination):
+        """Colocar en `destination` el audio del almacén con las etiquetas de `track`.
+
+        Si el archivo del almacén ya es de esta canción (o no se etiqueta) se
+        enlaza. Si no lleva etiquetas, guardado así por una versión anterior o
+        porque fallaron, se etiqueta en su sitio: las reciben también los
+        enlaces que ya tenía. Si es de otra canción con el mismo video, la
+        playlist recibe una copia con sus propias etiquetas. Devuelve el
+        resultado del etiquetado, o None si solo se enlazó.
+        """
+        if not self.active or track is None:
+            store.link(video_id, destination)
+            return None
+        stored_path = store.path_for(video_id)
+        key = read_track_key(stored_path, self.format)
+        if key is None:
+            with _place_lock:
+                # Otro hilo pudo etiquetarlo mientras se esperaba
+                key = read_track_key(stored_path, self.format)
+                if key is None:
+                    result = self.tag(stored_path, track)
+                    store.link(video_id, destination)
+                    return result
+        if key == track_key(track):
+            store.link(video_id, destination)
+            return None
+
+        temp_path = destination + '.part'
+        shutil.copyfile(stored_path, temp_path)
+        try:
+            result = self.tag(temp_path, track)
+            os.replace(temp_path, destination)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return result
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=not wait)
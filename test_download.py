@@ -1,12 +1,22 @@
 import os
 import logging
-import time
 import requests
 from dotenv import load_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
 import yt_dlp
 
+from audio_store import AudioStore
+from download_core import create_spotify_client
+from http_download import download_resumable
+from match_cache import MatchCache
+from matching import TrackMatcher, candidate_from_ytdlp
+from metrics import RunMetrics
+from rate_limit import default_scheduler
+from settings import env_bool
+from stream_cache import StreamCache, is_expired_url_error, stream_from_ytdlp
+from spotify_listing import open_playlist
+from tagging import ArtCache, Tagger
+from transcode import Transcoder
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -23,27 +33,97 @@ def extract_playlist_id(playlist_url):
         return playlist_url.split('playlist/')[1].split('?')[0]
     return None
 
-def download_playlist(playlist_url):
+def find_video_id(track, search_query, match_cache, matcher):
+    """Obtener el ID de YouTube de la canción, usando la caché si es posible."""
+    video_id = match_cache.get(track, search_query)
+    if video_id:
+        return video_id
+    
+    search_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': True,
+    }
+    with yt_dlp.YoutubeDL(search_opts) as ydl:
+        info = default_scheduler().call(
+            'youtube',
+            ydl.extract_info,
+            f"ytsearch{matcher.candidates}:{search_query}",
+            download=False
+        )
+    entries = (info or {}).get('entries') or []
+    
+    # Elegir el resultado que corresponde a la canción (duración, artistas, título)
+    match, score = matcher.select(track, [candidate_from_ytdlp(entry) for entry in entries])
+    if match is None:
+        if entries:
+            logging.warning(f"Ninguna coincidencia fiable para {search_query} (mejor puntuación {score})")
+        return None
+    
+    video_id = match['video_id']
+    match_cache.put(track, search_query, video_id, match, score)
+    return video_id
+
+def resolve_stream(video_url, video_id, stream_cache):
+    """Resolver con yt-dlp el mejor stream de audio, sin descargarlo, y guardarlo en la caché."""
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'quiet': True,
+        'no_warnings': True,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = default_scheduler().call(
+            'youtube',
+            ydl.extract_info,
+            video_url,
+            download=False
+        )
+    stream = stream_from_ytdlp(info)
+    stream_cache.put(video_id, stream)
+    return stream
+
+def place_track(tagger, store, video_id, job, audio_file_path, metrics):
+    """Colocar el audio del almacén con las etiquetas de la canción; si fallan, se enlaza sin ellas."""
+    try:
+        tagged = tagger.place(store, video_id, job['track'], audio_file_path)
+    except Exception as e:
+        logging.error(f"No se pudieron escribir las etiquetas de {job['song_name']}: {str(e)}")
+        store.link(video_id, audio_file_path)
+        return
+    if tagged is not None:
+        metrics.record('etiquetas', tagged['seconds'], job)
+
+def download_playlist(playlist_url, output_dir=None):
+    match_cache = MatchCache()
+    matcher = TrackMatcher()
+    stream_cache = StreamCache()
+    session = requests.Session()
+    # yt-dlp solo descarga; la conversión va en un pool de procesos aparte
+    # y no retrasa la descarga de la siguiente canción
+    transcoder = Transcoder()
+    store = AudioStore(extension=transcoder.extension)
+    # Etiquetas y portada en su propio pool, como en la aplicación
+    art_cache = ArtCache()
+    tagger = Tagger(transcoder.format, art_cache, session)
+    if tagger.enabled and not tagger.active:
+        logging.warning("No se encontró mutagen: las canciones se guardarán sin etiquetas")
+    conversions = []
+    # Videos enviados a convertir en esta ejecución: otra canción que lleve al mismo
+    # video (p. ej. un single y su versión del álbum) espera esa conversión en lugar
+    # de descargarlo otra vez sobre los mismos archivos .part
+    in_flight = {}
+    metrics = RunMetrics()
     try:
         # Cargar variables de entorno
         load_dotenv()
         
-        # Configurar credenciales de Spotify
-        client_id = os.getenv('SPOTIFY_CLIENT_ID')
-        client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
-        
-        if not client_id or not client_secret:
+        # Autenticar con Spotify (sin los reintentos de spotipy: los hace el planificador)
+        logging.info("Iniciando autenticación con Spotify...")
+        sp = create_spotify_client()
+        if sp is None:
             logging.error("No se encontraron las credenciales de Spotify. Verifica el archivo .env")
             return False
         
-        # Autenticar con Spotify
-        logging.info("Iniciando autenticación con Spotify...")
-        client_credentials_manager = SpotifyClientCredentials(
-            client_id=client_id, 
-            client_secret=client_secret
-        )
-        sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
-        
         # Extraer ID de la playlist
         playlist_id = extract_playlist_id(playlist_url)
         if not playlist_id:
@@ -52,90 +132,172 @@ def download_playlist(playlist_url):
         
         # Obtener información de la playlist
         logging.info("Obteniendo información de la playlist...")
-        playlist = sp.playlist(playlist_id)
-        playlist_name = playlist['name']
+        # Solo la cabecera y la primera página: el resto llega mientras se descarga
+        with metrics.stage('listado'):
+            listing = open_playlist(sp, playlist_id)
+        playlist_name = listing.name
         
         # Crear directorio para la playlist
-        download_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TestDownloads", playlist_name)
+        output_dir = output_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "TestDownloads")
+        download_dir = os.path.join(output_dir, playlist_name)
         os.makedirs(download_dir, exist_ok=True)
         logging.info(f"Directorio de descarga: {download_dir}")
         
-        # Obtener todas las canciones
-        tracks = []
-        results = playlist['tracks']
-        tracks.extend(results['items'])
-        while results['next']:
-            results = sp.next(results)
-            tracks.extend(results['items'])
-        
-        total_tracks = len(tracks)
+        # Las canciones se recorren a medida que llegan las páginas
+        # (o desde la caché si el snapshot de la playlist no ha cambiado)
+        total_tracks = listing.total
         logging.info(f"Encontradas {total_tracks} canciones en la playlist '{playlist_name}'")
         
         # Descargar cada canción
-        for i, item in enumerate(tracks, 1):
-            track = item['track']
-            artist = track['artists'][0]['name']
-            song_name = track['name']
+        for i, track in enumerate(listing, 1):
+            artist = track.artist
+            song_name = track.title
             search_query = f"{song_name} {artist}"
+            job = {'key': track.id or f"q:{search_query}", 'track': track, 'song_name': song_name, 'artist': artist}
             
             logging.info(f"[{i}/{total_tracks}] Procesando: {search_query}")
             
             try:
-                # Configurar opciones de yt-dlp
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                    'outtmpl': os.path.join(download_dir, f"{song_name} - {artist}.%(ext)s"),
-                    'quiet': True,
-                    'no_warnings': True,
-                    'extract_flat': False,
-                    'default_search': 'ytsearch',
-                }
+                # Resolver el video una sola vez (o desde la caché) y descargar por URL
+                with metrics.stage('busqueda', job):
+                    video_id = find_video_id(track, search_query, match_cache, matcher)
+                if not video_id:
+                    metrics.skip(job, 'no_encontrada')
+                    logging.error(f"No se encontró: {search_query}")
+                    continue
+                video_url = f"https://www.youtube.com/watch?v={video_id}"
 
                 # Preparar nombre de archivo
                 file_name = f"{song_name} - {artist}"
                 for char in ['/', '\\', '"', '?', ':', '*', '<', '>', '|']:
                     file_name = file_name.replace(char, '_')
-                
-                ydl_opts['outtmpl'] = os.path.join(download_dir, f"{file_name}.%(ext)s")
-
-                # Intentar descargar con reintentos
-                max_retries = 3
-                retry_count = 0
-                success = False
+                audio_file_path = os.path.join(download_dir, f"{file_name}.{transcoder.extension}")
 
-                while retry_count < max_retries and not success:
+                if video_id in in_flight:
+                    logging.info(f"♻️ Mismo video que otra canción en curso: {file_name}")
+                    metrics.skip(job, 'reutilizada')
+                    in_flight[video_id]['links'].append((job, audio_file_path, file_name))
+                    continue
+                
+                # Descargar salvo que el audio ya esté en el almacén
+                if store.get(video_id):
+                    logging.info(f"♻️ Reutilizado del almacén: {file_name}")
+                    metrics.skip(job, 'reutilizada')
+                    place_track(tagger, store, video_id, job, audio_file_path, metrics)
+                    continue
+                
+                # yt-dlp solo resuelve el stream (y una vez: queda en la caché hasta que caduca);
+                # la descarga va al almacén común por rangos y la playlist recibe un enlace
+                stream = stream_cache.get(video_id) or resolve_stream(video_url, video_id, stream_cache)
+                for attempt in range(2):
+                    source_path = store.source_path(video_id, stream['extension'])
                     try:
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            ydl.download([search_query])
-                            success = True
-                            logging.info(f"✅ Descargado exitosamente: {file_name}")
+                        with metrics.stage('descarga', job) as span:
+                            size, _ = default_scheduler().call(
+                                'download',
+                                download_resumable,
+                                stream['url'],
+                                source_path,
+                                session=session,
+                                expected_size=stream['filesize'],
+                                digest=False,
+                                durable=False
+                            )
+                            span['bytes'] = size
+                        break
                     except Exception as e:
-                        retry_count += 1
-                        if retry_count == max_retries:
-                            raise Exception(f"Error después de {max_retries} intentos: {str(e)}")
-                        logging.warning(f"Intento {retry_count}/{max_retries} falló, reintentando...")
-                        time.sleep(3 * retry_count)  # Backoff exponencial
+                        # URL caducada o rechazada: resolverla de nuevo una vez
+                        if attempt or not is_expired_url_error(e):
+                            raise
+                        metrics.retry('descarga', job, e)
+                        stream_cache.invalidate(video_id)
+                        fresh = resolve_stream(video_url, video_id, stream_cache)
+                        if fresh['itag'] != stream['itag'] and os.path.exists(source_path):
+                            # Otro formato: lo descargado del anterior no sirve
+                            os.remove(source_path)
+                        stream = fresh
                 
-                # Verificar archivo descargado
-                if os.path.exists(mp3_file_path) and os.path.getsize(mp3_file_path) > 1024:
-                    logging.info(f"✅ Descargado exitosamente: {file_name}")
-                else:
-                    logging.error(f"❌ Error: Archivo no encontrado o demasiado pequeño: {file_name}")
+                # Convertir en segundo plano mientras se descarga la siguiente canción; el
+                # archivo entra en el almacén cuando ya tiene las etiquetas
+                stored_path = store.path_for(video_id)
+                staging_path = tagger.staging_path(stored_path, track)
+                future = transcoder.submit(
+                    source_path,
+                    staging_path,
+                    source_codec=stream['codec'],
+                    source_bitrate=stream['bitrate'],
+                    final=staging_path == stored_path
+                )
+                entry = {
+                    'future': future,
+                    'tagging': tagger.submit(staging_path, track, after=future, destination=stored_path),
+                    'video_id': video_id,
+                    'source_path': source_path,
+                    'links': [(job, audio_file_path, file_name)],
+                }
+                in_flight[video_id] = entry
+                conversions.append(entry)
                 
             except Exception as e:
+                metrics.fail('descarga', job, e)
                 logging.error(f"Error al procesar {song_name}: {str(e)}")
         
+        # Recoger las conversiones y enlazar cada canción en la carpeta de la playlist
+        for entry in conversions:
+            job, _, file_name = entry['links'][0]
+            try:
+                conversion = entry['future'].result()
+                metrics.record('conversion', conversion['seconds'], job)
+                os.remove(entry['source_path'])
+            except Exception as e:
+                for job, _, file_name in entry['links']:
+                    metrics.fail('conversion', job, e)
+                    logging.error(f"Error al convertir {file_name}: {str(e)}")
+                continue
+            if entry['tagging'] is not None:
+                try:
+                    tagged = entry['tagging'].result()
+                    metrics.record('etiquetas', tagged['seconds'], job)
+                except Exception as e:
+                    # La canción se conserva sin etiquetas
+                    logging.error(f"No se pudieron escribir las etiquetas de {file_name}: {str(e)}")
+            
+            # La canción que lo descargó recibe un enlace; las demás que llevan a este
+            # video, el mismo archivo o una copia con las etiquetas de su canción
+            for index, (job, audio_file_path, file_name) in enumerate(entry['links']):
+                try:
+                    if index == 0:
+                        store.link(entry['video_id'], audio_file_path)
+                    else:
+                        place_track(tagger, store, entry['video_id'], job, audio_file_path, metrics)
+                    
+                    # Verificar archivo convertido
+                    if os.path.getsize(audio_file_path) > 1024:
+                        logging.info(f"✅ Descargado exitosamente: {file_name} ({conversion['mode']})")
+                    else:
+                        logging.error(f"❌ Error: Archivo demasiado pequeño: {file_name}")
+                except Exception as e:
+                    metrics.fail('conversion', job, e)
+                    logging.error(f"Error al colocar {file_name}: {str(e)}")
+        
+        logging.info(f"Peticiones: {default_scheduler().summary()}")
+        if tagger.active:
+            logging.info(f"Etiquetas: {art_cache.summary()}")
         logging.info(f"Proceso completado. Las canciones se guardaron en: {download_dir}")
         return True
         
     except Exception as e:
         logging.error(f"Error general: {str(e)}")
         return False
+    finally:
+        transcoder.shutdown()
+        tagger.shutdown()
+        match_cache.save()
+        stream_cache.save()
+        # Sin informe si no se llegó a procesar ninguna canción
+        if env_bool('RUN_REPORT', True) and metrics.track_count:
+            metrics.finish(playlist_url=playlist_url, requests=default_scheduler().stats())
+            logging.info(f"Informe de la ejecución: {metrics.write()}")
 
 if __name__ == "__main__":
     # URL de ejemplo de la playlist
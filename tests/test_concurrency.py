@@ -0,0 +1,120 @@
+import pytest
+
+import concurrency
+from concurrency import AIMDController, download_controller
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(concurrency, 'time', fake)
+    return fake
+
+
+def make_controller(initial=4, **kwargs):
+    options = dict(minimum=1, maximum=16, interval=1, max_error_rate=0.1)
+    options.update(kwargs)
+    return AIMDController('prueba', initial, **options)
+
+
+def run_window(controller, clock, nbytes, in_flight=None, errors=0, throttled=0, requests=10):
+    """Simular una ventana: `in_flight` operaciones a la vez, `requests` terminadas y `nbytes` recibidos."""
+    in_flight = controller.limit if in_flight is None else in_flight
+    for _ in range(in_flight):
+        assert controller.acquire()
+    for _ in range(requests - errors):
+        controller.record(0.1, nbytes // requests)
+    for _ in range(errors):
+        controller.record(error=True)
+    for _ in range(throttled):
+        controller.scheduler_error(throttled=True, retried=True)
+    clock.now += controller.interval
+    for _ in range(in_flight):
+        controller.release()
+    # La primera anotación tras cerrar la ventana la evalúa
+    controller.transferred(0)
+    return controller.history[-1]
+
+
+def decisions(controller):
+    return [(entry['decision'], entry['limit']) for entry in controller.history]
+
+
+def test_additive_increase_while_throughput_grows(clock):
+    controller = make_controller(initial=4)
+    for nbytes in (1000, 2000, 3000):
+        run_window(controller, clock, nbytes)
+    assert decisions(controller) == [('aumento', 5), ('aumento', 6), ('aumento', 7)]
+
+
+def test_no_increase_when_limit_is_not_used(clock):
+    controller = make_controller(initial=4)
+    run_window(controller, clock, 1000, in_flight=2)
+    assert decisions(controller) == [('igual', 4)]
+
+
+def test_halves_on_429(clock):
+    controller = make_controller(initial=8)
+    run_window(controller, clock, 1000, throttled=1)
+    assert decisions(controller) == [('congestion', 4)]
+    assert controller.history[-1]['throttled'] == 1
+
+
+def test_halves_on_error_spike(clock):
+    controller = make_controller(initial=8)
+    run_window(controller, clock, 1000, errors=5)
+    assert decisions(controller) == [('congestion', 4)]
+
+
+def test_steady_error_rate_does_not_keep_halving(clock):
+    # Un servidor que siempre corta el 20 % de las conexiones no es congestión
+    controller = make_controller(initial=8)
+    run_window(controller, clock, 1000, errors=2)
+    for nbytes in (2000, 3000):
+        run_window(controller, clock, nbytes, errors=2)
+    assert decisions(controller) == [('congestion', 4), ('aumento', 5), ('aumento', 6)]
+
+
+def test_undoes_increase_when_throughput_drops(clock):
+    controller = make_controller(initial=4)
+    run_window(controller, clock, 2000)
+    run_window(controller, clock, 1000)
+    assert decisions(controller) == [('aumento', 5), ('retroceso', 4)]
+
+
+def test_stops_increasing_when_throughput_stalls(clock):
+    controller = make_controller(initial=4)
+    run_window(controller, clock, 2000)
+    run_window(controller, clock, 2020)
+    assert decisions(controller) == [('aumento', 5), ('igual', 5)]
+
+
+def test_limit_stays_within_bounds(clock):
+    controller = make_controller(initial=2, minimum=2, maximum=3)
+    for nbytes in (1000, 2000, 3000):
+        run_window(controller, clock, nbytes)
+    assert controller.limit == 3
+    run_window(controller, clock, 3000, throttled=1)
+    assert controller.limit == 2
+
+
+def test_download_controller_ceiling(monkeypatch):
+    monkeypatch.setenv('DOWNLOAD_WORKERS_MAX', '16')
+    controller = download_controller(2, ceiling=2)
+    assert (controller.limit, controller.maximum) == (2, 2)
+
+
+def test_fixed_limit_without_adaptive_concurrency(monkeypatch, clock):
+    monkeypatch.setenv('ADAPTIVE_CONCURRENCY', '0')
+    controller = download_controller(3)
+    assert controller.minimum == controller.maximum == 3
+    run_window(controller, clock, 1000, throttled=1)
+    assert controller.limit == 3
@@ -0,0 +1,136 @@
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+import http_download
+from http_download import CHUNK_SIZE, download_resumable
+
+CONTENT = bytes(range(256)) * 1200  # 300 KiB
+
+
+class ScriptedHandler(http.server.BaseHTTPRequestHandler):
+    """Responde según el guion del servidor: una acción por petición."""
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get('Range'))
+        action = self.server.script.pop(0) if self.server.script else 'range'
+        start = 0
+        if action == 'range' and self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+        if action == '416':
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(CONTENT)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = CONTENT[start:]
+        if start:
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}')
+        else:
+            # 'full' (o 'range' sin Range): el recurso entero, aunque se pidiera un rango
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if action.startswith('drop:'):
+            # Cortar la conexión a mitad del cuerpo (en un límite de bloque, para saber dónde se reanuda)
+            self.wfile.write(body[:int(action.split(':')[1])])
+            self.wfile.flush()
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # Sin esperas entre reintentos
+    monkeypatch.setattr(http_download.time, 'sleep', lambda seconds: None)
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ScriptedHandler)
+    httpd.script = []
+    httpd.ranges = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}/audio'
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_resumes_after_drop_and_restarts_when_range_is_ignored(server, tmp_path):
+    part = str(tmp_path / 'audio.part')
+    final = str(tmp_path / 'audio.webm')
+    # Corte tras el primer bloque; el reintento ignora el Range (200, se empieza de cero)
+    # y se corta tras dos bloques; el último continúa desde ahí con un 206
+    server.script = [f'drop:{CHUNK_SIZE}', f'drop:{2 * CHUNK_SIZE}', 'range']
+    retries = []
+
+    size, sha256 = download_resumable(server.url, part, final_path=final, on_retry=retries.append)
+
+    assert read(final) == CONTENT
+    assert size == len(CONTENT)
+    assert sha256 == hashlib.sha256(CONTENT).hexdigest()
+    assert not os.path.exists(part)
+    assert server.ranges == [None, f'bytes={CHUNK_SIZE}-', f'bytes={2 * CHUNK_SIZE}-']
+    assert len(retries) == 2
+
+
+def test_416_on_complete_part_finishes_without_downloading(server, tmp_path):
+    part = tmp_path / 'audio.part'
+    part.write_bytes(CONTENT)
+    final = str(tmp_path / 'audio.webm')
+    server.script = ['416']
+
+    size, sha256 = download_resumable(server.url, str(part), final_path=final)
+
+    assert read(final) == CONTENT
+    assert (size, sha256) == (len(CONTENT), hashlib.sha256(CONTENT).hexdigest())
+    assert not part.exists()
+    assert server.ranges == [f'bytes={len(CONTENT)}-']
+
+
+def test_resumes_existing_part_with_range(server, tmp_path):
+    part = tmp_path / 'audio.part'
+    part.write_bytes(CONTENT[:50000])
+
+    size, sha256 = download_resumable(server.url, str(part), expected_size=len(CONTENT))
+
+    # Sin final_path el resultado queda en el .part
+    assert read(part) == CONTENT
+    assert sha256 == hashlib.sha256(CONTENT).hexdigest()
+    assert server.ranges == ['bytes=50000-']
+
+
+def test_without_digest_the_part_is_not_reread(server, tmp_path, monkeypatch):
+    part = tmp_path / 'audio.part'
+    part.write_bytes(CONTENT[:50000])
+    monkeypatch.setattr(http_download, 'update_digest_from_file', pytest.fail)
+
+    size, sha256 = download_resumable(server.url, str(part), digest=False, durable=False)
+
+    assert (size, sha256) == (len(CONTENT), None)
+    assert read(part) == CONTENT
+
+
+def test_cancel_keeps_part_for_later(server, tmp_path):
+    part = tmp_path / 'audio.part'
+    received = []
+
+    result = download_resumable(
+        server.url, str(part), on_progress=lambda done, total: received.append(done),
+        is_running=lambda: len(received) < 2
+    )
+
+    assert result is None
+    assert part.exists() and 0 < part.stat().st_size < len(CONTENT)
+    assert read(part) == CONTENT[:part.stat().st_size]
@@ -0,0 +1,137 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rate_limit import CircuitBreaker, CircuitOpenError, RequestScheduler
+
+
+class ServiceError(Exception):
+    status = 503
+
+
+class FlakyService:
+    """Servicio que responde 503 hasta `down_until` y después funciona."""
+
+    def __init__(self, outage):
+        self.down_until = time.monotonic() + outage
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        with self._lock:
+            self.calls += 1
+        if time.monotonic() < self.down_until:
+            raise ServiceError('503 Service Unavailable')
+        return value
+
+
+def make_scheduler(**kwargs):
+    options = dict(
+        limits={'svc': (1000, 1000)}, max_retries=1, base_delay=0.01, max_delay=0.05,
+        breaker_threshold=3, breaker_reset=0.3
+    )
+    options.update(kwargs)
+    return RequestScheduler(**options)
+
+
+def test_short_outage_does_not_fail_queued_calls():
+    scheduler = make_scheduler()
+    service = FlakyService(outage=0.5)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: scheduler.call('svc', service, i), range(40)))
+    assert results == list(range(40))
+    assert scheduler.stats()['svc']['breaker'] == 'cerrado'
+
+
+def test_short_outage_async():
+    import asyncio
+
+    scheduler = make_scheduler()
+    service = FlakyService(outage=0.5)
+
+    async def call(i):
+        async def request():
+            return service(i)
+        return await scheduler.acall('svc', request)
+
+    async def main():
+        return await asyncio.gather(*(call(i) for i in range(20)))
+
+    assert asyncio.run(main()) == list(range(20))
+
+
+def test_open_breaker_waits_instead_of_failing():
+    scheduler = make_scheduler()
+    breaker = scheduler.service('svc').breaker
+    for _ in range(3):
+        breaker.record_failure()
+    started = time.monotonic()
+    assert scheduler.call('svc', lambda: 'ok') == 'ok'
+    # Esperó a que se pudiera probar el servicio, no más
+    assert 0.25 <= time.monotonic() - started < 1.5
+
+
+def test_failed_probe_does_not_spend_the_last_retry():
+    # Sin reintentos: solo la espera al cortacircuitos separa el fallo del éxito
+    scheduler = make_scheduler(max_retries=0, breaker_threshold=1, breaker_reset=0.1, breaker_wait=2)
+    service = FlakyService(outage=0.35)
+    assert scheduler.call('svc', service, 'ok') == 'ok'
+    assert service.calls >= 3
+
+
+def test_long_outage_gives_up_after_breaker_wait():
+    scheduler = make_scheduler(breaker_wait=0.5)
+    service = FlakyService(outage=60)
+    started = time.monotonic()
+    with pytest.raises((CircuitOpenError, ServiceError)):
+        for _ in range(5):
+            scheduler.call('svc', service, 1)
+    assert time.monotonic() - started < 5
+
+
+def test_keep_waiting_stops_the_wait():
+    scheduler = make_scheduler(breaker_reset=30)
+    breaker = scheduler.service('svc').breaker
+    for _ in range(3):
+        breaker.record_failure()
+    started = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        scheduler.call('svc', lambda: 'ok', keep_waiting=lambda: time.monotonic() - started < 0.3)
+    assert time.monotonic() - started < 2
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_scoped_stats_count_only_their_own_calls():
+    scheduler = make_scheduler()
+    first, second = scheduler.scoped(), scheduler.scoped()
+
+    def throttled():
+        error = ServiceError('429 Too Many Requests')
+        error.status = 429
+        raise error
+
+    for i in range(3):
+        first.call('svc', lambda: i)
+    second.call('svc', lambda: 'ok')
+    with pytest.raises(ServiceError):
+        second.call('svc', throttled)
+
+    assert first.stats()['svc']['calls'] == 3
+    assert first.stats()['svc']['throttled'] == 0
+    assert second.stats()['svc']['calls'] == 3
+    assert second.stats()['svc']['throttled'] == 2
+    assert second.stats()['svc']['retries'] == 1
+    # El planificador común sigue contando todas
+    assert scheduler.stats()['svc']['calls'] == 6
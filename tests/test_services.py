@@ -0,0 +1,54 @@
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services import Services
+
+
+@pytest.fixture
+def slow_ytmusic(monkeypatch):
+    """YTMusic que tarda en crearse, como la petición de red del constructor real."""
+    created = []
+    release = threading.Event()
+
+    class YTMusic:
+        def __init__(self):
+            created.append(self)
+            release.wait(5)
+
+    monkeypatch.setitem(sys.modules, 'ytmusicapi', types.SimpleNamespace(YTMusic=YTMusic))
+    yield created, release
+    release.set()
+
+
+def test_creating_ytmusic_does_not_block_other_resources(tmp_path, slow_ytmusic):
+    created, release = slow_ytmusic
+    services = Services(token_cache_path=str(tmp_path / 'token.json'))
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(services.ytmusic)
+        while not created:
+            time.sleep(0.01)
+        started = time.monotonic()
+        session = services.http_session()
+        assert time.monotonic() - started < 1
+        assert not pending.done()
+        release.set()
+        assert pending.result(timeout=5) is created[0]
+    assert services.http_session() is session
+    services.close()
+
+
+def test_concurrent_callers_share_one_client(tmp_path, slow_ytmusic):
+    created, release = slow_ytmusic
+    services = Services(token_cache_path=str(tmp_path / 'token.json'))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(services.ytmusic) for _ in range(8)]
+        time.sleep(0.1)
+        release.set()
+        clients = {id(f.result(timeout=5)) for f in futures}
+    assert len(created) == 1
+    assert clients == {id(created[0])}
@@ -0,0 +1,18 @@
+import os
+import stat
+
+from storage import FILE_MODE, load_json, save_json
+
+
+def test_save_json_round_trip(tmp_path):
+    path = str(tmp_path / 'sub' / 'data.json')
+    save_json(path, {'canción': [1, 2]})
+    assert load_json(path) == {'canción': [1, 2]}
+    # No quedan temporales junto al archivo
+    assert os.listdir(tmp_path / 'sub') == ['data.json']
+
+
+def test_save_json_uses_umask_permissions(tmp_path):
+    path = str(tmp_path / 'data.json')
+    save_json(path, {})
+    assert stat.S_IMODE(os.stat(path).st_mode) == FILE_MODE
@@ -0,0 +1,158 @@
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from http_download import fsync_file
+from manifest import file_sha256
+from settings import env_bool, env_int
+
+# Formatos de salida: extensión, códec de audio, codificador y contenedor de ffmpeg
+FORMATS = {
+    'mp3': {'extension': 'mp3', 'codec': 'mp3', 'encoder': 'libmp3lame', 'muxer': 'mp3'},
+    'm4a': {'extension': 'm4a', 'codec': 'aac', 'encoder': 'aac', 'muxer': 'ipod'},
+    'opus': {'extension': 'opus', 'codec': 'opus', 'encoder': 'libopus', 'muxer': 'ogg'},
+}
+
+# Contenedor original según el tipo MIME del stream de YouTube
+SOURCE_EXTENSIONS = {'audio/webm': 'webm', 'audio/mp4': 'm4a'}
+
+MIN_BITRATE = 64
+
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+
+def normalize_codec(codec):
+    """Reducir los nombres de códec de pytube/yt-dlp ('mp4a.40.2', 'opus'...) al de ffmpeg."""
+    if not codec:
+        return None
+    codec = codec.lower()
+    if codec.startswith('mp4a'):
+        return 'aac'
+    return codec.split('.')[0]
+
+
+def parse_bitrate(value):
+    """Convertir '160kbps' (pytube) o 129.5 (yt-dlp) a kbps enteros."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.search(r'(\d+)', str(value))
+    return int(match.group(1)) if match else None
+
+
+def select_bitrate(target, source=None):
+    """No codificar por encima de la calidad del original: solo ocuparía más espacio."""
+    if source:
+        return max(MIN_BITRATE, min(target, source))
+    return target
+
+
+def probe_codec(path):
+    """Leer el códec de audio de un archivo con ffprobe, o None si no se puede."""
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+             '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', path],
+            capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def transcode_file(source, destination, fmt='mp3', bitrate=192, source_codec=None, passthrough=True, final=True):
+    """Convertir `source` al formato `fmt` y escribirlo en `destination` de forma atómica.
+
+    Si el códec del original ya es el del formato de destino y `passthrough`
+    está activado, solo se cambia de contenedor (sin recodificar). Devuelve un
+    diccionario con `mode` (`'copy'` o `'encode'`), `size` y `sha256` del
+    archivo resultante, calculados aquí para no releerlo en el proceso principal,
+    y `seconds`, el tiempo de conversión sin contar la espera en la cola del pool.
+    Con `final=False` el resultado es intermedio (lo publica la etapa de
+    etiquetas, que hace el fsync y el hash del archivo definitivo): no se
+    calculan aquí y `sha256` es None.
+
+    Es una función de módulo para poder ejecutarla en el pool de procesos.
+    """
+    target = FORMATS[fmt]
+    source_codec = normalize_codec(source_codec) or probe_codec(source)
+    mode = 'copy' if passthrough and source_codec == target['codec'] else 'encode'
+    start = time.monotonic()
+
+    command = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', '-i', source, '-vn']
+    if mode == 'copy':
+        command += ['-c:a', 'copy']
+    else:
+        command += ['-c:a', target['encoder'], '-b:a', f'{bitrate}k']
+    # El temporal termina en .part, así que el contenedor se indica explícitamente
+    temp_path = destination + '.part'
+    command += ['-f', target['muxer'], temp_path]
+
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        error = result.stderr.strip().splitlines()
+        raise Exception(f"ffmpeg no pudo convertir el audio: {error[-1] if error else result.returncode}")
+
+    sha256 = None
+    if final:
+        sha256 = file_sha256(temp_path)
+        fsync_file(temp_path)
+    os.replace(temp_path, destination)
+    return {
+        'mode': mode,
+        'size': os.path.getsize(destination),
+        'sha256': sha256,
+        'seconds': time.monotonic() - start,
+    }
+
+
+class Transcoder:
+    """Etapa de conversión de audio en un pool de procesos, separada de las descargas.
+
+    Los hilos de descarga entregan el archivo original y siguen con la
+    siguiente canción; la conversión (y la elección de bitrate) se hace en
+    paralelo en tantos procesos como núcleos haya.
+    """
+
+    def __init__(self, fmt=None, bitrate=None, workers=None, passthrough=None):
+        self.format = (fmt or os.getenv('AUDIO_FORMAT') or 'mp3').strip().lower()
+        if self.format not in FORMATS:
+            raise ValueError(f"Formato de audio no válido: {self.format} (usa {', '.join(FORMATS)})")
+        self.bitrate = bitrate or env_int('AUDIO_BITRATE', 192)
+        self.workers = workers or env_int('TRANSCODE_WORKERS', os.cpu_count() or 1)
+        self.passthrough = env_bool('TRANSCODE_PASSTHROUGH', True) if passthrough is None else passthrough
+        self._pool = None
+
+    @property
+    def extension(self):
+        return FORMATS[self.format]['extension']
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn: no heredar los hilos ni el estado de Qt/asyncio del proceso principal
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._pool
+
+    def submit(self, source, destination, source_codec=None, source_bitrate=None, final=True):
+        """Encolar la conversión y devolver un Future con el resultado de `transcode_file`."""
+        bitrate = select_bitrate(self.bitrate, parse_bitrate(source_bitrate))
+        return self._get_pool().submit(
+            transcode_file, source, destination, self.format, bitrate, source_codec, self.passthrough, final
+        )
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=not wait)
+            self._pool = None